@@ -0,0 +1,334 @@
+# Распределение капитала между отобранными активами: линейные веса
+# по месту в рейтинге, mean-variance и равный вклад в риск (risk parity)
+#
+# Распределитель — объект с методом weights(chosen, lower, upper),
+# который по метрикам отобранных активов (в порядке убывания рейтинга)
+# возвращает доли капитала в границах [lower, upper] с суммой 1
+import numpy as np
+
+from candle_store import DAY_MS, CandleStore, price_matrix
+from metrics import STOCK
+
+# Глубина истории дневных доходностей для ковариации (в днях)
+COVARIANCE_DAYS = 90
+# Доля сжатия выборочной ковариации к диагональной матрице
+SHRINKAGE = 0.1
+# Неприятие риска в mean-variance (доходность и риск в годовом выражении)
+RISK_AVERSION = 5.0
+DAYS_PER_YEAR = 365
+# Точность и предельное число итераций решателей
+TOLERANCE = 1e-8
+MAX_ITERATIONS = 1000
+
+
+def capacity(count, lower):
+    """
+    :param count: Число отобранных активов
+    :param lower: Минимальная доля одного актива
+    :return: Сколько лучших активов можно купить, не нарушая
+        минимальной доли
+    """
+    if lower <= 0:
+        return count
+    return min(count, int(1 / lower + 1e-9))
+
+
+def bounded_weights(values, lower, upper):
+    """
+    Ближайшие к values доли w = clip(values - tau, lower, upper)
+    с суммой 1. Сумма кусочно-линейна и убывает по tau, поэтому tau
+    находится точно по точкам излома за O(n log n) без итераций.
+    Если границы не позволяют распределить весь капитал
+    (upper * n < 1), все активы получают upper. Если среди values есть
+    NaN или бесконечность, вместо них берутся линейные веса по месту
+    в рейтинге, как в rank_weights
+    :param values: Желаемые доли
+    :param lower: Минимальная доля одного актива
+    :param upper: Максимальная доля одного актива
+    :return: Доли активов
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if not count or upper * count <= 1:
+        return np.full(count, upper)
+    if lower * count >= 1:
+        return np.full(count, 1 / count)
+    if not np.isfinite(values).all():
+        # Одна битая свеча не должна ронять весь расчет портфелей
+        values = np.arange(count, 0, -1, dtype=np.float64)
+        values /= values.sum()
+
+    # Точки излома: tau = v - upper (актив отходит от верхней границы)
+    # и tau = v - lower (актив доходит до нижней). В каждой точке
+    # считаем число активов на границах и сумму остальных по префиксным
+    # суммам отсортированных values
+    ordered = np.sort(values)
+    prefix = np.concatenate([[0.0], np.cumsum(ordered)])
+    index = np.arange(count)
+    gap = upper - lower
+
+    upper_tau = ordered - upper
+    below = np.searchsorted(ordered, ordered - gap, "right")
+    at_upper = (below * lower + (count - index) * upper +
+                prefix[index] - prefix[below] -
+                (index - below) * upper_tau)
+
+    lower_tau = ordered - lower
+    above = np.searchsorted(ordered, ordered + gap, "left")
+    at_lower = ((index + 1) * lower + (count - above) * upper +
+                prefix[above] - prefix[index + 1] -
+                (above - index - 1) * lower_tau)
+
+    # Сумма убывает по tau: ищем соседние точки излома по обе стороны
+    # от 1, между ними сумма линейна
+    taus = np.concatenate([upper_tau, lower_tau])
+    totals = np.concatenate([at_upper, at_lower])
+    left = np.flatnonzero(totals >= 1)
+    right = np.flatnonzero(totals < 1)
+    first = left[np.argmax(taus[left])]
+    second = right[np.argmin(taus[right])]
+    span = totals[first] - totals[second]
+    tau = taus[first] + (totals[first] - 1) / span * (taus[second] -
+                                                      taus[first])
+    return np.clip(values - tau, lower, upper)
+
+
+def rank_weights(count, lower, upper):
+    """
+    Вес актива линейно убывает с его местом в рейтинге; доли
+    приводятся к границам с сохранением суммы 1. Активы сверх
+    capacity(count, lower) получают 0
+    :param count: Число отобранных активов
+    :param lower: Минимальная доля одного актива
+    :param upper: Максимальная доля одного актива
+    :return: Массив долей в порядке убывания рейтинга
+    """
+    size = capacity(count, lower)
+    weight = np.arange(size, 0, -1, dtype=np.float64)
+    weights = np.zeros(count)
+    if size:
+        weights[:size] = bounded_weights(weight / weight.sum(), lower, upper)
+    return weights
+
+
+def spectral_norm(matrix, iterations=30):
+    """
+    :param matrix: Симметричная неотрицательно определенная матрица
+    :param iterations: Число шагов степенного метода
+    :return: Оценка наибольшего собственного значения сверху
+    """
+    vector = np.ones(len(matrix))
+    value = 0.0
+    for _ in range(iterations):
+        product = matrix @ vector
+        value = np.linalg.norm(product)
+        if value == 0:
+            return 0.0
+        vector = product / value
+    # Степенной метод сходится снизу: берем с запасом
+    return value * 1.1
+
+
+def mean_variance(mean, covariance, lower, upper,
+                  risk_aversion=RISK_AVERSION):
+    """
+    Максимизирует mean @ w - risk_aversion / 2 * w @ covariance @ w
+    при границах долей ускоренным проективным градиентом (FISTA).
+    Шаг итерации — одно умножение матрицы на вектор и проекция
+    bounded_weights, поэтому сотни активов решаются за миллисекунды
+    :param mean: Ожидаемые доходности активов
+    :param covariance: Ковариационная матрица доходностей
+    :param lower: Минимальная доля одного актива
+    :param upper: Максимальная доля одного актива
+    :param risk_aversion: Неприятие риска
+    :return: Доли активов
+    """
+    count = len(mean)
+    weights = bounded_weights(np.full(count, 1 / count) if count else mean,
+                              lower, upper)
+    lipschitz = risk_aversion * spectral_norm(covariance)
+    if not count or upper * count <= 1 or lipschitz == 0:
+        return weights
+    point, momentum = weights, 1.0
+    for _ in range(MAX_ITERATIONS):
+        gradient = risk_aversion * (covariance @ point) - mean
+        updated = bounded_weights(point - gradient / lipschitz, lower, upper)
+        if np.abs(updated - weights).max() < TOLERANCE:
+            return updated
+        following = (1 + np.sqrt(1 + 4 * momentum ** 2)) / 2
+        point = updated + (momentum - 1) / following * (updated - weights)
+        weights, momentum = updated, following
+    return weights
+
+
+def risk_parity(covariance, lower, upper):
+    """
+    Доли с равным вкладом активов в риск портфеля: w_i * (covariance @ w)_i
+    одинаковы. Это минимум выпуклой функции
+    x @ covariance @ x / 2 - sum(log(x)) / n, нормированный к сумме 1;
+    он находится демпфированным методом Ньютона за несколько шагов
+    при любой корреляции активов. Диагональ ковариации увеличивается
+    на TOLERANCE: актив с нулевой дисперсией не дает делить на ноль
+    и получает наибольшую, но конечную долю. Затем доли приводятся
+    к границам
+    :param covariance: Ковариационная матрица доходностей
+    :param lower: Минимальная доля одного актива
+    :param upper: Максимальная доля одного актива
+    :return: Доли активов
+    """
+    count = len(covariance)
+    if not count:
+        return np.zeros(0)
+    budget = 1 / count
+    covariance = covariance + TOLERANCE * np.eye(count)
+    # Начальное приближение — доли, обратные волатильности
+    weights = 1 / np.sqrt(np.diag(covariance))
+    weights /= np.sqrt(weights @ covariance @ weights)
+    for _ in range(MAX_ITERATIONS):
+        gradient = covariance @ weights - budget / weights
+        hessian = covariance + np.diag(budget / weights ** 2)
+        step = np.linalg.solve(hessian, gradient)
+        # Шаг 1 / (1 + декремент) не выводит доли из области x > 0
+        decrement = np.sqrt(gradient @ step)
+        weights -= step / (1 + decrement)
+        if decrement < TOLERANCE:
+            break
+    return bounded_weights(weights / weights.sum(), lower, upper)
+
+
+class RankAllocator:
+    """
+    Линейные веса по месту в рейтинге (rank_weights)
+    """
+
+    def weights(self, chosen, lower, upper):
+        """
+        :param chosen: Метрики отобранных активов Metrics
+        :param lower: Минимальная доля одного актива
+        :param upper: Максимальная доля одного актива
+        :return: Доли активов
+        """
+        return rank_weights(len(chosen), lower, upper)
+
+
+class CovarianceAllocator:
+    """
+    Основа распределителей по ковариации дневных доходностей
+    отобранных активов. Доходности считаются по свечам из хранилища
+    за последние days дней истории; ковариация сжимается к диагонали,
+    чтобы матрица была обратимой и при коротких рядах
+    """
+
+    def __init__(self, store=None, days=COVARIANCE_DAYS,
+                 shrinkage=SHRINKAGE):
+        """
+        :param store: Хранилище свечей CandleStore
+        :param days: Глубина истории доходностей (в днях)
+        :param shrinkage: Доля сжатия ковариации к диагонали
+        """
+        self.store = store if store is not None else CandleStore()
+        self.days = days
+        self.shrinkage = shrinkage
+        self._figi = None
+
+    def keys(self, chosen):
+        """
+        :param chosen: Метрики отобранных активов Metrics
+        :return: Ключи свечей: FIGI акций и instId криптовалютных пар
+        """
+        if self._figi is None and (chosen.asset_class == STOCK).any():
+            try:
+                shares = self.store.load_instruments("stocks")
+            except FileNotFoundError:
+                # Без справочника свечей акций нет: доходности нулевые
+                self._figi = {}
+            else:
+                self._figi = dict(zip(shares['ticker'][::-1],
+                                      shares['figi'][::-1]))
+        figi = self._figi or {}
+        return [figi.get(asset, asset) if code == STOCK else asset
+                for asset, code in zip(chosen.asset.tolist(),
+                                       chosen.asset_class.tolist())]
+
+    def returns(self, chosen):
+        """
+        :param chosen: Метрики отобранных активов Metrics
+        :return: Матрица дневных доходностей дни x активы; до первой
+            свечи актива и рядом с неположительной ценой доходность
+            равна 0
+        """
+        history = [self.store.load(key, "1D") for key in self.keys(chosen)]
+        last_day = max((int(candles['ts'][-1]) // DAY_MS
+                        for candles in history if len(candles)), default=0)
+        first_day = last_day - self.days
+        window = [candles[np.searchsorted(candles['ts'], first_day * DAY_MS):]
+                  for candles in history]
+        prices = price_matrix(window, first_day, self.days + 1)
+        # Неположительная или бесконечная цена — битая свеча,
+        # а не доходность
+        prices[~(np.isfinite(prices) & (prices > 0))] = np.nan
+        return np.nan_to_num(prices[1:] / prices[:-1] - 1,
+                             nan=0.0, posinf=0.0, neginf=0.0)
+
+    def moments(self, chosen):
+        """
+        :param chosen: Метрики отобранных активов Metrics
+        :return: Пара (средние доходности, ковариационная матрица)
+            в годовом выражении
+        """
+        returns = self.returns(chosen)
+        mean = returns.mean(axis=0) * DAYS_PER_YEAR
+        centered = returns - returns.mean(axis=0)
+        sample = centered.T @ centered / max(len(returns) - 1, 1)
+        target = np.diag(sample).mean() or TOLERANCE
+        covariance = ((1 - self.shrinkage) * sample +
+                      self.shrinkage * target * np.eye(len(sample)))
+        return mean, covariance * DAYS_PER_YEAR
+
+
+class MeanVarianceAllocator(CovarianceAllocator):
+    """
+    Доли, максимизирующие доходность за вычетом штрафа за риск
+    (mean_variance)
+    """
+
+    def __init__(self, store=None, risk_aversion=RISK_AVERSION, **kwargs):
+        """
+        :param store: Хранилище свечей CandleStore
+        :param risk_aversion: Неприятие риска
+        :param kwargs: Параметры CovarianceAllocator (days, shrinkage)
+        """
+        super().__init__(store, **kwargs)
+        self.risk_aversion = risk_aversion
+
+    def weights(self, chosen, lower, upper):
+        mean, covariance = self.moments(chosen)
+        return mean_variance(mean, covariance, lower, upper,
+                             self.risk_aversion)
+
+
+class RiskParityAllocator(CovarianceAllocator):
+    """
+    Доли с равным вкладом активов в риск портфеля (risk_parity)
+    """
+
+    def weights(self, chosen, lower, upper):
+        return risk_parity(self.moments(chosen)[1], lower, upper)
+
+
+ALLOCATORS = {
+    "rank": RankAllocator,
+    "mean_variance": MeanVarianceAllocator,
+    "risk_parity": RiskParityAllocator,
+}
+
+
+def make_allocator(name, store=None):
+    """
+    :param name: Имя распределителя из ALLOCATORS
+    :param store: Хранилище свечей для распределителей по ковариации
+    :return: Распределитель
+    """
+    if name == "rank":
+        return RankAllocator()
+    return ALLOCATORS[name](store)
@@ -0,0 +1,386 @@
+# Бэктест рейтинговой стратегии на сохраненных дневных свечах
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from candle_store import DAY_MS, CandleStore, price_matrix
+from metrics import CRYPTO, STOCK
+from portfolio import (COMMISSION, MAX_ASSETS, MAX_PERCENTAGE, MIN_LIQUIDITY,
+                       MIN_PERCENTAGE, rank_percentages, select_assets)
+from scoring import (CRYPTO_WEIGHTS, STOCK_WEIGHTS, candle_stats,
+                     crypto_components, stock_components)
+
+# Общий набор компонент рейтинга для акций и криптовалют
+COMPONENTS = ("pe", "pb", "nvt", "pv", "returns", "liquidity", "volatility")
+# Окно расчета рейтинга и период ребалансировки (в днях)
+LOOKBACK_DAYS = 60
+REBALANCE_DAYS = 30
+RESULTS_FILE = "backtest_results.csv"
+
+
+@dataclass
+class BacktestData:
+    """
+    Подготовленные для бэктеста массивы: цены закрытия по дням
+    (с переносом последней цены на дни без торгов), оценки компонент
+    рейтинга и ликвидность на каждую дату ребалансировки
+    """
+    prices: np.ndarray  # дни x активы
+    rebalance: np.ndarray  # номера дней ребалансировки
+    components: np.ndarray  # ребалансировки x активы x COMPONENTS
+    liquidity: np.ndarray  # ребалансировки x активы
+    asset_class: np.ndarray  # STOCK или CRYPTO для каждого актива
+
+
+def load_history(store, keys):
+    """
+    :param store: Хранилище свечей CandleStore
+    :param keys: FIGI акций или instId криптовалютных пар
+    :return: Список массивов свечей (в памяти, а не memory-map)
+    """
+    return [np.array(store.load(key, "1D")) for key in keys]
+
+
+def window_table(history, keys, start, end):
+    """
+    :param history: Список массивов свечей по активам
+    :param keys: Ключи активов
+    :param start: Начало окна (мс)
+    :param end: Конец окна, не включительно (мс)
+    :return: Таблица свечей в формате scoring.candle_table
+    """
+    arrays = [candles[np.searchsorted(candles['ts'], start):
+                      np.searchsorted(candles['ts'], end)]
+              for candles in history]
+    lengths = [len(array) for array in arrays]
+    candles = (np.concatenate(arrays) if arrays
+               else np.empty(0, dtype=[('ts', 'i8'), ('close', 'f8'),
+                                       ('volume', 'f8')]))
+    return pd.DataFrame({
+        "asset": pd.Categorical.from_codes(
+            np.repeat(np.arange(len(keys)), lengths),
+            categories=pd.Index(keys, dtype=object)),
+        "ts": candles['ts'],
+        "close": candles['close'],
+        "volume": candles['volume']
+    })
+
+
+def prepare(store, shares, pairs, lookback=LOOKBACK_DAYS,
+            rebalance_days=REBALANCE_DAYS):
+    """
+    Пересчитывает оценки компонент рейтинга на каждую дату ребалансировки
+    по окну из lookback дней. Оценки не зависят от весов, поэтому
+    перебор весов сводится к умножению матриц
+    :param store: Хранилище свечей CandleStore
+    :param shares: DataFrame акций (см. stocks.shares_table)
+    :param pairs: DataFrame криптовалютных пар (см. crypto.collect_crypto)
+    :param lookback: Окно расчета рейтинга (в днях)
+    :param rebalance_days: Период ребалансировки (в днях)
+    :return: BacktestData
+    """
+    stock_keys = list(shares['figi'])
+    crypto_keys = list(pairs['instId'])
+    stock_history = load_history(store, stock_keys)
+    crypto_history = load_history(store, crypto_keys)
+    history = stock_history + crypto_history
+
+    timestamps = [candles['ts'] for candles in history if len(candles)]
+    if not timestamps:
+        raise ValueError("В хранилище нет свечей для бэктеста")
+    first_day = min(int(ts[0]) for ts in timestamps) // DAY_MS
+    last_day = max(int(ts[-1]) for ts in timestamps) // DAY_MS
+    days = last_day - first_day + 1
+    if days <= lookback:
+        raise ValueError(f"Истории ({days} дн.) не хватает "
+                         f"для окна {lookback} дн.")
+
+    prices = price_matrix(history, first_day, days)
+    rebalance = np.arange(lookback, days, rebalance_days)
+    components = np.zeros((len(rebalance), len(history), len(COMPONENTS)))
+    liquidity = np.full((len(rebalance), len(history)), np.nan)
+    stock_columns = [COMPONENTS.index(name) for name in STOCK_WEIGHTS]
+    crypto_columns = [COMPONENTS.index(name) for name in CRYPTO_WEIGHTS]
+    crypto_slice = slice(len(stock_keys), len(history))
+
+    for r, day in enumerate(rebalance):
+        end = (first_day + day + 1) * DAY_MS
+        start = end - lookback * DAY_MS
+
+        stocks = stock_components(
+            candle_stats(window_table(stock_history, stock_keys, start, end)),
+            shares)
+        components[r, :len(stock_keys), stock_columns] = stocks[
+            [f"{name}_score" for name in STOCK_WEIGHTS]].to_numpy().T
+        liquidity[r, :len(stock_keys)] = stocks['liquidity']
+
+        # Цена и суточный объем пары берутся из последней свечи окна
+        table = window_table(crypto_history, crypto_keys, start, end)
+        last = table.groupby('asset', observed=False).last()
+        crypto = crypto_components(candle_stats(table), pairs.assign(
+            last=last['close'].to_numpy(), vol24h=last['volume'].to_numpy()))
+        components[r, crypto_slice, crypto_columns] = crypto[
+            [f"{name}_score" for name in CRYPTO_WEIGHTS]].to_numpy().T
+        liquidity[r, crypto_slice] = crypto['liquidity']
+
+    # Активы, которые еще не торговались, в портфель не попадают
+    liquidity[np.isnan(prices[rebalance])] = np.nan
+    asset_class = np.array([STOCK] * len(stock_keys) +
+                           [CRYPTO] * len(crypto_keys), dtype=np.int8)
+    return BacktestData(prices=prices, rebalance=rebalance,
+                        components=np.nan_to_num(components),
+                        liquidity=liquidity, asset_class=asset_class)
+
+
+def run_backtest(data, stock_weights=None, crypto_weights=None,
+                 n=MAX_ASSETS, min_percentage=MIN_PERCENTAGE,
+                 max_percentage=MAX_PERCENTAGE,
+                 min_liquidity=MIN_LIQUIDITY):
+    """
+    Проигрывает стратегию: на каждой дате ребалансировки пересчитывает
+    рейтинги, отбирает n лучших активов и распределяет капитал
+    по правилам portfolio.rank_percentages. Комиссия берется
+    с оборота при ребалансировке
+    :param data: BacktestData
+    :param stock_weights: Веса компонент рейтинга акций
+    :param crypto_weights: Веса компонент рейтинга криптовалют
+    :param n: Ограничение на кол-во различных активов
+    :param min_percentage: Минимальный процент вложений в один актив
+    :param max_percentage: Максимальный процент вложений в один актив
+    :param min_liquidity: Минимальная ликвидность актива
+    :return: Словарь с доходностью, максимальной просадкой и оборотом
+    """
+    vectors = []
+    for weights in (stock_weights or STOCK_WEIGHTS,
+                    crypto_weights or CRYPTO_WEIGHTS):
+        vector = np.zeros(len(COMPONENTS))
+        for name, weight in weights.items():
+            vector[COMPONENTS.index(name)] = weight
+        vectors.append(vector)
+    is_stock = data.asset_class == STOCK
+
+    equity = 1.0
+    holdings = np.zeros(data.prices.shape[1])  # доли капитала по активам
+    curve = []
+    turnover = []
+    rebalance = list(data.rebalance) + [len(data.prices) - 1]
+
+    for r, (day, next_day) in enumerate(zip(rebalance, rebalance[1:])):
+        components = data.components[r]
+        rating = np.where(is_stock, components @ vectors[0],
+                          components @ vectors[1])
+        selected = select_assets(
+            SimpleNamespace(rating=rating, liquidity=data.liquidity[r],
+                            asset_class=data.asset_class),
+            n, min_liquidity)
+        target = np.zeros_like(holdings)
+        target[selected] = rank_percentages(len(selected), min_percentage,
+                                            max_percentage) / 100
+
+        traded = np.abs(target - holdings).sum()
+        turnover.append(traded)
+        equity *= 1 - traded * COMMISSION
+
+        # Стоимость портфеля по дням до следующей ребалансировки
+        prices = data.prices[day:next_day + 1, selected]
+        growth = prices / prices[0]
+        values = equity * ((1 - target.sum()) + growth @ target[selected])
+        curve.append(values if not curve else values[1:])
+        equity = values[-1]
+
+        # Доли активов, «уплывшие» вслед за ценами
+        holdings = np.zeros_like(holdings)
+        holdings[selected] = target[selected] * growth[-1] * (
+            values[0] / values[-1])
+
+    curve = np.concatenate(curve) if curve else np.ones(1)
+    drawdown = 1 - curve / np.maximum.accumulate(curve)
+    years = (len(curve) - 1) / 365
+    return {
+        "total_return": (curve[-1] - 1) * 100,
+        "annual_return": ((curve[-1] ** (1 / years) - 1) * 100
+                          if years > 0 else 0.0),
+        "max_drawdown": drawdown.max() * 100,
+        "turnover": float(np.mean(turnover)) * 100 if turnover else 0.0
+    }
+
+
+def weight_grid(names, step):
+    """
+    :param names: Названия компонент рейтинга
+    :param step: Шаг сетки весов
+    :return: Все наборы весов с шагом step, сумма которых равна 1
+    """
+    units = round(1 / step)
+    return [{name: count / units for name, count in zip(names, counts)}
+            for counts in itertools.product(range(units + 1),
+                                            repeat=len(names))
+            if sum(counts) == units]
+
+
+# Данные бэктеста в процессе-обработчике (view на общую память)
+_shared = None
+
+
+def _share(data):
+    """
+    Копирует массивы BacktestData в общую память
+    :param data: BacktestData
+    :return: Блоки общей памяти и описание массивов для обработчиков
+    """
+    blocks = []
+    specs = {}
+    for field in fields(data):
+        array = getattr(data, field.name)
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[field.name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs):
+    """
+    Подключает процесс-обработчик к общей памяти без копирования массивов
+    :param specs: Описание массивов из _share
+    """
+    global _shared
+    blocks = {name: shared_memory.SharedMemory(name=block_name)
+              for name, (block_name, _, _) in specs.items()}
+    data = BacktestData(**{
+        name: np.ndarray(shape, np.dtype(dtype), buffer=blocks[name].buf)
+        for name, (_, shape, dtype) in specs.items()
+    })
+    # Блоки храним вместе с данными, чтобы память не освободилась
+    _shared = (blocks, data)
+
+
+def _run_config(config):
+    return {**config, **run_backtest(_shared[1], **config)}
+
+
+def sweep(data, configs, workers=None, chunksize=16):
+    """
+    Прогоняет бэктест для множества конфигураций в пуле процессов.
+    Массивы цен и оценок передаются через общую память
+    :param data: BacktestData
+    :param configs: Список словарей с параметрами run_backtest
+    :param workers: Число процессов (по умолчанию по числу ядер)
+    :param chunksize: Сколько конфигураций отправлять процессу за раз
+    :return: Список результатов в порядке configs
+    """
+    blocks, specs = _share(data)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(specs,)) as pool:
+            return list(pool.map(_run_config, configs, chunksize=chunksize))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def format_weights(weights):
+    """
+    :param weights: Веса компонент рейтинга
+    :return: Строка вида pe=0.4 pb=0.3
+    """
+    return " ".join(f"{name}={weight:g}" for name, weight in weights.items())
+
+
+def save_results(results, path):
+    """
+    Сохраняет результаты перебора в CSV, лучшие по доходности первыми
+    :param results: Список результатов sweep
+    :param path: Путь к файлу
+    """
+    results = sorted(results, key=lambda row: row["total_return"],
+                     reverse=True)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["stock_weights", "crypto_weights", "n",
+                         "min_percentage", "max_percentage", "total_return",
+                         "annual_return", "max_drawdown", "turnover"])
+        for row in results:
+            writer.writerow([
+                format_weights(row["stock_weights"]),
+                format_weights(row["crypto_weights"]),
+                row["n"], row["min_percentage"], row["max_percentage"],
+                row["total_return"], row["annual_return"],
+                row["max_drawdown"], row["turnover"]
+            ])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Бэктест рейтинговой стратегии на сохраненных свечах")
+    parser.add_argument("--store", default="candles",
+                        help="директория хранилища свечей")
+    parser.add_argument("--lookback", type=int, default=LOOKBACK_DAYS,
+                        help="окно расчета рейтинга в днях")
+    parser.add_argument("--rebalance", type=int, default=REBALANCE_DAYS,
+                        help="период ребалансировки в днях")
+    parser.add_argument("--top-n", type=int, nargs="+",
+                        default=[MAX_ASSETS], help="варианты числа активов")
+    parser.add_argument("--min-pct", type=float, nargs="+",
+                        default=[MIN_PERCENTAGE],
+                        help="варианты минимальной доли актива (%%)")
+    parser.add_argument("--max-pct", type=float, nargs="+",
+                        default=[MAX_PERCENTAGE],
+                        help="варианты максимальной доли актива (%%)")
+    parser.add_argument("--weight-step", type=float,
+                        help="перебирать веса рейтинга по сетке с этим "
+                             "шагом (по умолчанию только текущие веса)")
+    parser.add_argument("--workers", type=int, help="число процессов")
+    parser.add_argument("--output", default=RESULTS_FILE,
+                        help="файл результатов (по умолчанию %(default)s)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = CandleStore(args.store)
+    data = prepare(store, store.load_instruments("stocks"),
+                   store.load_instruments("crypto"), args.lookback,
+                   args.rebalance)
+    print(f"Дней истории: {len(data.prices)}, активов: "
+          f"{data.prices.shape[1]}, ребалансировок: {len(data.rebalance)}")
+
+    if args.weight_step:
+        stock_grid = weight_grid(list(STOCK_WEIGHTS), args.weight_step)
+        crypto_grid = weight_grid(list(CRYPTO_WEIGHTS), args.weight_step)
+    else:
+        stock_grid, crypto_grid = [STOCK_WEIGHTS], [CRYPTO_WEIGHTS]
+
+    configs = [
+        {"stock_weights": stock_weights, "crypto_weights": crypto_weights,
+         "n": n, "min_percentage": min_percentage,
+         "max_percentage": max_percentage}
+        for stock_weights, crypto_weights, n, min_percentage, max_percentage
+        in itertools.product(stock_grid, crypto_grid, args.top_n,
+                             args.min_pct, args.max_pct)
+    ]
+    print(f"Конфигураций: {len(configs)}, процессов: "
+          f"{args.workers or os.cpu_count()}")
+
+    results = sweep(data, configs, args.workers)
+    save_results(results, args.output)
+
+    best = max(results, key=lambda row: row["total_return"])
+    print(f"Лучшая доходность: {best['total_return']:.2f}%, "
+          f"просадка {best['max_drawdown']:.2f}%, "
+          f"оборот {best['turnover']:.1f}% за ребалансировку")
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
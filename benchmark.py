@@ -0,0 +1,399 @@
+# Сквозной бенчмарк конвейера на синтетических данных
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from charts import ChartRenderer
+from crypto import crypto_pipeline, pairs_table
+from fundamentals import FundamentalsCache, base_asset, fetch_fundamentals
+from metrics import COLUMN_TYPES, MetricsStore, metrics_from_frame
+from portfolio import build_portfolio, save_portfolio
+from providers import ReplayProvider
+from scoring import score_universe
+from stocks import fetch_stock_candles, shares_table
+
+SIZES = (1_000, 10_000, 100_000)
+# Глубина синтетической истории: укладывается в окна расчета метрик
+HISTORY_DAYS = 100
+# Лимиты запросов не ограничивают бенчмарк: измеряется сам конвейер
+UNLIMITED_RATE = 1e9
+CONCURRENCY = 64
+RESULTS_FILE = "benchmark_results.json"
+# Замедление короче этого (в секундах) считается шумом при сравнении
+MIN_SLOWDOWN = 0.05
+# Доля монет, для которых CoinGecko знает фундаментальные данные
+KNOWN_COINS = 0.9
+
+
+def synthetic_fixture(root, size, days=HISTORY_DAYS, seed=0):
+    """
+    Создает записанные ответы провайдеров (формат ReplayProvider)
+    для синтетического рынка: половина акций, половина пар.
+    Свечи заканчиваются сегодняшним днем, поэтому при одном seed
+    метрики не зависят от даты запуска
+    :param root: Директория фикстур
+    :param size: Число инструментов
+    :param days: Глубина истории в днях
+    :param seed: Начальное значение генератора
+    """
+    rng = np.random.default_rng(seed)
+    stocks = size // 2
+    crypto = size - stocks
+    today = int(time.time() * 1000) // DAY_MS
+
+    shares = [{"figi": f"BBG{i:09d}", "ticker": f"S{i}",
+               "issue_size": int(rng.integers(10**5, 10**9)),
+               "nominal": float(rng.choice([0.01, 0.1, 1, 10]))}
+              for i in range(stocks)]
+    tickers = [{"instId": f"C{i}-USDT"} for i in range(crypto)]
+    coins = {f"c{i}": f"coin-{i}" for i in range(crypto)}
+    markets = {
+        f"coin-{i}": {
+            "transaction_volume_usd": float(rng.lognormal(14, 2)),
+            "circulating_supply": float(rng.lognormal(17, 2))
+        }
+        for i in range(crypto) if rng.random() < KNOWN_COINS
+    }
+
+    store = CandleStore(os.path.join(root, "candles"))
+    os.makedirs(os.path.dirname(store.path("x", "1D")), exist_ok=True)
+    keys = [share["figi"] for share in shares] + [
+        ticker["instId"] for ticker in tickers]
+    for i, key in enumerate(keys):
+        candles = np.zeros(days, dtype=CANDLE_DTYPE)
+        candles['ts'] = np.arange(today - days + 1, today + 1) * DAY_MS
+        close = rng.lognormal(3, 1) * np.exp(
+            np.cumsum(rng.normal(0, rng.uniform(0.01, 0.05), days)))
+        candles['open'] = np.roll(close, 1)
+        candles['open'][0] = close[0]
+        candles['high'] = np.maximum(candles['open'], close) * 1.01
+        candles['low'] = np.minimum(candles['open'], close) * 0.99
+        candles['close'] = close
+        candles['volume'] = rng.lognormal(rng.uniform(5, 15), 1, days)
+        np.save(store.path(key, "1D"), candles)
+        if i >= stocks:
+            # Текущая цена и суточный объем пары по последней свече
+            tickers[i - stocks].update(last=str(close[-1]),
+                                       vol24h=str(candles['volume'][-1]))
+
+    for name, data in (("shares", shares), ("tickers", tickers),
+                       ("coins", coins), ("markets", markets)):
+        with open(os.path.join(root, f"{name}.json"), "w",
+                  encoding="utf-8") as file:
+            json.dump(data, file)
+
+
+def _rss():
+    """
+    :return: Резидентная память процесса (байт) или None, если
+        /proc недоступен
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemory(threading.Thread):
+    """
+    Фоновый замер пиковой резидентной памяти: в отличие от tracemalloc
+    не замедляет измеряемый код
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: Период опроса (в секундах)
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = self.peak = _rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self):
+        """
+        :return: Пара (пиковая память, ее прирост за этап) в МБ
+            или (None, None)
+        """
+        self._done.set()
+        self.join()
+        if self.peak is None:
+            return None, None
+        self.peak = max(self.peak, _rss())
+        return (round(self.peak / 2**20, 1),
+                round((self.peak - self.start_rss) / 2**20, 1))
+
+
+class Stages:
+    """
+    Замеряет этапы: время, пропускную способность и пиковую
+    резидентную память процесса
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, items, function, *args, **kwargs):
+        """
+        :param name: Название этапа
+        :param items: Число обработанных элементов (для пропускной
+            способности)
+        :param function: Функция этапа; корутины выполняются в asyncio
+        :return: Результат функции
+        """
+        memory = PeakMemory()
+        if memory.peak is not None:
+            memory.start()
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+        seconds = time.perf_counter() - start
+        peak, growth = memory.stop() if memory.is_alive() else (None, None)
+
+        self.results[name] = {
+            "seconds": round(seconds, 4),
+            "items": items,
+            "throughput": round(items / seconds, 1) if seconds else None,
+            "peak_rss_mb": peak,
+            "rss_growth_mb": growth
+        }
+        print(f"  {name:<15} {seconds:9.3f} с {items / seconds:12.0f} эл./с "
+              f"{peak or 0:9.1f} МБ (+{growth or 0:.1f})")
+        return result
+
+
+async def _listing(provider):
+    return (await provider.shares(), await provider.tickers(),
+            await provider.coin_mapping())
+
+
+async def _stock_candles(provider, shares, store, concurrency):
+    async for _ in fetch_stock_candles(provider, shares, store,
+                                       rate=UNLIMITED_RATE,
+                                       concurrency=concurrency):
+        pass
+
+
+async def _crypto_candles(provider, tickers, coingecko_ids, store, cache,
+                          concurrency):
+    pairs = []
+    fundamentals = await crypto_pipeline(
+        provider, provider, tickers, coingecko_ids, store, cache,
+        rate=UNLIMITED_RATE, concurrency=concurrency,
+        coingecko_rate=UNLIMITED_RATE, on_pair=pairs.append)
+    # Порядок пар как в списке тикеров, а не в порядке завершения загрузки
+    order = {ticker['instId']: i for i, ticker in enumerate(tickers)}
+    pairs.sort(key=lambda pair: order[pair["instId"]])
+    return pairs_table(pairs, coingecko_ids, fundamentals)
+
+
+def _digest(*paths):
+    """
+    :param paths: Пути к файлам
+    :return: SHA-256 содержимого (для сравнения результатов версий)
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def run_size(size, workdir, days=HISTORY_DAYS, latency=0.0,
+             concurrency=CONCURRENCY, plot=True):
+    """
+    Прогоняет конвейер на синтетическом рынке из size инструментов
+    :param size: Число инструментов
+    :param workdir: Рабочая директория (фикстуры и хранилище свечей)
+    :param days: Глубина истории в днях
+    :param latency: Задержка каждого запроса к провайдеру (в секундах)
+    :param concurrency: Число одновременных запросов
+    :param plot: Замерять построение диаграммы
+    :return: Словарь с результатами этапов и хэшами результатов
+    """
+    fixture_dir = os.path.join(workdir, "fixtures")
+    print(f"Синтетический рынок: {size} инструментов...")
+    synthetic_fixture(fixture_dir, size, days)
+
+    provider = ReplayProvider(fixture_dir, latency=latency)
+    store = CandleStore(os.path.join(workdir, "candles"))
+    cache = FundamentalsCache(path=None)
+    stages = Stages()
+
+    shares, tickers, mapping = stages.run("listing", size, _listing,
+                                          provider)
+    stages.run("stock_candles", len(shares), _stock_candles, provider,
+               shares, store, concurrency)
+    coingecko_ids = {
+        ticker['instId']: mapping.get(base_asset(ticker['instId']))
+        for ticker in tickers
+    }
+    stages.run("fundamentals", len(tickers), fetch_fundamentals, provider,
+               coingecko_ids.values(), cache, rate=UNLIMITED_RATE)
+    pairs = stages.run("crypto_candles", len(tickers), _crypto_candles,
+                       provider, tickers, coingecko_ids, store, cache,
+                       concurrency)
+
+    shares = shares_table(shares)
+    metrics_df = stages.run("scoring", size, score_universe, store, shares,
+                            pairs)
+    metrics = metrics_from_frame(metrics_df)
+    portfolio = stages.run("allocation", size,
+                           lambda: build_portfolio(metrics, 10_000))
+
+    metrics_store = MetricsStore(os.path.join(workdir, "metrics"))
+    portfolio_file = os.path.join(workdir, "portfolio.csv")
+
+    def write():
+        metrics_store.save(metrics)
+        save_portfolio(portfolio, portfolio_file)
+
+    stages.run("write", size, write)
+    stages.run("metrics_load", size,
+               lambda: build_portfolio(metrics_store.load(), 10_000))
+    if plot:
+        # Первая отрисовка рисует диаграмму, повторная берет ее из кэша
+        renderer = ChartRenderer(os.path.join(workdir, "charts"))
+        for stage in ("plotting", "plotting_cached"):
+            stages.run(stage, len(portfolio.asset), renderer.render,
+                       portfolio.asset, portfolio.percentage)
+
+    return {
+        "size": size,
+        "days": days,
+        "latency": latency,
+        "stages": stages.results,
+        "digests": {"metrics": _digest(*(
+                        os.path.join(metrics_store.root, f"{name}.npy")
+                        for name in COLUMN_TYPES)),
+                    "portfolio": _digest(portfolio_file)}
+    }
+
+
+def _commit():
+    """
+    :return: Хэш текущего коммита git или None
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base, current, tolerance):
+    """
+    Сравнивает результаты двух версий
+    :param base: Результаты базовой версии
+    :param current: Результаты текущей версии
+    :param tolerance: Допустимое относительное замедление этапа
+    :return: True, если нет замедлений сверх допуска и результаты
+        скоринга и распределения совпадают
+    """
+    ok = True
+    base_runs = {run["size"]: run for run in base["runs"]}
+    for run in current["runs"]:
+        old = base_runs.get(run["size"])
+        if old is None:
+            continue
+        print(f"Размер {run['size']}:")
+        for name, stage in run["stages"].items():
+            if name not in old["stages"]:
+                continue
+            before = old["stages"][name]["seconds"]
+            ratio = stage["seconds"] / max(before, 1e-9)
+            slower = (ratio > 1 + tolerance and
+                      stage["seconds"] - before > MIN_SLOWDOWN)
+            ok &= not slower
+            print(f"  {name:<15} {before:9.3f} -> "
+                  f"{stage['seconds']:9.3f} с (x{ratio:.2f})"
+                  f"{'  ЗАМЕДЛЕНИЕ' if slower else ''}")
+        for name, digest in run["digests"].items():
+            if old["digests"].get(name) != digest:
+                ok = False
+                print(f"  результат {name} изменился")
+    return ok
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк конвейера на синтетических данных")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="размеры рынка (по умолчанию %(default)s)")
+    parser.add_argument("--days", type=int, default=HISTORY_DAYS,
+                        help="глубина истории (по умолчанию %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка каждого запроса (в секундах)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="число одновременных запросов "
+                             "(по умолчанию %(default)s)")
+    parser.add_argument("--no-plot", dest="plot", action="store_false",
+                        help="не замерять построение диаграммы")
+    parser.add_argument("--output", default=RESULTS_FILE,
+                        help="файл результатов (по умолчанию %(default)s)")
+    parser.add_argument("--compare", metavar="BASE",
+                        help="сравнить с результатами предыдущей версии")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="допустимое замедление этапа при сравнении "
+                             "(по умолчанию %(default)s)")
+    parser.add_argument("--workdir",
+                        help="рабочая директория (по умолчанию временная, "
+                             "удаляется после запуска)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "runs": []
+    }
+
+    for size in args.sizes:
+        workdir = (os.path.join(args.workdir, str(size)) if args.workdir
+                   else tempfile.mkdtemp(prefix=f"benchmark-{size}-"))
+        try:
+            results["runs"].append(run_size(size, workdir, args.days,
+                                            args.latency, args.concurrency,
+                                            args.plot))
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            base = json.load(file)
+        if not compare(base, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Локальное хранилище свечей для инкрементальной загрузки
+import os
+import re
+import time
+
+import numpy as np
+
+# Время открытия свечи в миллисекундах UTC и ее цены/объем
+CANDLE_DTYPE = np.dtype([
+    ('ts', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8')
+])
+
+STORE_DIR = "candles"
+DAY_MS = 24 * 60 * 60 * 1000
+# Глубина истории для расчета метрик (в днях): год для акций
+# и одна страница свечей OKX для криптовалют
+STOCK_HISTORY_DAYS = 365
+CRYPTO_HISTORY_DAYS = 100
+
+
+def window_start(days, now=None):
+    """
+    :param days: Глубина истории в днях
+    :param now: Текущее время (мс), по умолчанию системное
+    :return: Начало окна истории (мс)
+    """
+    now = int(time.time() * 1000) if now is None else now
+    return now - days * DAY_MS
+
+
+def price_matrix(history, first_day, days):
+    """
+    :param history: Список массивов свечей по активам
+    :param first_day: Номер первого дня (дней с начала эпохи)
+    :param days: Число дней
+    :return: Матрица цен закрытия дни x активы; в дни без торгов
+        переносится последняя известная цена
+    """
+    prices = np.full((days, len(history)), np.nan)
+    for column, candles in enumerate(history):
+        prices[candles['ts'] // DAY_MS - first_day, column] = candles['close']
+
+    # Перенос последней известной цены вперед
+    rows = np.where(np.isnan(prices), 0, np.arange(days)[:, None])
+    rows = np.maximum.accumulate(rows, axis=0)
+    return prices[rows, np.arange(len(history))]
+
+
+class CandleStore:
+    """
+    Свечи хранятся по одному файлу .npy на инструмент и интервал
+    (candles/<интервал>/<FIGI или instId>.npy), отсортированными
+    по времени. Файлы читаются через memory-map без копирования
+    """
+
+    def __init__(self, root=STORE_DIR):
+        """
+        :param root: Корневая директория хранилища
+        """
+        self.root = root
+
+    def path(self, key, interval):
+        """
+        :param key: FIGI акции или instId криптовалютной пары
+        :param interval: Интервал свечей, например 1D
+        :return: Путь к файлу свечей
+        """
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+        return os.path.join(self.root, interval, f"{name}.npy")
+
+    def load(self, key, interval="1D", since=None):
+        """
+        :param key: FIGI акции или instId криптовалютной пары
+        :param interval: Интервал свечей
+        :param since: Вернуть только свечи не раньше этого времени (мс)
+        :return: Массив свечей CANDLE_DTYPE (пустой, если свечей нет)
+        """
+        path = self.path(key, interval)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        candles = np.load(path, mmap_mode='r')
+        if since is not None:
+            candles = candles[np.searchsorted(candles['ts'], since):]
+        return candles
+
+    def last_timestamp(self, key, interval="1D"):
+        """
+        :param key: FIGI акции или instId криптовалютной пары
+        :param interval: Интервал свечей
+        :return: Время последней сохраненной свечи (мс) или None
+        """
+        candles = self.load(key, interval)
+        return int(candles['ts'][-1]) if len(candles) else None
+
+    def append(self, key, interval, candles):
+        """
+        Дописывает новые свечи. Сохраненные свечи, начиная с первой новой,
+        заменяются: так последняя (незакрытая) свеча обновляется
+        :param key: FIGI акции или instId криптовалютной пары
+        :param interval: Интервал свечей
+        :param candles: Массив свечей CANDLE_DTYPE
+        """
+        if not len(candles):
+            return
+        candles = np.sort(np.asarray(candles, dtype=CANDLE_DTYPE),
+                          order='ts')
+        stored = self.load(key, interval)
+        stored = stored[:np.searchsorted(stored['ts'], candles['ts'][0])]
+        merged = np.concatenate([stored, candles])
+
+        path = self.path(key, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл и подменяем, чтобы сбой не испортил данные
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, merged)
+        del stored
+        os.replace(tmp_path, path)
+
+    def save_instruments(self, name, instruments):
+        """
+        Сохраняет справочник инструментов рядом со свечами, чтобы
+        пересчитывать рейтинги без обращения к провайдерам
+        :param name: Имя справочника (stocks или crypto)
+        :param instruments: DataFrame с данными инструментов
+        """
+        os.makedirs(self.root, exist_ok=True)
+        instruments.to_csv(os.path.join(self.root, f"{name}.csv"),
+                           index=False)
+
+    def load_instruments(self, name):
+        """
+        :param name: Имя справочника (stocks или crypto)
+        :return: DataFrame с данными инструментов
+        """
+        import pandas as pd
+
+        # Тикеры бывают числовыми (например, 788), читаем их как строки
+        return pd.read_csv(os.path.join(self.root, f"{name}.csv"),
+                           dtype={"figi": str, "ticker": str, "instId": str})
+
+    def fetch_start(self, key, interval, default_start):
+        """
+        :param key: FIGI акции или instId криптовалютной пары
+        :param interval: Интервал свечей
+        :param default_start: Начало истории, если свечей еще нет (мс)
+        :return: Время, с которого нужно загружать свечи (мс): последняя
+            сохраненная свеча запрашивается заново, так как она могла
+            быть незакрытой
+        """
+        last = self.last_timestamp(key, interval)
+        return default_start if last is None else max(last, default_start)
@@ -0,0 +1,212 @@
+# Диаграммы портфолио без графического интерфейса: отрисовка через
+# Agg в PNG или SVG, кэш по содержимому и фоновый пул процессов
+#
+# Диаграмма зависит только от активов и их долей, поэтому имя файла —
+# хэш этих данных: одинаковые распределения (например, у клиентов
+# пакетного режима с разным капиталом) рисуются один раз
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import REGISTRY
+
+CHARTS_DIR = "charts"
+CHART_FORMATS = ("png", "svg")
+# Версия оформления: меняется вместе с render_chart, чтобы старые
+# изображения в кэше не выдавались за новые
+CHART_VERSION = 1
+# Точность долей (%), с которой распределения считаются одинаковыми:
+# на диаграмме доли подписываются с одним знаком после запятой
+PERCENTAGE_DECIMALS = 4
+CHARTS_INDEX = "charts.csv"
+
+
+def chart_key(asset, percentage):
+    """
+    :param asset: Имена активов
+    :param percentage: Доли активов (%)
+    :return: SHA-256 содержимого диаграммы
+    """
+    content = json.dumps([CHART_VERSION, [str(name) for name in asset],
+                          np.round(np.asarray(percentage, dtype=np.float64),
+                                   PERCENTAGE_DECIMALS).tolist()],
+                         ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def render_chart(asset, percentage, path):
+    """
+    Рисует круговую диаграмму портфолио в файл. Используются Figure
+    и холст Agg напрямую, без pyplot: не загружается графический
+    интерфейс и не остается открытых окон и глобальных фигур
+    :param asset: Имена активов
+    :param percentage: Доли активов (%)
+    :param path: Путь к файлу; формат задается расширением (.png, .svg)
+    :return: path
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 10))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.pie(
+        percentage,
+        labels=[str(name) for name in asset],
+        autopct='%1.1f%%',
+        startangle=140,
+        wedgeprops={"edgecolor": "black"}
+    )
+    axes.set_title("Портфолио")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    root, extension = os.path.splitext(path)
+    # Пишем во временный файл и подменяем, чтобы в кэш не попал
+    # недорисованный файл
+    tmp_path = f"{root}.tmp{os.getpid()}{extension}"
+    figure.savefig(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChartRenderer:
+    """
+    Отрисовка диаграмм с кэшем по содержимому. Уже нарисованная
+    диаграмма берется из кэша; новая рисуется сразу (render) или
+    в фоновом пуле процессов, пока вызывающий код продолжает работу
+    (submit). Пул запускается только при первом промахе кэша.
+    Используется как контекстный менеджер: при выходе дожидается
+    всех диаграмм
+    """
+
+    def __init__(self, root=CHARTS_DIR, fmt="png", workers=None):
+        """
+        :param root: Директория кэша диаграмм
+        :param fmt: Формат: png или svg
+        :param workers: Число процессов (по умолчанию по числу ядер)
+        """
+        if fmt not in CHART_FORMATS:
+            raise ValueError(f"формат диаграммы {fmt} не поддерживается, "
+                             f"ожидается один из {CHART_FORMATS}")
+        self.root = root
+        self.fmt = fmt
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wait()
+
+    def path(self, key):
+        """
+        :param key: Хэш содержимого диаграммы
+        :return: Путь к файлу диаграммы
+        """
+        return os.path.join(self.root, f"{key}.{self.fmt}")
+
+    def _lookup(self, asset, percentage):
+        """
+        :param asset: Имена активов
+        :param percentage: Доли активов (%)
+        :return: Пара (хэш, путь к файлу); попадания и промахи
+            кэша учитываются в счетчике cache_requests_total
+        """
+        key = chart_key(asset, percentage)
+        path = self.path(key)
+        hit = key in self._pending or os.path.exists(path)
+        REGISTRY.inc("cache_requests_total", cache="charts",
+                     result="hit" if hit else "miss")
+        return (None if hit else key), path
+
+    def render(self, asset, percentage):
+        """
+        Рисует диаграмму в текущем процессе, если ее нет в кэше:
+        для одной диаграммы запуск пула дороже отрисовки
+        :param asset: Имена активов
+        :param percentage: Доли активов (%)
+        :return: Путь к готовому файлу диаграммы
+        """
+        key, path = self._lookup(asset, percentage)
+        if key is not None:
+            render_chart(asset, percentage, path)
+        return path
+
+    def submit(self, asset, percentage):
+        """
+        Ставит диаграмму в очередь фонового пула, если ее нет в кэше
+        :param asset: Имена активов
+        :param percentage: Доли активов (%)
+        :return: Путь к файлу диаграммы (файл готов после wait)
+        """
+        key, path = self._lookup(asset, percentage)
+        if key is not None:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers)
+            self._pending[key] = self._executor.submit(
+                render_chart, list(asset), np.asarray(percentage), path)
+        return path
+
+    def wait(self):
+        """
+        Дожидается всех поставленных в очередь диаграмм и останавливает пул
+        """
+        try:
+            for future in self._pending.values():
+                future.result()
+        finally:
+            self._pending.clear()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def render_batch(batch, renderer, directory):
+    """
+    Ставит в очередь диаграммы пакетного режима. Клиенты с одинаковым
+    распределением получают одну диаграмму: строки долей группируются
+    до отрисовки, поэтому число диаграмм равно числу различных
+    распределений, а не клиентов. Индекс клиент -> файл диаграммы
+    сохраняется в directory/charts.csv, пока диаграммы рисуются
+    :param batch: PortfolioBatch
+    :param renderer: ChartRenderer
+    :param directory: Директория портфолио пакетного режима
+    :return: Путь к индексу
+    """
+    # Некупленные активы (например, при нулевом капитале)
+    # в диаграмму не входят
+    shares = np.where(batch.allocation > 0,
+                      np.round(batch.percentage, PERCENTAGE_DECIMALS), 0.0)
+    # Строка долей сравнивается как одно значение из байтов: так
+    # группировка миллиона клиентов в разы быстрее np.unique(axis=0)
+    row_type = np.dtype((np.void, shares.dtype.itemsize *
+                         max(shares.shape[1], 1)))
+    rows, inverse = np.unique(
+        np.ascontiguousarray(shares).view(row_type).ravel()
+        if shares.shape[1] else np.zeros(len(shares), row_type),
+        return_inverse=True)
+    rows = rows.view(shares.dtype).reshape(len(rows), -1)[
+        :, :shares.shape[1]]
+    charts = []
+    for row in rows:
+        keep = row > 0
+        charts.append(os.path.relpath(
+            renderer.submit(batch.asset[keep], row[keep]), directory)
+            if keep.any() else "")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, CHARTS_INDEX)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["Client", "Chart"])
+        writer.writerows(zip(batch.client.tolist(),
+                             np.array(charts, dtype=object)[
+                                 inverse.ravel()].tolist()))
+    return path
@@ -0,0 +1,141 @@
+# Контрольные точки сбора данных: перезапуск продолжает с места сбоя
+import json
+import os
+from datetime import datetime, timezone
+
+from candle_store import STORE_DIR
+
+# Контрольные точки хранятся рядом со свечами, прогресс которых описывают
+CHECKPOINT_DIR = os.path.join(STORE_DIR, "checkpoint")
+# Сколько записей накапливать перед записью на диск
+BATCH_SIZE = 100
+
+
+def _truncate_partial(path):
+    """
+    Обрезает недописанную при сбое последнюю строку файла,
+    чтобы новые записи не склеились с ней
+    :param path: Путь к файлу
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(end - 4096, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            file.truncate(end)
+
+
+class Checkpoint:
+    """
+    Записи по инструментам дописываются пачками в <name>.jsonl,
+    а ключи завершенных инструментов — в манифест <name>.done.
+    Пачка попадает в манифест только после записи самих данных,
+    поэтому манифест не ссылается на потерянные записи.
+    Контрольная точка действует в течение дня (UTC), как и метрики
+    """
+
+    def __init__(self, name, root=CHECKPOINT_DIR, batch_size=BATCH_SIZE):
+        """
+        :param name: Имя этапа сбора (stocks или crypto)
+        :param root: Директория контрольных точек
+        :param batch_size: Число записей в пачке
+        """
+        self.records_path = os.path.join(root, f"{name}.jsonl")
+        self.manifest_path = os.path.join(root, f"{name}.done")
+        self.batch_size = batch_size
+        self.pending = []
+        self.done = set()
+
+        if not self._fresh():
+            self.clear()
+        elif os.path.exists(self.manifest_path):
+            _truncate_partial(self.records_path)
+            with open(self.manifest_path, encoding="utf-8") as file:
+                self.done = {line.rstrip("\n") for line in file
+                             if line.endswith("\n")}
+
+    def _fresh(self):
+        """
+        :return: True, если манифест записан сегодня (UTC)
+        """
+        return os.path.exists(self.manifest_path) and (
+            datetime.fromtimestamp(os.path.getmtime(self.manifest_path),
+                                   timezone.utc).date()
+            == datetime.now(timezone.utc).date())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Сохраняем завершенное даже при ошибке или Ctrl-C
+        self.flush()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, key, record):
+        """
+        Отмечает инструмент завершенным
+        :param key: FIGI акции или instId криптовалютной пары
+        :param record: Словарь с данными инструмента
+        """
+        self.pending.append((key, record))
+        self.done.add(key)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Записывает накопленную пачку: сначала данные, затем манифест
+        """
+        if not self.pending:
+            return
+        os.makedirs(os.path.dirname(self.records_path), exist_ok=True)
+        with open(self.records_path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps({"key": key, "record": record},
+                                       ensure_ascii=False) + "\n"
+                            for key, record in self.pending)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.manifest_path, "a", encoding="utf-8") as file:
+            file.writelines(f"{key}\n" for key, _ in self.pending)
+        self.pending = []
+
+    def records(self):
+        """
+        Читает записи с диска по одной, не загружая файл целиком.
+        Записи, не попавшие в манифест до сбоя, и повторы пропускаются
+        :return: Генератор словарей с данными инструментов
+        """
+        self.flush()
+        if not os.path.exists(self.records_path):
+            return
+        seen = set()
+        with open(self.records_path, encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry["key"] in self.done and entry["key"] not in seen:
+                    seen.add(entry["key"])
+                    yield entry["record"]
+
+    def clear(self):
+        """
+        Удаляет контрольную точку после успешного завершения сбора
+        """
+        for path in (self.records_path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.pending = []
+        self.done = set()
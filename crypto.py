@@ -0,0 +1,303 @@
+# Загрузка криптовалют через OKX и CoinGecko
+import asyncio
+from contextlib import AsyncExitStack
+
+import httpx
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from candle_store import (CANDLE_DTYPE, CRYPTO_HISTORY_DAYS, CandleStore,
+                          window_start)
+from checkpoint import Checkpoint
+from fetcher import FetchStats, fetch_all
+from fundamentals import (COINGECKO_CONCURRENCY, COINGECKO_RATE, EMPTY,
+                          CoinGeckoProvider, FundamentalsCache, base_asset,
+                          fetch_fundamentals)
+from instrumentation import REGISTRY, instrumented
+from ratelimit import Throttled, TokenBucket, Unavailable, retry_after
+from retry import CircuitOpen, RetriesExhausted, retry_call
+
+OKX_URL = "https://www.okx.com/api/v5"
+
+# OKX разрешает 40 запросов свечей за 2 секунды
+OKX_RATE = 15
+OKX_CONCURRENCY = 16
+
+# Общий пул соединений для обоих провайдеров
+HTTP_LIMITS = httpx.Limits(max_connections=OKX_CONCURRENCY +
+                           COINGECKO_CONCURRENCY,
+                           max_keepalive_connections=OKX_CONCURRENCY +
+                           COINGECKO_CONCURRENCY)
+HTTP_TIMEOUT = httpx.Timeout(30)
+
+
+def http_client():
+    """
+    :return: Асинхронный HTTP-клиент с пулом соединений, рассчитанным
+        на оба провайдера (OKX и CoinGecko)
+    """
+    return httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+def candles_to_array(data):
+    """
+    :param data: Свечи OKX в виде списков строк [ts, o, h, l, c, vol, ...]
+    :return: Массив свечей CANDLE_DTYPE
+    """
+    return np.array([
+        (int(row[0]), float(row[1]), float(row[2]), float(row[3]),
+         float(row[4]), float(row[5]))
+        for row in data
+    ], dtype=CANDLE_DTYPE)
+
+
+async def okx_get(http, path, **params):
+    """
+    Выполняет GET-запрос к публичному API OKX
+    :param http: Общий асинхронный HTTP-клиент
+    :param path: Путь метода API
+    :param params: Параметры запроса
+    :return: Поле data ответа
+    """
+    try:
+        response = await http.get(f"{OKX_URL}{path}", params=params)
+    except httpx.TransportError:
+        # Тайм-аут или обрыв соединения: повторяем запрос позже
+        raise Unavailable()
+
+    REGISTRY.inc("provider_bytes_total", len(response.content),
+                 provider="okx")
+    if response.status_code == 429:
+        raise Throttled(retry_after(response, 2))
+    if response.status_code in [500, 502, 503, 504]:
+        raise Unavailable(retry_after(response, None))
+    response.raise_for_status()
+    data = response.json()
+    if data.get('code') == '50011':
+        # OKX сообщает о превышении лимита в теле ответа
+        raise Throttled(2)
+    return data['data']
+
+
+async def get_tickers(http):
+    """
+    :param http: Общий асинхронный HTTP-клиент
+    :return: Список торговых пар спотового рынка OKX
+    """
+    return await okx_get(http, "/market/tickers", instType='SPOT')
+
+
+async def get_candles(http, inst_id, since=None):
+    """
+    Получает дневные свечи торговой пары
+    :param http: Общий асинхронный HTTP-клиент
+    :param inst_id: Идентификатор инструмента OKX
+    :param since: Загрузить только свечи не раньше этого времени (мс)
+    :return: Список свечей (новые свечи идут первыми)
+    """
+    params = {"instId": inst_id, "bar": '1D'}
+    if since is not None:
+        # OKX возвращает свечи строго новее before
+        params["before"] = since - 1
+    return await okx_get(http, "/market/candles", **params)
+
+
+class OkxProvider:
+    """
+    Провайдер рыночных данных OKX: tickers() и candles(inst_id, since).
+    Используется как асинхронный контекстный менеджер
+    """
+
+    def __init__(self, http=None):
+        """
+        :param http: Асинхронный HTTP-клиент (по умолчанию свой)
+        """
+        self.http = http
+        self._own_http = http is None
+
+    async def __aenter__(self):
+        if self._own_http:
+            self.http = http_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._own_http:
+            await self.http.aclose()
+
+    @instrumented("okx", "tickers")
+    async def tickers(self):
+        return await get_tickers(self.http)
+
+    @instrumented("okx", "candles")
+    async def candles(self, inst_id, since=None):
+        """
+        :param inst_id: Идентификатор инструмента OKX
+        :param since: Загрузить только свечи не раньше этого времени (мс),
+            по умолчанию последняя страница свечей
+        :return: Массив свечей CANDLE_DTYPE
+        """
+        return candles_to_array(await get_candles(self.http, inst_id, since))
+
+
+async def crypto_pipeline(okx, coingecko, tickers, coingecko_ids, store,
+                          cache=None, okx_stats=None, coingecko_stats=None,
+                          rate=OKX_RATE, concurrency=OKX_CONCURRENCY,
+                          coingecko_rate=COINGECKO_RATE, on_pair=None):
+    """
+    Конвейер из двух этапов: свечи OKX и данные CoinGecko.
+    У каждого этапа свой лимит запросов: пока пачки запросов
+    к CoinGecko ждут своей очереди, свечи OKX продолжают загружаться.
+    Свечи сохраняются в хранилище сразу в обработчике OKX, а буфер
+    готовых пар ограничен: загруженные свечи не копятся в памяти
+    и не теряются при сбое, пока CoinGecko еще отвечает.
+    Фундаментальные данные присоединяются к парам только при
+    построении таблицы (pairs_table)
+    :param okx: Провайдер рыночных данных (OkxProvider)
+    :param coingecko: Провайдер фундаментальных данных (CoinGeckoProvider)
+    :param tickers: Торговые пары OKX, свечи которых нужно загрузить
+    :param coingecko_ids: ID CoinGecko пар, которым нужны фундаментальные
+        данные: {instId: ID или None}
+    :param store: Хранилище свечей CandleStore: с OKX догружаются
+        только свечи после последней сохраненной
+    :param cache: Кэш фундаментальных данных FundamentalsCache
+    :param okx_stats: Статистика этапа OKX
+    :param coingecko_stats: Статистика этапа CoinGecko
+    :param rate: Частота запросов свечей OKX (в секунду)
+    :param concurrency: Число одновременных запросов свечей OKX
+    :param coingecko_rate: Частота запросов к CoinGecko (в секунду)
+    :param on_pair: Функция, вызываемая с рыночными данными пары
+        (instId, last, vol24h), как только ее свечи сохранены
+    :return: Словарь {ID CoinGecko: данные}; ID из пачек, не загруженных
+        за все попытки, в него не попадают
+    """
+    # Пары с одним базовым активом (BTC-USDT, BTC-USDC, ...) используют
+    # одни и те же данные CoinGecko, поэтому запрашиваем каждую монету один раз
+    fundamentals = asyncio.create_task(fetch_fundamentals(
+        coingecko, coingecko_ids.values(), cache, rate=coingecko_rate,
+        stats=coingecko_stats))
+
+    since = window_start(CRYPTO_HISTORY_DAYS)
+
+    async def fetch_candles(ticker):
+        inst_id = ticker['instId']
+        start = store.fetch_start(inst_id, "1D", since)
+        candles = await okx.candles(inst_id, start if start > since else None)
+        store.append(inst_id, "1D", candles)
+        return {
+            "instId": inst_id,
+            "last": float(ticker['last']),
+            "vol24h": float(ticker['vol24h'])
+        }
+
+    try:
+        async for _, pair in fetch_all(
+                tickers, fetch_candles, TokenBucket(rate), concurrency,
+                okx_stats, name="okx_candles", host="okx"):
+            if on_pair is not None:
+                on_pair(pair)
+        return await fundamentals
+    finally:
+        fundamentals.cancel()
+
+
+PAIR_COLUMNS = ["instId", "last", "vol24h", "transaction_volume_usd",
+                "circulating_supply"]
+
+
+def pairs_table(pairs, coingecko_ids, fundamentals):
+    """
+    :param pairs: Словари с рыночными данными пар (instId, last, vol24h)
+    :param coingecko_ids: {instId: ID CoinGecko или None}
+    :param fundamentals: {ID CoinGecko: данные}
+    :return: DataFrame пар с колонками PAIR_COLUMNS; пары без данных
+        CoinGecko получают EMPTY
+    """
+    return pd.DataFrame([
+        {**pair, **fundamentals.get(coingecko_ids.get(pair["instId"]), EMPTY)}
+        for pair in pairs
+    ], columns=PAIR_COLUMNS)
+
+
+async def collect_crypto(okx=None, coingecko=None, store=None, cache=None,
+                         checkpoint=None, progress=False, **kwargs):
+    """
+    Загружает все спотовые пары OKX, догружает их свечи в хранилище
+    и получает данные CoinGecko. Пара отмечается в контрольной точке,
+    как только ее свечи сохранены: при перезапуске после сбоя она
+    пропускается. Данные CoinGecko сохраняются отдельно, в кэше
+    после каждой пачки, и присоединяются к парам в конце сбора
+    :param okx: Провайдер рыночных данных (по умолчанию OkxProvider)
+    :param coingecko: Провайдер фундаментальных данных
+        (по умолчанию CoinGeckoProvider)
+    :param store: Хранилище свечей CandleStore
+    :param cache: Кэш фундаментальных данных FundamentalsCache
+    :param checkpoint: Контрольная точка Checkpoint
+    :param progress: Показывать индикатор выполнения по каждой паре
+    :param kwargs: Параметры crypto_pipeline (rate, concurrency,
+        coingecko_rate)
+    :return: DataFrame пар с колонками instId, last, vol24h,
+        transaction_volume_usd и circulating_supply
+    """
+    okx_stats = FetchStats()
+    coingecko_stats = FetchStats()
+    store = store if store is not None else CandleStore()
+    cache = cache if cache is not None else FundamentalsCache()
+    checkpoint = checkpoint if checkpoint is not None else Checkpoint("crypto")
+
+    async with AsyncExitStack() as stack:
+        if okx is None or coingecko is None:
+            # Общий пул соединений для обоих провайдеров
+            http = await stack.enter_async_context(http_client())
+            okx = okx if okx is not None else OkxProvider(http)
+            coingecko = (coingecko if coingecko is not None
+                         else CoinGeckoProvider(http))
+        await stack.enter_async_context(okx)
+        await stack.enter_async_context(coingecko)
+
+        # Получаем список доступных торговых пар на спотовом рынке
+        tickers = await retry_call(okx.tickers, "okx",
+                                   name="okx_tickers")
+        pending = [ticker for ticker in tickers
+                   if ticker['instId'] not in checkpoint]
+        # Фундаментальные данные нужны и парам из контрольной точки:
+        # в ней хранятся только рыночные данные
+        try:
+            mapping = await retry_call(coingecko.coin_mapping, "coingecko",
+                                       name="coingecko_coins")
+        except (RetriesExhausted, CircuitOpen) as e:
+            # Без списка монет пары загружаются без данных CoinGecko,
+            # а запуск считается неполным: данные догрузятся позже
+            REGISTRY.inc("fetch_failures_total", stage="coingecko_coins")
+            print(f"CoinGecko: список монет не получен: {e}")
+            mapping = {}
+        coingecko_ids = {
+            ticker['instId']: mapping.get(base_asset(ticker['instId']))
+            for ticker in tickers
+        }
+
+        with checkpoint, tqdm(total=len(tickers),
+                              initial=len(tickers) - len(pending),
+                              desc="Криптовалюты", unit="пара",
+                              disable=not progress) as bar:
+            def stored(pair):
+                # Пара отмечается, как только ее свечи сохранены
+                checkpoint.add(pair["instId"], pair)
+                bar.update()
+
+            fundamentals = await crypto_pipeline(
+                okx, coingecko, pending, coingecko_ids, store, cache,
+                okx_stats, coingecko_stats, on_pair=stored, **kwargs)
+
+    print(f"OKX: загружено {okx_stats}")
+    print(f"CoinGecko: запросов {coingecko_stats.instruments}, "
+          f"из кэша {cache.hits}, отказов по лимиту "
+          f"{coingecko_stats.throttled}")
+    # Порядок пар как в ответе OKX, а не в порядке завершения загрузки
+    order = {ticker['instId']: i for i, ticker in enumerate(tickers)}
+    pairs = pairs_table(sorted(checkpoint.records(),
+                               key=lambda record: order.get(record["instId"],
+                                                            len(order))),
+                        coingecko_ids, fundamentals)
+    store.save_instruments("crypto", pairs)
+    return pairs
@@ -0,0 +1,128 @@
+# Конкурентная загрузка данных по множеству инструментов
+import asyncio
+import time
+
+from instrumentation import REGISTRY
+from retry import DEFAULT_POLICY, CircuitOpen, RetriesExhausted, retry_call
+
+
+class FetchStats:
+    """
+    Статистика загрузки: число инструментов, отказов и пропускная способность
+    """
+
+    def __init__(self):
+        self.instruments = 0
+        self.throttled = 0
+        # Отказы из-за недоступности провайдера (тайм-аут, 5xx)
+        self.unavailable = 0
+        # Инструменты, пропущенные после всех попыток или из-за
+        # разомкнутого выключателя; загрузятся при следующем запуске
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished else time.perf_counter()
+        return end - self.started
+
+    @property
+    def throughput(self):
+        """
+        :return: Скорость загрузки (инструментов в секунду)
+        """
+        return self.instruments / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return (f"{self.instruments} инструментов за {self.elapsed:.1f} с "
+                f"({self.throughput:.2f} инстр./с), "
+                f"отказов по лимиту: {self.throttled}, "
+                f"недоступности: {self.unavailable}, "
+                f"пропущено: {self.failed}")
+
+
+async def fetch_all(keys, fetch_one, bucket, concurrency=8, stats=None,
+                    buffer=None, name="fetch", host=None,
+                    policy=DEFAULT_POLICY):
+    """
+    Загружает данные по всем ключам пулом из concurrency обработчиков.
+    Перед каждым запросом берется токен из bucket. Если провайдер
+    отказал (Throttled), повторяется только этот запрос (retry_call),
+    остальные обработчики продолжают работу. Ключ, не загруженный
+    за все попытки или при разомкнутом выключателе хоста, пропускается
+    :param keys: Итерируемый (в т.ч. асинхронно) набор ключей. Асинхронный
+        источник позволяет строить конвейер из нескольких этапов
+        с собственными лимитами
+    :param fetch_one: Корутина-функция, загружающая данные по одному ключу
+    :param bucket: Ограничитель частоты запросов (TokenBucket)
+    :param concurrency: Число одновременных запросов
+    :param stats: Объект FetchStats для накопления статистики
+    :param buffer: Размер буфера готовых результатов (0 - без ограничения).
+        По умолчанию вдвое больше concurrency
+    :param name: Имя этапа для счетчиков повторов (метка stage)
+    :param host: Имя хоста для выключателя, по умолчанию name
+    :param policy: Политика повторов RetryPolicy
+    :return: Асинхронный генератор пар (ключ, результат) в порядке готовности
+    """
+    stats = stats if stats is not None else FetchStats()
+    results = asyncio.Queue(
+        maxsize=concurrency * 2 if buffer is None else buffer)
+    finished = object()
+
+    if hasattr(keys, '__aiter__'):
+        source = aiter(keys)
+        source_lock = asyncio.Lock()
+
+        async def next_key():
+            # Асинхронный генератор нельзя продвигать из нескольких задач сразу
+            async with source_lock:
+                return await anext(source, finished)
+    else:
+        source = iter(keys)
+
+        async def next_key():
+            return next(source, finished)
+
+    def throttled(e):
+        stats.throttled += 1
+        bucket.throttle(e.rate)
+
+    def unavailable(e):
+        stats.unavailable += 1
+
+    async def worker():
+        # Обработчики разбирают ключи из общего источника
+        while (key := await next_key()) is not finished:
+            try:
+                result = await retry_call(
+                    lambda: fetch_one(key), host or name, policy,
+                    before=bucket.acquire, on_throttled=throttled,
+                    on_unavailable=unavailable, name=name)
+            except (RetriesExhausted, CircuitOpen) as e:
+                stats.failed += 1
+                REGISTRY.inc("fetch_failures_total", stage=name)
+                REGISTRY.item(f"Пропущен {key}: {e}")
+                continue
+            stats.instruments += 1
+            await results.put((key, result))
+
+    async def run():
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # При ошибке одного обработчика останавливаем остальные
+            for task in workers:
+                task.cancel()
+            await results.put(finished)
+
+    runner = asyncio.create_task(run())
+    try:
+        while (item := await results.get()) is not finished:
+            yield item
+        # Пробрасываем ошибку обработчика, если она была
+        await runner
+    finally:
+        runner.cancel()
+        stats.finished = time.perf_counter()
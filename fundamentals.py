@@ -0,0 +1,243 @@
+# Фундаментальные данные криптовалют из CoinGecko с кэшированием
+import json
+import os
+import time
+
+import httpx
+from cachetools import TLRUCache
+
+from fetcher import fetch_all
+from instrumentation import REGISTRY, instrumented
+from ratelimit import Throttled, TokenBucket, Unavailable, retry_after
+
+COINGECKO_URL = "https://api.coingecko.com/api/v3"
+
+# CoinGecko без ключа допускает около 30 запросов в минуту
+COINGECKO_RATE = 0.5
+COINGECKO_CONCURRENCY = 2
+# Максимальное число ID в одном запросе /coins/markets
+BATCH_SIZE = 250
+
+CACHE_FILE = os.path.join(".cache", "coingecko.json")
+# Время жизни закэшированных данных (в секундах)
+CACHE_TTL = 24 * 60 * 60
+
+# Значения для монет, о которых у CoinGecko нет данных
+EMPTY = {
+    "transaction_volume_usd": 0,
+    "circulating_supply": 0
+}
+
+
+def base_asset(inst_id):
+    """
+    :param inst_id: Идентификатор пары OKX, например BTC-USDT
+    :return: Символ базового актива в нижнем регистре (btc)
+    """
+    return inst_id.split('-')[0].lower()
+
+
+class FundamentalsCache:
+    """
+    Двухуровневый кэш фундаментальных данных: в памяти (TLRUCache)
+    и на диске (JSON с временем получения каждой записи)
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL, maxsize=100_000):
+        """
+        :param path: Файл дискового кэша (None - только память)
+        :param ttl: Время жизни записи в секундах
+        :param maxsize: Максимальное число записей в памяти
+        """
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Срок годности каждой записи считается от момента ее получения,
+        # поэтому записи с диска не живут дольше положенного
+        self._memory = TLRUCache(
+            maxsize, lambda _, value, now: value['fetched'] + ttl,
+            timer=time.time)
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as file:
+            entries = json.load(file)
+        now = time.time()
+        for coingecko_id, entry in entries.items():
+            if entry['fetched'] + self.ttl > now:
+                self._memory[coingecko_id] = entry
+
+    def save(self):
+        """
+        Сохраняет актуальные записи на диск
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._memory.expire()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(dict(self._memory.items()), file)
+        os.replace(tmp_path, self.path)
+
+    def get(self, coingecko_id):
+        """
+        :param coingecko_id: ID криптовалюты в системе Gecko
+        :return: Закэшированные данные или None
+        """
+        entry = self._memory.get(coingecko_id)
+        if entry is None:
+            self.misses += 1
+            REGISTRY.inc("cache_requests_total", cache="coingecko",
+                         result="miss")
+            return None
+        self.hits += 1
+        REGISTRY.inc("cache_requests_total", cache="coingecko", result="hit")
+        return {key: entry[key] for key in EMPTY}
+
+    def put(self, coingecko_id, data):
+        self._memory[coingecko_id] = dict(data, fetched=time.time())
+
+
+async def coingecko_get(http, path, params=None):
+    """
+    Выполняет GET-запрос к API CoinGecko
+    :param http: Общий асинхронный HTTP-клиент
+    :param path: Путь метода API
+    :param params: Параметры запроса
+    :return: Успешный HTTP-ответ
+    """
+    try:
+        response = await http.get(f"{COINGECKO_URL}{path}", params=params)
+    except httpx.TransportError:
+        # Тайм-аут или обрыв соединения: повторяем запрос позже
+        raise Unavailable()
+
+    REGISTRY.inc("provider_bytes_total", len(response.content),
+                 provider="coingecko")
+    if response.status_code == 429:
+        # Слишком много запросов: ждем и повторяем
+        raise Throttled(retry_after(response))
+    if response.status_code in [500, 502, 503, 504]:
+        raise Unavailable(retry_after(response, None))
+    if response.status_code != 200:
+        raise Exception(f"Не удалось получить информацию CoinGecko: "
+                        f"{response.status_code}")
+    return response
+
+
+async def get_coin_mapping(http):
+    """
+    Получает список всех доступных криптовалют CoinGecko
+    :param http: Общий асинхронный HTTP-клиент
+    :return: Словарь для сопоставления символов криптовалют
+        с их ID на CoinGecko
+    """
+    response = await coingecko_get(http, "/coins/list")
+    return {coin['symbol']: coin['id'] for coin in response.json()}
+
+
+async def get_markets(http, ids):
+    """
+    Получает объем транзакций и циркулирующее предложение
+    сразу для пачки криптовалют
+    :param http: Общий асинхронный HTTP-клиент
+    :param ids: Список ID CoinGecko (не более BATCH_SIZE)
+    :return: Словарь {ID: данные} для всех запрошенных ID
+    """
+    response = await coingecko_get(http, "/coins/markets", params={
+        "vs_currency": "usd",
+        "ids": ",".join(ids),
+        "per_page": BATCH_SIZE
+    })
+
+    # ID, которых нет в ответе, тоже запоминаем, чтобы не запрашивать их снова
+    result = {coingecko_id: EMPTY for coingecko_id in ids}
+    for coin in response.json():
+        # Если данные отсутствуют, устанавливаем значение 0
+        result[coin['id']] = {
+            "transaction_volume_usd": coin.get("total_volume") or 0,
+            "circulating_supply": coin.get("circulating_supply") or 0
+        }
+    return result
+
+
+class CoinGeckoProvider:
+    """
+    Провайдер фундаментальных данных CoinGecko: coin_mapping() и
+    markets(ids). Используется как асинхронный контекстный менеджер
+    """
+
+    def __init__(self, http=None):
+        """
+        :param http: Асинхронный HTTP-клиент (по умолчанию свой)
+        """
+        self.http = http
+        self._own_http = http is None
+
+    async def __aenter__(self):
+        if self._own_http:
+            self.http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=COINGECKO_CONCURRENCY),
+                timeout=httpx.Timeout(30))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._own_http:
+            await self.http.aclose()
+
+    @instrumented("coingecko", "coin_mapping")
+    async def coin_mapping(self):
+        return await get_coin_mapping(self.http)
+
+    @instrumented("coingecko", "markets")
+    async def markets(self, ids):
+        return await get_markets(self.http, ids)
+
+
+async def fetch_fundamentals(provider, coingecko_ids, cache=None,
+                             rate=COINGECKO_RATE,
+                             concurrency=COINGECKO_CONCURRENCY, stats=None):
+    """
+    Получает фундаментальные данные для набора криптовалют.
+    Повторяющиеся ID схлопываются, закэшированные не запрашиваются,
+    остальные запрашиваются пачками по BATCH_SIZE. ID из пачек,
+    не загруженных за все попытки, в результат не попадают
+    :param provider: Провайдер фундаментальных данных (CoinGeckoProvider)
+    :param coingecko_ids: ID CoinGecko (допускаются повторы и None)
+    :param cache: Кэш FundamentalsCache
+    :param rate: Частота запросов к CoinGecko (в секунду)
+    :param concurrency: Число одновременных запросов
+    :param stats: Объект FetchStats для накопления статистики
+    :return: Словарь {ID: данные}
+    """
+    cache = cache if cache is not None else FundamentalsCache(path=None)
+    result = {}
+    missing = []
+    for coingecko_id in sorted(set(filter(None, coingecko_ids))):
+        data = cache.get(coingecko_id)
+        if data is None:
+            missing.append(coingecko_id)
+        else:
+            result[coingecko_id] = data
+
+    batches = [missing[i:i + BATCH_SIZE]
+               for i in range(0, len(missing), BATCH_SIZE)]
+
+    async def fetch_batch(batch):
+        return await provider.markets(batch)
+
+    async for _, markets in fetch_all(batches, fetch_batch,
+                                      TokenBucket(rate), concurrency, stats,
+                                      name="coingecko_markets",
+                                      host="coingecko"):
+        for coingecko_id, data in markets.items():
+            cache.put(coingecko_id, data)
+        result.update(markets)
+        # Сохраняем кэш после каждой пачки, чтобы не терять ее при сбое
+        cache.save()
+
+    return result
@@ -0,0 +1,307 @@
+# Счетчики и гистограммы задержек запросов к провайдерам
+import asyncio
+import bisect
+import functools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from ratelimit import Throttled, Unavailable
+
+# Границы корзин гистограммы задержек (в секундах)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Период сводки по умолчанию (в секундах)
+SUMMARY_INTERVAL = 30
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами, как в Prometheus
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: Верхние границы корзин по возрастанию
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        :param value: Наблюдаемое значение
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :param q: Квантиль от 0 до 1
+        :return: Верхняя граница корзины, в которую попадает квантиль
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    """
+    :param value: Значение счетчика или суммы гистограммы
+    :return: Запись значения для Prometheus без потери точности
+        (формат :g оставляет только 6 значащих цифр)
+    """
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """
+    Хранилище счетчиков и гистограмм с метками. Выводится сводкой
+    для консоли или текстом в формате Prometheus
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        # Вывод по каждому инструменту (ошибки отдельных бумаг и т. п.)
+        self.verbose = False
+
+    def inc(self, name, value=1, **labels):
+        """
+        :param name: Имя счетчика
+        :param value: Приращение
+        :param labels: Метки
+        """
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        :param name: Имя гистограммы
+        :param value: Наблюдаемое значение
+        :param labels: Метки
+        """
+        key = (name, _labels(labels))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def value(self, name, **labels):
+        """
+        :param name: Имя счетчика
+        :param labels: Метки; счетчики с дополнительными метками суммируются
+        :return: Значение счетчика
+        """
+        wanted = set(labels.items())
+        return sum(value for (counter, key), value in self.counters.items()
+                   if counter == name and wanted <= set(key))
+
+    def item(self, message):
+        """
+        Сообщение по отдельному инструменту: выводится только в режиме
+        verbose, чтобы не тормозить горячий цикл выводом в терминал
+        :param message: Текст сообщения
+        """
+        if self.verbose:
+            print(message)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def summary(self):
+        """
+        :return: Сводка для консоли: запросы к провайдерам, задержки,
+            повторы, объем данных и попадания в кэш
+        """
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name != "provider_request_seconds":
+                continue
+            labels = dict(labels)
+            provider, call = labels["provider"], labels["call"]
+            throttled = self.value("provider_requests_total",
+                                   provider=provider, call=call,
+                                   outcome="throttled")
+            unavailable = self.value("provider_requests_total",
+                                     provider=provider, call=call,
+                                     outcome="unavailable")
+            errors = self.value("provider_requests_total", provider=provider,
+                                call=call, outcome="error")
+            lines.append(
+                f"{provider}.{call}: {histogram.count} запросов, "
+                f"p50 {histogram.quantile(0.5) * 1000:.0f} мс, "
+                f"p95 {histogram.quantile(0.95) * 1000:.0f} мс, "
+                f"отказов по лимиту {throttled:.0f}, "
+                f"недоступен {unavailable:.0f}, ошибок {errors:.0f}")
+
+        stages = sorted({dict(labels)["stage"]
+                         for name, labels in self.counters
+                         if name == "retries_total"})
+        for stage in stages:
+            retries = self.value("retries_total", stage=stage)
+            backoff = self.value("backoff_seconds_total", stage=stage)
+            failures = self.value("fetch_failures_total", stage=stage)
+            lines.append(f"{stage}: повторов {retries:.0f}, "
+                         f"ожидание {backoff:.1f} с, "
+                         f"пропущено {failures:.0f}")
+
+        hosts = sorted({dict(labels)["host"]
+                        for name, labels in self.counters
+                        if name == "circuit_opened_total"})
+        for host in hosts:
+            opened = self.value("circuit_opened_total", host=host)
+            rejected = self.value("circuit_rejected_total", host=host)
+            lines.append(f"{host}: выключатель срабатывал {opened:.0f} раз, "
+                         f"отклонено запросов {rejected:.0f}")
+
+        providers = sorted({dict(labels)["provider"]
+                            for name, labels in self.counters
+                            if name == "provider_bytes_total"})
+        for provider in providers:
+            size = self.value("provider_bytes_total", provider=provider)
+            lines.append(f"{provider}: получено {size / 2**20:.1f} МБ")
+
+        caches = sorted({dict(labels)["cache"]
+                         for name, labels in self.counters
+                         if name == "cache_requests_total"})
+        for cache in caches:
+            hits = self.value("cache_requests_total", cache=cache,
+                              result="hit")
+            total = self.value("cache_requests_total", cache=cache)
+            lines.append(f"кэш {cache}: попаданий {hits:.0f} из {total:.0f} "
+                         f"({hits / total * 100 if total else 0:.0f}%)")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        :return: Все счетчики и гистограммы в текстовом формате Prometheus
+        """
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{_format_labels(labels)} "
+                                 f"{_format_value(value)}")
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_name, labels), histogram in sorted(
+                    self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                bounds = [f"{bound:g}" for bound in histogram.buckets]
+                for bound, count in zip(bounds + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket"
+                                 f"{_format_labels(labels, [('le', bound)])} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} "
+                             f"{_format_value(histogram.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} "
+                             f"{histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Сохраняет счетчики в файл в формате Prometheus
+        (например, для textfile-коллектора node_exporter)
+        :param path: Путь к файлу
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    @asynccontextmanager
+    async def reporting(self, interval=SUMMARY_INTERVAL, path=None):
+        """
+        Периодически выводит сводку (и сохраняет счетчики в path),
+        пока выполняется блок
+        :param interval: Период сводки (в секундах), 0 — без сводки
+        :param path: Файл для счетчиков в формате Prometheus
+        """
+        started = time.perf_counter()
+
+        async def report():
+            while True:
+                await asyncio.sleep(interval)
+                print(f"Сводка по запросам за "
+                      f"{time.perf_counter() - started:.0f} с:")
+                print(self.summary())
+                if path:
+                    self.dump(path)
+
+        task = asyncio.create_task(report()) if interval else None
+        try:
+            yield self
+        finally:
+            if task:
+                task.cancel()
+            if path:
+                self.dump(path)
+
+
+# Общее хранилище счетчиков процесса
+REGISTRY = Registry()
+
+
+def instrumented(provider, call):
+    """
+    Декоратор асинхронного метода провайдера: считает запросы по исходу
+    (ok, throttled, unavailable, error) и задержку каждого запроса
+    :param provider: Имя провайдера (метка provider)
+    :param call: Имя метода (метка call)
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await method(*args, **kwargs)
+                outcome = "ok"
+                return result
+            except Unavailable:
+                outcome = "unavailable"
+                raise
+            except Throttled:
+                outcome = "throttled"
+                raise
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            finally:
+                REGISTRY.observe("provider_request_seconds",
+                                 time.perf_counter() - start,
+                                 provider=provider, call=call)
+                REGISTRY.inc("provider_requests_total", provider=provider,
+                             call=call, outcome=outcome)
+        return wrapper
+    return decorator
@@ -0,0 +1,312 @@
+# Колоночное представление метрик активов и их хранилище на диске
+import csv
+import json
+import math
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Классы активов: код в колонке asset_class и название
+STOCK = 0
+CRYPTO = 1
+ASSET_CLASSES = ("stock", "crypto")
+
+NUMERIC_COLUMNS = ("pe", "pb", "returns", "volatility", "liquidity", "rating")
+
+# Типы колонок. Рейтинг остается float64: по нему упорядочиваются
+# активы, и на миллионах строк точности float32 не хватает,
+# чтобы различать близкие рейтинги
+COLUMN_TYPES = {
+    "asset_id": np.int32,
+    "asset_class": np.int8,
+    "pe": np.float32,
+    "pb": np.float32,
+    "returns": np.float32,
+    "volatility": np.float32,
+    "liquidity": np.float32,
+    "rating": np.float64,
+}
+
+METRICS_DIR = "metrics"
+
+
+class AssetDictionary:
+    """
+    Словарь имен активов: имена в UTF-8 подряд в одном массиве байт
+    и смещения их начал. Имена декодируются только по запросу,
+    поэтому словарь из файлов читается через memory-map без копирования
+    """
+
+    def __init__(self, data, offsets):
+        """
+        :param data: Байты всех имен подряд (uint8)
+        :param offsets: Смещения начала имен и конца последнего (int64)
+        """
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_names(cls, names):
+        """
+        :param names: Имена активов
+        :return: Словарь, в котором номер имени — его позиция в names
+        """
+        encoded = [str(name).encode("utf-8") for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, i):
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.data[start:stop]).decode("utf-8")
+
+    def __getitem__(self, ids):
+        """
+        :param ids: Номер имени или массив номеров
+        :return: Имя или массив имен (object)
+        """
+        if np.ndim(ids) == 0:
+            return self._decode(int(ids))
+        ids = np.asarray(ids)
+        if len(ids) * 8 > len(self):
+            # Большая выборка: быстрее декодировать словарь целиком
+            return np.array(self.names(), dtype=object)[ids]
+        return np.array([self._decode(i) for i in ids.tolist()],
+                        dtype=object)
+
+    def names(self):
+        """
+        :return: Список всех имен по порядку номеров
+        """
+        data = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [data[start:stop].decode("utf-8")
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def save(self, root):
+        """
+        :param root: Директория для names.npy и offsets.npy
+        """
+        np.save(os.path.join(root, "names.npy"), self.data)
+        np.save(os.path.join(root, "offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, root):
+        """
+        :param root: Директория с names.npy и offsets.npy
+        :return: Словарь, читаемый через memory-map
+        """
+        return cls(np.load(os.path.join(root, "names.npy"), mmap_mode='r'),
+                   np.load(os.path.join(root, "offsets.npy"), mmap_mode='r'))
+
+
+@dataclass
+class Metrics:
+    """
+    Метрики всех активов в виде типизированных колонок NumPy
+    (см. COLUMN_TYPES): одна строка на актив, без словарей на каждую
+    строку. Имя актива хранится номером в словаре names
+    """
+    asset_id: np.ndarray  # Номер тикера акции или instId пары в names
+    asset_class: np.ndarray  # STOCK или CRYPTO
+    pe: np.ndarray
+    pb: np.ndarray
+    returns: np.ndarray
+    volatility: np.ndarray
+    liquidity: np.ndarray
+    rating: np.ndarray
+    names: AssetDictionary
+
+    @classmethod
+    def from_columns(cls, asset, asset_class, **columns):
+        """
+        :param asset: Имена активов
+        :param asset_class: Коды классов активов
+        :param columns: Числовые колонки NUMERIC_COLUMNS
+        :return: Metrics с колонками приведенных типов
+        """
+        return cls(asset_id=np.arange(len(asset), dtype=np.int32),
+                   asset_class=np.asarray(asset_class, dtype=np.int8),
+                   names=AssetDictionary.from_names(asset),
+                   **{name: np.asarray(columns[name],
+                                       dtype=COLUMN_TYPES[name])
+                      for name in NUMERIC_COLUMNS})
+
+    def __len__(self):
+        return len(self.asset_id)
+
+    @property
+    def asset(self):
+        """
+        :return: Имена активов (декодируются из словаря при обращении)
+        """
+        return self.names[self.asset_id]
+
+    def take(self, indices):
+        """
+        :param indices: Номера строк или срез (срез не копирует данные)
+        :return: Метрики только выбранных активов
+        """
+        return Metrics(**{name: getattr(self, name)[indices]
+                          for name in COLUMN_TYPES}, names=self.names)
+
+
+class MetricsStore:
+    """
+    Метрики на диске: по файлу .npy на колонку. Строки сгруппированы
+    по классам активов, и каждый класс (раздел) занимает непрерывный
+    диапазон строк, указанный в manifest.json. Колонки и словарь имен
+    читаются через memory-map: загрузка не копирует данные
+    и не зависит от числа активов
+    """
+
+    def __init__(self, root=METRICS_DIR):
+        """
+        :param root: Директория хранилища
+        """
+        self.root = root
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, "manifest.json")
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def manifest(self):
+        """
+        :return: Число строк, разделы {класс: [начало, конец]} и типы колонок
+        """
+        with open(self.manifest_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save(self, metrics):
+        """
+        Сохраняет метрики вместе со словарем имен: строки переупорядочиваются
+        по разделам, имена не перекодируются. Новая версия пишется
+        во временную директорию и подменяет старую целиком, чтобы сбой
+        не оставил колонки разных версий
+        :param metrics: Metrics
+        """
+        order = np.argsort(metrics.asset_class, kind="stable")
+        metrics = metrics.take(order)
+
+        tmp_root = f"{self.root}.tmp"
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        os.makedirs(tmp_root)
+        for name, dtype in COLUMN_TYPES.items():
+            np.save(os.path.join(tmp_root, f"{name}.npy"),
+                    np.asarray(getattr(metrics, name), dtype=dtype))
+        metrics.names.save(tmp_root)
+
+        bounds = np.searchsorted(metrics.asset_class,
+                                 np.arange(len(ASSET_CLASSES) + 1))
+        manifest = {
+            "rows": len(metrics),
+            "partitions": {name: [int(bounds[code]), int(bounds[code + 1])]
+                           for code, name in enumerate(ASSET_CLASSES)},
+            "columns": {name: np.dtype(dtype).str
+                        for name, dtype in COLUMN_TYPES.items()},
+            "created": datetime.now(timezone.utc).isoformat()
+        }
+        with open(os.path.join(tmp_root, "manifest.json"), "w",
+                  encoding="utf-8") as file:
+            json.dump(manifest, file)
+
+        old_root = f"{self.root}.old"
+        if os.path.exists(self.root):
+            shutil.rmtree(old_root, ignore_errors=True)
+            os.replace(self.root, old_root)
+        os.replace(tmp_root, self.root)
+        shutil.rmtree(old_root, ignore_errors=True)
+
+    def load(self, asset_class=None):
+        """
+        :param asset_class: Название класса (stock или crypto),
+            по умолчанию все активы
+        :return: Metrics, колонки которых отображены в память
+        """
+        columns = {name: np.load(os.path.join(self.root, f"{name}.npy"),
+                                 mmap_mode='r')
+                   for name in COLUMN_TYPES}
+        metrics = Metrics(**columns, names=AssetDictionary.load(self.root))
+        if asset_class is None:
+            return metrics
+        start, stop = self.manifest()["partitions"][asset_class]
+        return metrics.take(slice(start, stop))
+
+
+def load_metrics(path):
+    """
+    :param path: Директория MetricsStore или файл all_metrics.csv
+        прежнего формата
+    :return: Metrics
+    """
+    if path.endswith(".csv"):
+        return load_metrics_csv(path)
+    return MetricsStore(path).load()
+
+
+def _to_float(value):
+    return float(value) if value else math.nan
+
+
+def load_metrics_csv(path):
+    """
+    Загружает all_metrics.csv (акции с колонкой ticker, криптовалюты
+    с колонкой symbol) сразу в колонки, без pandas
+    :param path: Путь к файлу метрик
+    :return: Metrics
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = list(reader)
+
+    index = {name: i for i, name in enumerate(header)}
+    ticker = index.get("ticker")
+    symbol = index.get("symbol")
+
+    asset = []
+    asset_class = []
+    kept = []
+    for row in rows:
+        if ticker is not None and row[ticker]:
+            asset.append(row[ticker])
+            asset_class.append(STOCK)
+        elif symbol is not None and row[symbol]:
+            asset.append(row[symbol])
+            asset_class.append(CRYPTO)
+        else:
+            continue
+        kept.append(row)
+
+    columns = {}
+    for name in NUMERIC_COLUMNS:
+        i = index.get(name)
+        columns[name] = ([_to_float(row[i]) for row in kept]
+                         if i is not None else [math.nan] * len(kept))
+
+    return Metrics.from_columns(asset, asset_class, **columns)
+
+
+def metrics_from_frame(frame):
+    """
+    :param frame: DataFrame в формате all_metrics.csv (см. score_universe)
+    :return: Metrics
+    """
+    is_stock = frame['ticker'].notna().to_numpy()
+    asset = np.where(is_stock, frame['ticker'], frame['symbol'])
+    columns = {
+        name: (frame[name].to_numpy(dtype=np.float64) if name in frame
+               else np.full(len(frame), np.nan))
+        for name in NUMERIC_COLUMNS
+    }
+    return Metrics.from_columns(asset.tolist(),
+                                np.where(is_stock, STOCK, CRYPTO), **columns)
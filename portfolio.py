@@ -0,0 +1,306 @@
+# Построение портфолио по рейтингам активов
+import csv
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from allocation import RankAllocator, capacity, rank_weights
+from metrics import ASSET_CLASSES
+
+# Минимальный средний объем торгов актива
+MIN_LIQUIDITY = 10_000
+# Ограничение на кол-во различных активов
+MAX_ASSETS = 10
+# Минимальный и максимальный процент вложений в один актив
+MIN_PERCENTAGE = 1
+MAX_PERCENTAGE = 30
+# Комиссия 0.04%
+COMMISSION = 0.0004
+# Число клиентов в одной части пакетного вывода
+PARTITION_SIZE = 10_000
+
+
+@dataclass
+class Portfolio:
+    """
+    Портфолио в виде колонок: активы, их рейтинги,
+    суммы вложений ($) и доли капитала (%).
+    allocation = капитал * percentage / 100 * (1 - COMMISSION),
+    remaining_capital = капитал - allocation.sum() - commission
+    """
+    asset: np.ndarray
+    rating: np.ndarray
+    allocation: np.ndarray
+    percentage: np.ndarray
+    remaining_capital: float
+    commission: float = 0.0
+
+
+def top_k(rating, candidates, k):
+    """
+    Частичный отбор k лучших по рейтингу без сортировки всех кандидатов:
+    порог находится за O(n) через np.partition, сортируются только
+    отобранные k. Среди равных рейтингов выигрывает стоящий раньше,
+    как при устойчивой сортировке всего списка
+    :param rating: Рейтинги всех активов
+    :param candidates: Номера активов-кандидатов по возрастанию
+    :param k: Сколько активов отобрать
+    :return: Номера отобранных активов в порядке убывания рейтинга
+    """
+    # Активы без рейтинга считаем худшими
+    values = np.nan_to_num(rating[candidates], nan=-np.inf)
+    if k <= 0 or not len(values):
+        return candidates[:0]
+    if k < len(values):
+        threshold = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values > threshold)
+        ties = np.flatnonzero(values == threshold)[:k - len(above)]
+        chosen = np.sort(np.concatenate([above, ties]))
+    else:
+        chosen = np.arange(len(values))
+    chosen = chosen[np.argsort(-values[chosen], kind='stable')]
+    return candidates[chosen]
+
+
+def select_assets(metrics, n=MAX_ASSETS, min_liquidity=MIN_LIQUIDITY,
+                  quotas=None):
+    """
+    Отбирает лучшие по рейтингу активы: сначала фильтр по ликвидности,
+    затем частичный отбор top-k, итого O(n) вместо сортировки всех активов
+    :param metrics: Метрики активов Metrics
+    :param n: Ограничение на кол-во различных активов
+    :param min_liquidity: Минимальная ликвидность актива
+    :param quotas: Максимальное число активов каждого класса,
+        например {"stock": 5, "crypto": 5}
+    :return: Номера лучших по рейтингу активов в порядке убывания рейтинга
+    """
+    # Фильтруем активы по ликвидности
+    candidates = np.flatnonzero(metrics.liquidity >= min_liquidity)
+
+    # Внутри класса с квотой оставляем только лучших в пределах квоты
+    for name, quota in (quotas or {}).items():
+        code = ASSET_CLASSES.index(name)
+        in_class = metrics.asset_class[candidates] == code
+        best = top_k(metrics.rating, candidates[in_class], quota)
+        candidates = np.sort(np.concatenate([candidates[~in_class], best]))
+
+    return top_k(metrics.rating, candidates, n)
+
+
+def rank_percentages(count, min_percentage=MIN_PERCENTAGE,
+                     max_percentage=MAX_PERCENTAGE):
+    """
+    Доли активов: вес актива линейно убывает с его местом в рейтинге,
+    доли укладываются в min/max процент и в сумме дают 100%
+    (см. allocation.rank_weights)
+    :param count: Число отобранных активов
+    :param min_percentage: Минимальный процент вложений в один актив
+    :param max_percentage: Максимальный процент вложений в один актив
+    :return: Массив долей (%) в порядке убывания рейтинга
+    """
+    return rank_weights(count, min_percentage / 100,
+                        max_percentage / 100) * 100
+
+
+@dataclass
+class PortfolioBatch:
+    """
+    Портфолио множества клиентов: активы и рейтинги общие,
+    суммы ($) и доли (%) — матрицы клиенты x активы
+    """
+    client: np.ndarray
+    capital: np.ndarray
+    asset: np.ndarray
+    rating: np.ndarray
+    allocation: np.ndarray
+    percentage: np.ndarray
+    remaining_capital: np.ndarray
+    commission: np.ndarray
+
+    def __len__(self):
+        return len(self.client)
+
+    def portfolio(self, i):
+        """
+        :param i: Номер клиента
+        :return: Portfolio клиента (только купленные активы)
+        """
+        keep = self.allocation[i] > 0
+        return Portfolio(asset=self.asset[keep], rating=self.rating[keep],
+                         allocation=self.allocation[i, keep],
+                         percentage=self.percentage[i, keep],
+                         remaining_capital=float(self.remaining_capital[i]),
+                         commission=float(self.commission[i]))
+
+
+def build_portfolios(metrics, capitals, clients=None, n=MAX_ASSETS,
+                     min_liquidity=MIN_LIQUIDITY, quotas=None,
+                     min_percentage=MIN_PERCENTAGE,
+                     max_percentage=MAX_PERCENTAGE, allocator=None):
+    """
+    Распределяет капитал множества клиентов за один векторный проход:
+    отбор активов и доли не зависят от капитала и считаются один раз,
+    суммы считаются матрицей клиенты x активы. Комиссия берется
+    с каждой покупки, поэтому сумма вложений, комиссии
+    и нераспределенного остатка равна капиталу
+    :param metrics: Метрики активов Metrics
+    :param capitals: Капиталы клиентов ($)
+    :param clients: Идентификаторы клиентов (по умолчанию номера)
+    :param n: Ограничение на кол-во различных активов
+    :param min_liquidity: Минимальная ликвидность актива
+    :param quotas: Максимальное число активов каждого класса
+    :param min_percentage: Минимальный процент вложений в один актив
+    :param max_percentage: Максимальный процент вложений в один актив
+    :param allocator: Распределитель долей (см. allocation.py),
+        по умолчанию RankAllocator
+    :return: PortfolioBatch
+    """
+    capitals = np.asarray(capitals, dtype=np.float64)
+    clients = (np.arange(len(capitals)) if clients is None
+               else np.asarray(clients, dtype=object))
+    allocator = allocator if allocator is not None else RankAllocator()
+    lower, upper = min_percentage / 100, max_percentage / 100
+    selected = select_assets(metrics, n, min_liquidity, quotas)
+    # Если минимальная доля не позволяет купить все отобранные активы,
+    # покупаются лучшие из них. Имена декодируются только для них
+    chosen = metrics.take(selected[:capacity(len(selected), lower)])
+    weights = allocator.weights(chosen, lower, upper)
+
+    # Доля капитала уходит на покупку актива, из нее берется комиссия
+    spent = np.outer(capitals, weights)
+    allocation = spent * (1 - COMMISSION)
+    commission = spent.sum(axis=1) * COMMISSION
+    percentage = np.broadcast_to(weights * 100, allocation.shape)
+
+    return PortfolioBatch(client=clients, capital=capitals,
+                          asset=chosen.asset,
+                          rating=np.asarray(chosen.rating),
+                          allocation=allocation, percentage=percentage,
+                          remaining_capital=np.maximum(
+                              capitals - spent.sum(axis=1), 0.0),
+                          commission=commission)
+
+
+def build_portfolio(metrics, total_capital, n=MAX_ASSETS,
+                    min_liquidity=MIN_LIQUIDITY, quotas=None,
+                    min_percentage=MIN_PERCENTAGE,
+                    max_percentage=MAX_PERCENTAGE, allocator=None):
+    """
+    Распределяет капитал между лучшими активами: по умолчанию вес
+    актива линейно убывает с его местом в рейтинге
+    :param metrics: Метрики активов Metrics
+    :param total_capital: Общий капитал для инвестирования ($)
+    :param n: Ограничение на кол-во различных активов
+    :param min_liquidity: Минимальная ликвидность актива
+    :param quotas: Максимальное число активов каждого класса
+    :param min_percentage: Минимальный процент вложений в один актив
+    :param max_percentage: Максимальный процент вложений в один актив
+    :param allocator: Распределитель долей (см. allocation.py)
+    :return: Portfolio
+    """
+    return build_portfolios(metrics, [total_capital], n=n,
+                            min_liquidity=min_liquidity, quotas=quotas,
+                            min_percentage=min_percentage,
+                            max_percentage=max_percentage,
+                            allocator=allocator).portfolio(0)
+
+
+def save_portfolio(portfolio, path):
+    """
+    Сохраняет портфолио в файл CSV
+    :param portfolio: Portfolio
+    :param path: Путь к файлу
+    """
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["Asset", "Rating", "Allocation ($)",
+                         "Percentage (%)"])
+        writer.writerows(zip(portfolio.asset, portfolio.rating.tolist(),
+                             portfolio.allocation.tolist(),
+                             portfolio.percentage.tolist()))
+
+
+def _csv_field(value):
+    """
+    :param value: Значение поля
+    :return: Поле CSV, при необходимости в кавычках
+    """
+    text = str(value)
+    if any(char in text for char in ',"\r\n'):
+        text = '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def save_portfolios(batch, directory, partition_size=PARTITION_SIZE):
+    """
+    Сохраняет портфолио всех клиентов в директорию частями
+    part-00000.csv, part-00001.csv, ... по partition_size клиентов,
+    по строке на купленный актив клиента. Суммы округляются до центов;
+    поля клиентов и активов форматируются один раз, а не в каждой строке
+    :param batch: PortfolioBatch
+    :param directory: Директория для частей
+    :param partition_size: Число клиентов в одной части
+    :return: Список путей к записанным частям
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Удаляем части от предыдущего запуска, чтобы не смешать результаты
+    for name in os.listdir(directory):
+        if name.startswith("part-") and name.endswith(".csv"):
+            os.remove(os.path.join(directory, name))
+
+    clients = np.array([f"{_csv_field(client)},{capital:.2f}"
+                        for client, capital in zip(batch.client.tolist(),
+                                                   batch.capital.tolist())],
+                       dtype=object)
+    assets = np.array([f"{_csv_field(asset)},{rating!r}"
+                       for asset, rating in zip(batch.asset.tolist(),
+                                                batch.rating.tolist())],
+                      dtype=object)
+    remaining = np.array([f"{value:.2f}"
+                          for value in batch.remaining_capital.tolist()],
+                         dtype=object)
+
+    paths = []
+    for part, start in enumerate(range(0, len(batch), partition_size)):
+        rows = slice(start, start + partition_size)
+        client, asset = np.nonzero(batch.allocation[rows] > 0)
+        client += start
+        path = os.path.join(directory, f"part-{part:05d}.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("Client,Capital ($),Asset,Rating,Allocation ($),"
+                       "Percentage (%),Remaining capital ($)\n")
+            file.writelines(map("%s,%s,%.2f,%.6f,%s\n".__mod__, zip(
+                clients[client].tolist(), assets[asset].tolist(),
+                batch.allocation[client, asset].tolist(),
+                batch.percentage[client, asset].tolist(),
+                remaining[client].tolist())))
+        paths.append(path)
+    return paths
+
+
+def load_clients(path):
+    """
+    Загружает файл клиентов CSV с колонками client и capital
+    :param path: Путь к файлу
+    :return: Пара (идентификаторы клиентов, капиталы)
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    return (np.array([row["client"] for row in rows], dtype=object),
+            np.array([float(row["capital"]) for row in rows]))
+
+
+def print_portfolio(portfolio):
+    """
+    Выводит портфолио в консоль
+    :param portfolio: Portfolio
+    """
+    print(f"{'#':>3} {'Актив':<20} {'Рейтинг':>8} {'Сумма ($)':>14} "
+          f"{'Доля (%)':>9}")
+    for place, row in enumerate(zip(portfolio.asset, portfolio.rating,
+                                    portfolio.allocation,
+                                    portfolio.percentage), start=1):
+        asset, rating, allocation, percentage = row
+        print(f"{place:>3} {asset:<20} {rating:>8.3f} {allocation:>14.2f} "
+              f"{percentage:>9.2f}")
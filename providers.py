@@ -0,0 +1,184 @@
+# Провайдеры рыночных данных: воспроизведение записанных ответов
+#
+# Конвейеры сбора (stocks.collect_stocks, crypto.collect_crypto) работают
+# с провайдерами — асинхронными контекстными менеджерами с методами:
+#   инструменты:  shares() — акции, tickers() — торговые пары
+#   свечи:        candles(key, start=None) — массив CANDLE_DTYPE
+#                 со свечами не раньше start (мс)
+#   фундаментальные данные: coin_mapping() и markets(ids)
+# Реальные адаптеры: stocks.TinkoffProvider, crypto.OkxProvider,
+# fundamentals.CoinGeckoProvider. ReplayProvider отдает записанные
+# ответы с диска, RecordingProvider записывает ответы любого провайдера
+import asyncio
+import json
+import os
+import random
+
+import numpy as np
+
+from candle_store import CandleStore
+from fundamentals import EMPTY
+from instrumentation import REGISTRY, instrumented
+from ratelimit import Throttled, Unavailable
+
+FIXTURE_DIR = "fixtures"
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class ReplayProvider:
+    """
+    Отдает записанные ответы из директории:
+    shares.json, tickers.json, coins.json, markets.json
+    и свечи в формате CandleStore (candles/1D/<ключ>.npy).
+    Для всех запросов имитируются задержка, отказы по лимиту (429)
+    и временная недоступность (5xx); отказы детерминированы
+    при заданном seed
+    """
+
+    def __init__(self, root=FIXTURE_DIR, latency=0.0, throttle_rate=0.0,
+                 retry_after=1, seed=0, failure_rate=0.0):
+        """
+        :param root: Директория с записанными ответами
+        :param latency: Задержка каждого запроса (в секундах)
+        :param throttle_rate: Доля запросов, отклоняемых по лимиту
+        :param retry_after: Через сколько секунд повторять отклоненный запрос
+        :param seed: Начальное значение генератора отказов
+        :param failure_rate: Доля запросов, завершающихся Unavailable
+        """
+        self.root = root
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.store = CandleStore(os.path.join(root, "candles"))
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._markets = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def _request(self):
+        """
+        Имитирует сетевой запрос: задержка и, возможно, отказ
+        """
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        draw = self._random.random()
+        if draw < self.failure_rate:
+            self.failed += 1
+            raise Unavailable()
+        if draw < self.failure_rate + self.throttle_rate:
+            self.throttled += 1
+            raise Throttled(self.retry_after)
+
+    def _path(self, name):
+        return os.path.join(self.root, f"{name}.json")
+
+    @instrumented("replay", "shares")
+    async def shares(self):
+        await self._request()
+        return _read_json(self._path("shares"), [])
+
+    @instrumented("replay", "tickers")
+    async def tickers(self):
+        await self._request()
+        return _read_json(self._path("tickers"), [])
+
+    @instrumented("replay", "candles")
+    async def candles(self, key, start=None):
+        await self._request()
+        candles = np.array(self.store.load(key, "1D", since=start))
+        REGISTRY.inc("provider_bytes_total", candles.nbytes,
+                     provider="replay")
+        return candles
+
+    @instrumented("replay", "coin_mapping")
+    async def coin_mapping(self):
+        await self._request()
+        return _read_json(self._path("coins"), {})
+
+    @instrumented("replay", "markets")
+    async def markets(self, ids):
+        await self._request()
+        if self._markets is None:
+            self._markets = _read_json(self._path("markets"), {})
+        return {coingecko_id: self._markets.get(coingecko_id, EMPTY)
+                for coingecko_id in ids}
+
+
+class RecordingProvider:
+    """
+    Обертка над провайдером, сохраняющая его ответы в формате
+    ReplayProvider. Свечи дописываются в хранилище фикстур, поэтому
+    инкрементальные запросы накапливают полную историю
+    """
+
+    def __init__(self, provider, root=FIXTURE_DIR):
+        """
+        :param provider: Записываемый провайдер
+        :param root: Директория для записанных ответов
+        """
+        self.provider = provider
+        self.root = root
+        self.store = CandleStore(os.path.join(root, "candles"))
+        self._markets = None
+
+    async def __aenter__(self):
+        await self.provider.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._markets is not None:
+            _write_json(self._path("markets"), self._markets)
+        await self.provider.__aexit__(*exc_info)
+
+    def _path(self, name):
+        return os.path.join(self.root, f"{name}.json")
+
+    async def shares(self):
+        shares = await self.provider.shares()
+        _write_json(self._path("shares"), shares)
+        return shares
+
+    async def tickers(self):
+        tickers = await self.provider.tickers()
+        _write_json(self._path("tickers"), tickers)
+        return tickers
+
+    async def candles(self, key, start=None):
+        candles = await self.provider.candles(key, start)
+        self.store.append(key, "1D", candles)
+        return candles
+
+    async def coin_mapping(self):
+        mapping = await self.provider.coin_mapping()
+        _write_json(self._path("coins"), mapping)
+        return mapping
+
+    async def markets(self, ids):
+        markets = await self.provider.markets(ids)
+        if self._markets is None:
+            self._markets = _read_json(self._path("markets"), {})
+        self._markets.update(markets)
+        return markets
@@ -0,0 +1,97 @@
+# Ограничение частоты запросов к провайдерам данных
+import asyncio
+import time
+
+
+class Throttled(Exception):
+    """
+    Провайдер отклонил запрос из-за превышения лимита
+    """
+
+    def __init__(self, retry_after, rate=None):
+        """
+        :param retry_after: Через сколько секунд можно повторить запрос
+        :param rate: Допустимая частота запросов (в секунду),
+            если провайдер ее сообщил
+        """
+        super().__init__(f"Превышен лимит запросов, "
+                         f"повтор через {retry_after} с")
+        self.retry_after = retry_after
+        self.rate = rate
+
+
+class Unavailable(Throttled):
+    """
+    Провайдер временно недоступен: тайм-аут, обрыв соединения или 5xx.
+    В отличие от отказа по лимиту, такие отказы подряд размыкают
+    автоматический выключатель (retry.CircuitBreaker)
+    """
+
+    def __init__(self, retry_after=None):
+        """
+        :param retry_after: Через сколько секунд можно повторить запрос,
+            если сервер это сообщил; иначе паузу выбирает RetryPolicy
+        """
+        Exception.__init__(self, "Провайдер временно недоступен")
+        self.retry_after = retry_after
+        self.rate = None
+
+
+def retry_after(response, default=10):
+    """
+    :param response: HTTP-ответ сервера с отказом
+    :param default: Пауза, если сервер ее не указал
+    :return: Пауза перед повтором из заголовка Retry-After (в секундах)
+    """
+    value = response.headers.get('Retry-After')
+    return int(value) if value and value.isdigit() else default
+
+
+class TokenBucket:
+    """
+    Асинхронное ведро токенов: не более rate запросов в секунду
+    с допустимым всплеском до capacity запросов
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Скорость пополнения ведра (токенов в секунду)
+        :param capacity: Емкость ведра (по умолчанию равна rate)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Ждет, пока в ведре появится токен, и забирает его
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def throttle(self, rate=None):
+        """
+        Реакция на отказ провайдера: опустошаем ведро,
+        чтобы остальные запросы шли с установившейся скоростью,
+        и при необходимости снижаем скорость до лимита провайдера.
+        После отказа скорость только снижается: лимит из заголовка
+        может быть общим на несколько методов и выше допустимого
+        :param rate: Частота запросов, сообщенная провайдером
+        """
+        self._refill()
+        self._tokens = 0
+        if rate:
+            self.rate = min(self.rate, rate)
+            self.capacity = min(self.capacity, max(rate, 1))
@@ -0,0 +1,219 @@
+# Повтор запросов к провайдерам: ограниченное число попыток,
+# экспоненциальная пауза со случайным разбросом и автоматический
+# выключатель на каждый хост
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+
+from instrumentation import REGISTRY
+from ratelimit import Throttled, Unavailable
+
+# Число попыток одного запроса, включая первую
+MAX_ATTEMPTS = 6
+# Пауза перед первым повтором и верхняя граница паузы (в секундах)
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# Сколько отказов подряд размыкают выключатель и на сколько секунд
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+
+class RetriesExhausted(Exception):
+    """
+    Запрос не удался за все отведенные попытки
+    """
+
+    def __init__(self, host, attempts):
+        super().__init__(f"{host}: запрос не удался за {attempts} попыток")
+        self.host = host
+        self.attempts = attempts
+
+
+class CircuitOpen(Exception):
+    """
+    Выключатель хоста разомкнут: запрос не отправляется
+    """
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} недоступен, повтор через {retry_in:.0f} с")
+        self.host = host
+        self.retry_in = retry_in
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Число попыток и расчет паузы перед повтором
+    """
+    attempts: int = MAX_ATTEMPTS
+    base_delay: float = BASE_DELAY
+    max_delay: float = MAX_DELAY
+
+    def delay(self, attempt, retry_after=None, rng=random):
+        """
+        Экспоненциальная пауза с разбросом в половину величины, чтобы
+        обработчики, получившие отказ одновременно, не повторяли запросы
+        тоже одновременно. Пауза, которую назвал сервер (Retry-After,
+        ratelimit_reset), не сокращается
+        :param attempt: Номер неудачной попытки, начиная с 0
+        :param retry_after: Пауза, названная сервером (в секундах)
+        :param rng: Генератор случайных чисел
+        :return: Пауза перед следующей попыткой (в секундах)
+        """
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = backoff / 2 + rng.uniform(0, backoff / 2)
+        if retry_after:
+            delay = max(delay, retry_after + rng.uniform(0, self.base_delay))
+        return delay
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель хоста. После threshold отказов
+    Unavailable подряд размыкается: запросы к хосту сразу завершаются
+    CircuitOpen, не занимая обработчики. Через reset_timeout пропускает
+    один пробный запрос, остальные по-прежнему завершаются CircuitOpen:
+    успех пробы замыкает выключатель, отказ снова размыкает.
+    Отказы по лимиту (429) выключатель не учитывает — их снимает пауза
+    """
+
+    def __init__(self, host, threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT, clock=time.monotonic):
+        """
+        :param host: Имя хоста (провайдера) для сообщений и счетчиков
+        :param threshold: Число отказов подряд, размыкающее выключатель
+        :param reset_timeout: Время до пробного запроса (в секундах)
+        :param clock: Источник монотонного времени
+        """
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = None
+        # Пробный запрос уже выполняется
+        self.probing = False
+
+    @property
+    def state(self):
+        """
+        :return: closed, open или half_open
+        """
+        if self.opened is None:
+            return "closed"
+        if self.clock() - self.opened < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def check(self):
+        """
+        :return: True, если запрос пропущен как пробный: его исход
+            нужно сообщить через success, failure или release
+        :raise CircuitOpen: Если выключатель разомкнут или пробный
+            запрос уже выполняется
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        REGISTRY.inc("circuit_rejected_total", host=self.host)
+        raise CircuitOpen(self.host, max(self.reset_timeout -
+                                         (self.clock() - self.opened), 0))
+
+    def release(self):
+        """
+        Снимает пробный запрос, не давший ответа о доступности хоста
+        (отказ по лимиту, отмена): пробу сделает следующий запрос
+        """
+        self.probing = False
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or (self.opened is None and
+                                         self.failures >= self.threshold):
+            self.opened = self.clock()
+            REGISTRY.inc("circuit_opened_total", host=self.host)
+            print(f"{self.host}: {self.failures} отказов подряд, "
+                  f"запросы приостановлены на {self.reset_timeout:.0f} с")
+
+
+# Выключатели процесса по именам хостов
+BREAKERS = {}
+
+
+def breaker(host):
+    """
+    :param host: Имя хоста (провайдера)
+    :return: Общий для процесса выключатель хоста
+    """
+    if host not in BREAKERS:
+        BREAKERS[host] = CircuitBreaker(host)
+    return BREAKERS[host]
+
+
+async def retry_call(call, host, policy=DEFAULT_POLICY, before=None,
+                     on_throttled=None, on_unavailable=None, name=None):
+    """
+    Выполняет запрос с повторами: при отказе Throttled ждет паузу
+    policy.delay и повторяет, не более policy.attempts попыток.
+    Остальные исключения пробрасываются без повтора
+    :param call: Корутина-функция без аргументов, выполняющая запрос
+    :param host: Имя хоста: у каждого хоста свой выключатель
+    :param policy: Политика повторов RetryPolicy
+    :param before: Корутина-функция, вызываемая перед каждой попыткой
+        (например, получение токена ограничителя частоты)
+    :param on_throttled: Функция, вызываемая с исключением при каждом
+        отказе по лимиту (429)
+    :param on_unavailable: Функция, вызываемая с исключением при каждой
+        недоступности провайдера (Unavailable)
+    :param name: Имя этапа для счетчиков повторов (метка stage),
+        по умолчанию host
+    :return: Результат запроса
+    :raise RetriesExhausted: Если все попытки завершились отказом
+    :raise CircuitOpen: Если выключатель хоста разомкнут
+    """
+    circuit = breaker(host)
+    stage = name or host
+    for attempt in range(policy.attempts):
+        probe = circuit.check()
+        try:
+            if before is not None:
+                await before()
+            result = await call()
+        except Throttled as e:
+            # Недоступность хоста — не отказ по лимиту: она размыкает
+            # выключатель, но не меняет частоту запросов
+            if isinstance(e, Unavailable):
+                circuit.failure()
+                if on_unavailable is not None:
+                    on_unavailable(e)
+            else:
+                if probe:
+                    circuit.release()
+                if on_throttled is not None:
+                    on_throttled(e)
+            if attempt + 1 == policy.attempts:
+                raise RetriesExhausted(host, policy.attempts) from e
+            delay = policy.delay(attempt, e.retry_after)
+            REGISTRY.inc("retries_total", stage=stage)
+            REGISTRY.inc("backoff_seconds_total", delay, stage=stage)
+            await asyncio.sleep(delay)
+        except BaseException:
+            if probe:
+                circuit.release()
+            raise
+        else:
+            circuit.success()
+            return result
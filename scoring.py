@@ -0,0 +1,293 @@
+# Векторизованный расчет метрик и рейтингов по всей вселенной активов
+import numpy as np
+import pandas as pd
+
+from candle_store import CRYPTO_HISTORY_DAYS, STOCK_HISTORY_DAYS, window_start
+
+# Веса компонент рейтинга акций
+STOCK_WEIGHTS = {
+    "pe": 0.4,
+    "pb": 0.3,
+    "returns": 0.2,
+    "liquidity": 0.1
+}
+
+# Веса компонент рейтинга криптовалют
+CRYPTO_WEIGHTS = {
+    "nvt": 0.3,
+    "pv": 0.2,
+    "returns": 0.3,
+    "liquidity": 0.1,
+    "volatility": 0.1
+}
+
+
+def candle_table(store, keys, interval="1D", since=None):
+    """
+    Собирает свечи инструментов из хранилища в одну таблицу
+    длинного формата, сгруппированную по активу и упорядоченную по времени
+    :param store: Хранилище свечей CandleStore
+    :param keys: FIGI акций или instId криптовалютных пар
+    :param interval: Интервал свечей
+    :param since: Использовать только свечи не раньше этого времени (мс)
+    :return: DataFrame с колонками asset (категория), ts, close, volume
+    """
+    keys = list(keys)
+    columns = {"ts": [np.empty(0, dtype=np.int64)],
+               "close": [np.empty(0)], "volume": [np.empty(0)]}
+    lengths = np.zeros(len(keys), dtype=np.int64)
+    for i, key in enumerate(keys):
+        # Копируем только нужные колонки: memory-map файла закрывается
+        # сразу, и на большом рынке не кончаются файловые дескрипторы
+        candles = store.load(key, interval, since)
+        lengths[i] = len(candles)
+        for name, arrays in columns.items():
+            arrays.append(np.array(candles[name]))
+    codes = np.repeat(np.arange(len(keys)), lengths)
+    return pd.DataFrame({
+        "asset": pd.Categorical.from_codes(codes, categories=pd.Index(
+            keys, dtype=object)),
+        **{name: np.concatenate(arrays) for name, arrays in columns.items()}
+    })
+
+
+def candle_stats(candles):
+    """
+    Считает статистики свечей для всех активов за один проход:
+    группы задаются границами отрезков, а суммы и максимумы
+    по группам считаются через np.ufunc.reduceat
+    :param candles: Таблица свечей (см. candle_table)
+    :return: DataFrame, индексированный активом, с колонками count,
+        first_close, last_close, mean_volume, volatility (стандартное
+        отклонение дневного изменения, %) и max_volatility
+        (максимальное по модулю дневное изменение, %)
+    """
+    asset = candles['asset']
+    if not isinstance(asset.dtype, pd.CategoricalDtype):
+        asset = asset.astype('category')
+    codes = asset.cat.codes.to_numpy()
+    categories = asset.cat.categories
+    ts = candles['ts'].to_numpy()
+    close = candles['close'].to_numpy(dtype=np.float64)
+    volume = candles['volume'].to_numpy(dtype=np.float64)
+
+    # Упорядочиваем свечи по активу и времени, если это еще не так
+    if len(codes) > 1 and ((np.diff(codes) < 0).any() or
+                           ((np.diff(codes) == 0) &
+                            (np.diff(ts) < 0)).any()):
+        order = np.lexsort((ts, codes))
+        codes, close, volume = codes[order], close[order], volume[order]
+
+    count = np.bincount(codes, minlength=len(categories))
+    present = count > 0
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))[present]
+    ends = starts + count[present] - 1
+    lengths = count[present]
+
+    # Дневное изменение цены; первая свеча каждого актива не имеет пары
+    pct = np.empty_like(close)
+    pct[0:1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct[1:] = close[1:] / close[:-1] - 1
+    pct[starts] = np.nan
+    valid = ~np.isnan(pct)
+
+    n = np.add.reduceat(valid, starts)
+    total = np.add.reduceat(np.where(valid, pct, 0), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        # Двухпроходная дисперсия с поправкой Бесселя, как в pandas
+        deviation = np.where(valid, pct - np.repeat(mean, lengths), 0)
+        squares = np.add.reduceat(deviation ** 2, starts)
+        std = np.where(n > 1, np.sqrt(squares / (n - 1)), np.nan)
+        max_abs = np.fmax.reduceat(np.abs(pct), starts)
+    mean_volume = np.add.reduceat(volume, starts) / lengths
+
+    stats = pd.DataFrame({
+        "count": count,
+        "first_close": np.nan,
+        "last_close": np.nan,
+        "mean_volume": np.nan,
+        "volatility": np.nan,
+        "max_volatility": np.nan
+    }, index=categories)
+    stats.loc[present, "first_close"] = close[starts]
+    stats.loc[present, "last_close"] = close[ends]
+    stats.loc[present, "mean_volume"] = mean_volume
+    stats.loc[present, "volatility"] = std * 100
+    stats.loc[present, "max_volatility"] = max_abs * 100
+    return stats
+
+
+def ladder_score(ratio, steps):
+    """
+    Ступенчатая оценка коэффициента: чем он ниже, тем выше оценка
+    :param ratio: Массив коэффициентов (NaN и 0 - нет данных)
+    :param steps: Пары (порог, оценка) по возрастанию порога
+    :return: Массив оценок
+    """
+    ratio = np.asarray(ratio, dtype=np.float64)
+    known = ~np.isnan(ratio) & (ratio != 0)
+    return np.select([known & (ratio < limit) for limit, _ in steps],
+                     [score for _, score in steps], 0.0)
+
+
+def rate(components, weights):
+    """
+    :param components: DataFrame с оценками компонент рейтинга
+        (колонки <компонента>_score)
+    :param weights: Веса компонент
+    :return: Взвешенный рейтинг
+    """
+    return sum(weight * components[f"{name}_score"]
+               for name, weight in weights.items())
+
+
+def stock_components(stats, shares):
+    """
+    Считает метрики акций и оценки компонент рейтинга
+    :param stats: Статистики свечей, индексированные FIGI (candle_stats)
+    :param shares: DataFrame акций с колонками figi, ticker,
+        issue_size и nominal
+    :return: DataFrame с колонками ticker, pe, pb, returns, liquidity
+        и оценками компонент
+    """
+    stats = stats.reindex(shares['figi'])
+    count = stats['count'].fillna(0).to_numpy()
+    issue_size = shares['issue_size'].to_numpy(dtype=np.float64)
+    nominal = shares['nominal'].to_numpy(dtype=np.float64)
+    has_candles = count > 0
+
+    last_price = np.where(has_candles, stats['last_close'], 0)
+    first_price = stats['first_close'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Доходность
+        returns = np.where(has_candles,
+                           (last_price - first_price) / first_price * 100, 0)
+        # Средний объем торгов
+        liquidity = np.where(has_candles, stats['mean_volume'], 0)
+        # Условная чистая прибыль (10% от капитализации) на акцию
+        eps = np.where(issue_size != 0,
+                       last_price * issue_size * 0.1 / issue_size, np.nan)
+        # Коэффициент P/E
+        pe = np.where((eps != 0) & ~np.isnan(eps), last_price / eps, np.nan)
+        # Коэффициент P/B: цена к балансовой стоимости на акцию
+        pb = np.where((issue_size != 0) & (nominal != 0),
+                      last_price / nominal, np.nan)
+
+    return pd.DataFrame({
+        "ticker": shares['ticker'].to_numpy(),
+        "pe": pe,
+        "pb": pb,
+        "returns": returns,
+        "liquidity": liquidity,
+        "pe_score": ladder_score(pe, [(15, 1), (25, 0.25)]),
+        "pb_score": ladder_score(pb, [(1.5, 1), (3, 0.5)]),
+        # Нормализуем доходность и ликвидность в диапазон [0,1]
+        "returns_score": np.clip(returns / 10, 0, 1),
+        "liquidity_score": np.clip(liquidity / 1_000_000, 0, 1)
+    })
+
+
+def crypto_components(stats, tickers):
+    """
+    Считает метрики криптовалют и оценки компонент рейтинга
+    :param stats: Статистики свечей, индексированные instId (candle_stats)
+    :param tickers: DataFrame пар с колонками instId, last, vol24h,
+        transaction_volume_usd и circulating_supply
+    :return: DataFrame с колонками symbol, returns, volatility, liquidity
+        и оценками компонент
+    """
+    stats = stats.reindex(tickers['instId'])
+    count = stats['count'].fillna(0).to_numpy()
+    has_candles = count > 0
+    price = tickers['last'].to_numpy(dtype=np.float64) # Текущая цена
+    # Объем торгов за 24 часа
+    liquidity = tickers['vol24h'].to_numpy(dtype=np.float64)
+    transaction_volume = tickers['transaction_volume_usd'].to_numpy(
+        dtype=np.float64)
+    supply = tickers['circulating_supply'].to_numpy(dtype=np.float64)
+
+    first_close = stats['first_close'].to_numpy()
+    last_close = stats['last_close'].to_numpy()
+    max_volatility = stats['max_volatility'].to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Доходность и волатильность
+        returns = np.where(has_candles,
+                           (last_close - first_close) / first_close * 100, 0)
+        volatility = np.where(has_candles, stats['volatility'], 0)
+        # Рыночная капитализация и коэффициент NVT
+        nvt_ratio = price * supply / transaction_volume
+        nvt_score = np.where(transaction_volume > 0, 1 / (nvt_ratio + 1), 0)
+        # Отношение цены к объему
+        pv_ratio = price / liquidity
+        pv_score = np.where(liquidity > 0, 1 / (pv_ratio + 1), 0)
+        volatility_score = np.where(
+            ~np.isnan(max_volatility) & (max_volatility != 0),
+            1 - np.minimum(volatility / max_volatility, 1), 0)
+
+    return pd.DataFrame({
+        "symbol": tickers['instId'].to_numpy(),
+        "returns": returns,
+        "volatility": volatility,
+        "liquidity": liquidity,
+        "nvt_score": nvt_score,
+        "pv_score": pv_score,
+        # Нормализуем оценки в диапазон [0,1]
+        "returns_score": np.clip(returns / 10, 0, 1),
+        "liquidity_score": np.clip(liquidity / 1_000_000, 0, 1),
+        "volatility_score": volatility_score
+    })
+
+
+def score_stocks(candles, shares, weights=None):
+    """
+    :param candles: Таблица свечей акций (см. candle_table)
+    :param shares: DataFrame акций (см. stock_components)
+    :param weights: Веса компонент рейтинга (по умолчанию STOCK_WEIGHTS)
+    :return: DataFrame с метриками и рейтингом акций
+    """
+    weights = weights or STOCK_WEIGHTS
+    components = stock_components(candle_stats(candles), shares)
+    metrics = components[["ticker", "pe", "pb", "returns", "liquidity"]]
+    return metrics.assign(rating=rate(components, weights))
+
+
+def score_crypto(candles, tickers, weights=None):
+    """
+    :param candles: Таблица свечей криптовалют (см. candle_table)
+    :param tickers: DataFrame пар (см. crypto_components)
+    :param weights: Веса компонент рейтинга (по умолчанию CRYPTO_WEIGHTS)
+    :return: DataFrame с метриками и рейтингом криптовалют
+    """
+    weights = weights or CRYPTO_WEIGHTS
+    components = crypto_components(candle_stats(candles), tickers)
+    metrics = components[["symbol", "returns", "volatility", "liquidity"]]
+    return metrics.assign(rating=rate(components, weights))
+
+
+def score_universe(store, shares, pairs, stock_weights=None,
+                   crypto_weights=None):
+    """
+    Рассчитывает метрики всех активов по свечам из хранилища.
+    Справочники инструментов сохраняются в хранилище при загрузке,
+    поэтому рейтинг можно пересчитать с новыми весами без провайдеров:
+    score_universe(store, store.load_instruments("stocks"),
+                   store.load_instruments("crypto"), ...)
+    :param store: Хранилище свечей CandleStore
+    :param shares: DataFrame акций (см. stock_components)
+    :param pairs: DataFrame криптовалютных пар (см. crypto_components)
+    :param stock_weights: Веса компонент рейтинга акций
+    :param crypto_weights: Веса компонент рейтинга криптовалют
+    :return: DataFrame с метриками в формате all_metrics.csv
+    """
+    stocks = score_stocks(
+        candle_table(store, shares['figi'],
+                     since=window_start(STOCK_HISTORY_DAYS)),
+        shares, stock_weights)
+    crypto = score_crypto(
+        candle_table(store, pairs['instId'],
+                     since=window_start(CRYPTO_HISTORY_DAYS)),
+        pairs, crypto_weights)
+    return pd.concat([stocks, crypto], ignore_index=True)
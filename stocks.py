@@ -0,0 +1,257 @@
+# Загрузка акций через Tinkoff Invest API
+# Tinkoff SDK импортируется только в адаптере TinkoffProvider,
+# чтобы конвейер работал и с другими провайдерами (например, replay)
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from candle_store import (CANDLE_DTYPE, STOCK_HISTORY_DAYS, CandleStore,
+                          window_start)
+from checkpoint import Checkpoint
+from fetcher import FetchStats, fetch_all
+from instrumentation import REGISTRY, instrumented
+from ratelimit import Throttled, TokenBucket, Unavailable
+from retry import retry_call
+
+# Частота запросов свечей по умолчанию (в секунду), уточняется
+# по метаданным лимита, которые Tinkoff присылает при отказе
+CANDLES_RATE = 5
+# Число одновременных запросов свечей
+CANDLES_CONCURRENCY = 8
+
+
+def quotation(value):
+    """
+    :param value: Денежное значение Tinkoff (units + nano)
+    :return: Значение в виде float
+    """
+    return value.units + value.nano / 1e9
+
+
+def candles_to_array(candles):
+    """
+    :param candles: Свечи Tinkoff
+    :return: Массив свечей CANDLE_DTYPE
+    """
+    return np.array([
+        (int(candle.time.timestamp() * 1000), quotation(candle.open),
+         quotation(candle.high), quotation(candle.low),
+         quotation(candle.close), candle.volume)
+        for candle in candles
+    ], dtype=CANDLE_DTYPE)
+
+
+def parse_ratelimit(limit):
+    """
+    Разбирает заголовок лимита Tinkoff вида "600, 600;w=60"
+    :param limit: Значение ratelimit_limit из метаданных ответа
+    :return: Допустимая частота запросов в секунду или None
+    """
+    if not limit:
+        return None
+    try:
+        count, _, policy = str(limit).partition(',')
+        window = policy.split('w=')[-1] if 'w=' in policy else 60
+        return int(count) / int(window)
+    except ValueError:
+        return None
+
+
+def raise_transient(error):
+    """
+    Преобразует временные ошибки Tinkoff в исключения для повтора
+    :param error: Ошибка запроса tinkoff.invest.RequestError
+    :raise Throttled: Если превышен лимит: повтор через ratelimit_reset
+    :raise Unavailable: Если сервис временно недоступен
+    """
+    from grpc import StatusCode
+
+    metadata = error.metadata
+    if error.code == StatusCode.RESOURCE_EXHAUSTED:
+        ratelimit_reset = 10
+        if getattr(metadata, "ratelimit_reset", None) is not None:
+            ratelimit_reset = int(metadata.ratelimit_reset)
+        raise Throttled(ratelimit_reset, parse_ratelimit(
+            getattr(metadata, "ratelimit_limit", None)))
+    if error.code in (StatusCode.UNAVAILABLE, StatusCode.DEADLINE_EXCEEDED):
+        raise Unavailable()
+
+
+async def get_candles(client, figi, start, end):
+    """
+    Получает дневные свечи по одной акции
+    :param client: Асинхронный клиент Tinkoff (или совместимая заглушка)
+    :param figi: Уникальный идентификатор финансового инструмента
+    :param start: Начало периода
+    :param end: Конец периода
+    :return: Список свечей
+    """
+    from tinkoff.invest import CandleInterval, RequestError
+
+    try:
+        history = await client.market_data.get_candles(
+            figi=figi,
+            from_=start,
+            to=end,
+            interval=CandleInterval.CANDLE_INTERVAL_DAY
+        )
+    except RequestError as e:
+        raise_transient(e)
+        # Остальные ошибки относятся к конкретной бумаге
+        REGISTRY.inc("instrument_errors_total", provider="tinkoff")
+        REGISTRY.item(f"Проблема с {figi}: {e}")
+        return []
+
+    return history.candles
+
+
+class TinkoffProvider:
+    """
+    Провайдер акций Tinkoff Invest API: shares() и candles(figi, start).
+    Используется как асинхронный контекстный менеджер
+    """
+
+    def __init__(self, token):
+        """
+        :param token: Токен Tinkoff Invest API
+        """
+        self.token = token
+        self._client = None
+        self.client = None
+
+    async def __aenter__(self):
+        from tinkoff.invest import AsyncClient
+
+        self._client = AsyncClient(self.token)
+        self.client = await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.__aexit__(*exc_info)
+
+    @instrumented("tinkoff", "shares")
+    async def shares(self):
+        """
+        :return: Список словарей с данными акций (см. share_record)
+        """
+        from tinkoff.invest import RequestError
+
+        try:
+            response = await self.client.instruments.shares()
+        except RequestError as e:
+            raise_transient(e)
+            raise
+        return [share_record(share) for share in response.instruments]
+
+    @instrumented("tinkoff", "candles")
+    async def candles(self, figi, start=None):
+        """
+        :param figi: Уникальный идентификатор финансового инструмента
+        :param start: Начало периода (мс), по умолчанию начало окна истории;
+            свечи загружаются до текущего момента
+        :return: Массив свечей CANDLE_DTYPE
+        """
+        if start is None:
+            start = window_start(STOCK_HISTORY_DAYS)
+        return candles_to_array(await get_candles(
+            self.client, figi,
+            datetime.fromtimestamp(start / 1000, timezone.utc),
+            datetime.now(timezone.utc)))
+
+
+async def fetch_stock_candles(provider, shares, store, days=STOCK_HISTORY_DAYS,
+                              rate=CANDLES_RATE,
+                              concurrency=CANDLES_CONCURRENCY, stats=None):
+    """
+    Параллельно догружает дневные свечи по списку акций в хранилище:
+    запрашиваются только свечи после последней сохраненной
+    :param provider: Провайдер акций (TinkoffProvider)
+    :param shares: Список акций (словари с ключом figi)
+    :param store: Хранилище свечей CandleStore
+    :param days: Глубина истории в днях
+    :param rate: Частота запросов (в секунду)
+    :param concurrency: Число одновременных запросов
+    :param stats: Объект FetchStats для накопления статистики
+    :return: Асинхронный генератор загруженных акций
+    """
+    since = window_start(days)
+
+    async def fetch_one(share):
+        start = store.fetch_start(share['figi'], "1D", since)
+        return await provider.candles(share['figi'], start)
+
+    async for share, candles in fetch_all(shares, fetch_one,
+                                          TokenBucket(rate), concurrency,
+                                          stats, name="tinkoff_candles",
+                                          host="tinkoff"):
+        store.append(share['figi'], "1D", candles)
+        yield share
+
+
+SHARE_COLUMNS = ["figi", "ticker", "issue_size", "nominal"]
+
+
+def share_record(share):
+    """
+    :param share: Акция Tinkoff
+    :return: Словарь с данными акции для контрольной точки
+    """
+    return {
+        "figi": share.figi,
+        "ticker": share.ticker,
+        "issue_size": share.issue_size,
+        "nominal": quotation(share.nominal)
+    }
+
+
+def shares_table(records):
+    """
+    :param records: Словари с данными акций (см. share_record)
+    :return: DataFrame акций с колонками figi, ticker, issue_size, nominal
+    """
+    return pd.DataFrame(records, columns=SHARE_COLUMNS)
+
+
+async def collect_stocks(provider, store=None, checkpoint=None,
+                         progress=False, **kwargs):
+    """
+    Загружает все акции и догружает их свечи в хранилище.
+    Завершенные акции отмечаются в контрольной точке: при перезапуске
+    после сбоя они пропускаются
+    :param provider: Провайдер акций (TinkoffProvider)
+    :param store: Хранилище свечей CandleStore
+    :param checkpoint: Контрольная точка Checkpoint
+    :param progress: Показывать индикатор выполнения по каждой акции
+    :param kwargs: Параметры fetch_stock_candles (rate, concurrency, days)
+    :return: DataFrame акций (см. shares_table)
+    """
+    stats = FetchStats()
+    store = store if store is not None else CandleStore()
+    checkpoint = checkpoint if checkpoint is not None else Checkpoint("stocks")
+
+    async with provider:
+        # Получаем список всех доступных акций
+        shares = await retry_call(provider.shares, "tinkoff",
+                                  name="tinkoff_shares")
+        pending = [share for share in shares
+                   if share['figi'] not in checkpoint]
+
+        with checkpoint, tqdm(total=len(shares),
+                              initial=len(shares) - len(pending),
+                              desc="Акции", unit="акция",
+                              disable=not progress) as bar:
+            async for share in fetch_stock_candles(
+                    provider, pending, store, stats=stats, **kwargs):
+                checkpoint.add(share['figi'], share)
+                bar.update()
+
+    print(f"Загружено {stats}")
+    # Порядок акций как в справочнике, а не в порядке завершения загрузки
+    order = {share['figi']: i for i, share in enumerate(shares)}
+    shares = shares_table(sorted(checkpoint.records(),
+                                 key=lambda record: order.get(record["figi"],
+                                                              len(order))))
+    store.save_instruments("stocks", shares)
+    return shares
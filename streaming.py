@@ -0,0 +1,546 @@
+# Потоковое обновление рейтингов по тикам внутри дня
+import argparse
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from candle_store import (CRYPTO_HISTORY_DAYS, DAY_MS, STOCK_HISTORY_DAYS,
+                          CandleStore, window_start)
+from instrumentation import REGISTRY
+from metrics import CRYPTO, STOCK, Metrics
+from portfolio import (MAX_ASSETS, MIN_LIQUIDITY, build_portfolio,
+                       print_portfolio, select_assets, top_k)
+from retry import retry_call
+from scoring import (CRYPTO_WEIGHTS, STOCK_WEIGHTS, candle_table,
+                     crypto_components, rate, stock_components)
+
+# Период пересчета рейтингов измененных активов (в секундах)
+REFRESH_INTERVAL = 0.1
+# Частота тиков имитируемого потока (в секунду)
+TICK_RATE = 1000
+# Период опроса тикеров OKX (в секундах)
+POLL_INTERVAL = 1.0
+
+
+@dataclass
+class Tick:
+    """
+    Обновление текущей дневной свечи инструмента
+    """
+    key: str  # FIGI акции или instId криптовалютной пары
+    ts: int  # Время сделки (мс)
+    price: float  # Последняя цена — закрытие текущей свечи
+    volume: float = None  # Объем текущей свечи, если известен
+
+
+class RollingWindow:
+    """
+    Скользящее окно дневных свечей по каждому активу с суммами,
+    из которых статистики candle_stats получаются за O(1).
+    Тик внутри дня меняет только последнюю свечу и поправляет суммы
+    на одно дневное изменение цены. Новый день добавляет свечу,
+    сдвигает окно и пересчитывает суммы актива по окну — раз в сутки
+    на актив, то есть O(1) в среднем на тик
+    """
+
+    def __init__(self, candles, size, days):
+        """
+        :param candles: Таблица свечей (см. scoring.candle_table),
+            коды актива — номера строк окна
+        :param size: Число активов
+        :param days: Глубина окна в днях
+        """
+        self.days = days
+        codes = candles['asset'].cat.codes.to_numpy()
+        close = candles['close'].to_numpy(dtype=np.float64)
+        volume = candles['volume'].to_numpy(dtype=np.float64)
+        count = np.bincount(codes, minlength=size)
+        # Кольцевые буферы: в окне не больше days + 1 дневных свечей.
+        # Свечи дневные, поэтому время хранится номером дня
+        self.capacity = int(max(count.max(initial=0), days + 1)) + 1
+        self.day = np.zeros((size, self.capacity), dtype=np.int32)
+        self.close = np.full((size, self.capacity), np.nan)
+        self.volume = np.zeros((size, self.capacity))
+        self.head = np.zeros(size, dtype=np.int64)
+        self.count = count.astype(np.int64)
+
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        position = np.arange(len(codes)) - starts[codes]
+        self.day[codes, position] = candles['ts'].to_numpy() // DAY_MS
+        self.close[codes, position] = close
+        self.volume[codes, position] = volume
+
+        # Начальные суммы по всем активам за один проход, как в candle_stats
+        self.n_pct = np.zeros(size, dtype=np.int64)
+        self.sum_pct = np.zeros(size)
+        self.sum_sq = np.zeros(size)
+        self.current_pct = np.full(size, np.nan)
+        self.max_done = np.full(size, np.nan)
+        self.sum_volume = np.zeros(size)
+        present = count > 0
+        if not present.any():
+            return
+        starts, ends = starts[present], (starts + count - 1)[present]
+        pct = np.empty_like(close)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct[1:] = close[1:] / close[:-1] - 1
+        pct[starts] = np.nan
+        valid = ~np.isnan(pct)
+        values = np.where(valid, pct, 0)
+        self.n_pct[present] = np.add.reduceat(valid, starts)
+        self.sum_pct[present] = np.add.reduceat(values, starts)
+        self.sum_sq[present] = np.add.reduceat(values ** 2, starts)
+        self.current_pct[present] = pct[ends]
+        done = np.abs(pct)
+        done[ends] = np.nan
+        with np.errstate(invalid='ignore'):
+            self.max_done[present] = np.fmax.reduceat(done, starts)
+        self.sum_volume[present] = np.add.reduceat(volume, starts)
+
+    def _slot(self, i, k):
+        return (self.head[i] + k) % self.capacity
+
+    def _candles(self, i, column):
+        """
+        :return: Значения колонки по свечам окна актива i по порядку
+        """
+        slots = (self.head[i] + np.arange(self.count[i])) % self.capacity
+        return column[i, slots]
+
+    def _recompute(self, i):
+        """
+        Пересчитывает суммы актива i по всему окну
+        """
+        close = self._candles(i, self.close)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = close[1:] / close[:-1] - 1
+        valid = pct[~np.isnan(pct)]
+        self.n_pct[i] = len(valid)
+        self.sum_pct[i] = valid.sum()
+        self.sum_sq[i] = (valid ** 2).sum()
+        self.current_pct[i] = pct[-1] if len(pct) else np.nan
+        self.max_done[i] = (np.nanmax(np.abs(pct[:-1]))
+                            if len(pct) > 1 and not np.isnan(pct[:-1]).all()
+                            else np.nan)
+        self.sum_volume[i] = self._candles(i, self.volume).sum()
+
+    def _shift_pct(self, i, old, new):
+        """
+        Заменяет в суммах дневное изменение old на new
+        """
+        if not np.isnan(old):
+            self.n_pct[i] -= 1
+            self.sum_pct[i] -= old
+            self.sum_sq[i] -= old * old
+        if not np.isnan(new):
+            self.n_pct[i] += 1
+            self.sum_pct[i] += new
+            self.sum_sq[i] += new * new
+        self.current_pct[i] = new
+
+    def update(self, i, ts, price, volume=None):
+        """
+        :param i: Номер актива
+        :param ts: Время тика (мс)
+        :param price: Последняя цена
+        :param volume: Объем текущей дневной свечи
+        :return: False, если тик старше последней свечи и пропущен
+        """
+        count = self.count[i]
+        last = self._slot(i, count - 1)
+        day = ts // DAY_MS
+        if count and day == self.day[i, last]:
+            # Тот же день: меняется только последняя свеча
+            if count > 1:
+                previous = self.close[i, self._slot(i, count - 2)]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    pct = price / previous - 1
+                self._shift_pct(i, self.current_pct[i], pct)
+            self.close[i, last] = price
+            if volume is not None:
+                self.sum_volume[i] += volume - self.volume[i, last]
+                self.volume[i, last] = volume
+            return True
+        if count and day < self.day[i, last]:
+            return False
+
+        # Новый день: добавляем свечу и сдвигаем окно
+        if count == self.capacity:
+            self.head[i] = (self.head[i] + 1) % self.capacity
+            self.count[i] -= 1
+        slot = self._slot(i, self.count[i])
+        self.day[i, slot] = day
+        self.close[i, slot] = price
+        self.volume[i, slot] = volume or 0.0
+        self.count[i] += 1
+        # В окне остаются свечи за последние days дней до тика
+        start = (ts - self.days * DAY_MS) // DAY_MS
+        while self.count[i] > 1 and self.day[i, self.head[i]] < start:
+            self.head[i] = (self.head[i] + 1) % self.capacity
+            self.count[i] -= 1
+        self._recompute(i)
+        return True
+
+    def last_close(self):
+        """
+        :return: Последние цены закрытия всех активов
+        """
+        rows = np.arange(len(self.count))
+        return self.close[rows, self._slot(rows, self.count - 1)]
+
+    def last_volume(self):
+        """
+        :return: Объемы последних свечей всех активов
+        """
+        rows = np.arange(len(self.count))
+        return self.volume[rows, self._slot(rows, self.count - 1)]
+
+    def stats(self, rows, index):
+        """
+        :param rows: Номера активов
+        :param index: Ключи этих активов
+        :return: DataFrame в формате scoring.candle_stats
+        """
+        count = self.count[rows]
+        present = count > 0
+        n = self.n_pct[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.sum_pct[rows] / n
+            variance = (self.sum_sq[rows] - n * mean ** 2) / (n - 1)
+            std = np.where(n > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+            mean_volume = self.sum_volume[rows] / count
+        first = self.close[rows, self.head[rows]]
+        last = self.close[rows, self._slot(rows, count - 1)]
+        max_abs = np.fmax(self.max_done[rows],
+                          np.abs(self.current_pct[rows]))
+        return pd.DataFrame({
+            "count": count,
+            "first_close": np.where(present, first, np.nan),
+            "last_close": np.where(present, last, np.nan),
+            "mean_volume": np.where(present, mean_volume, np.nan),
+            "volatility": np.where(present, std * 100, np.nan),
+            "max_volatility": np.where(present, max_abs * 100, np.nan)
+        }, index=pd.Index(index, dtype=object))
+
+
+class StreamingRatings:
+    """
+    Рейтинги всех активов, обновляемые по тикам. Тики меняют
+    скользящие окна за O(1); refresh() пересчитывает рейтинги только
+    измененных активов теми же формулами, что и scoring, и обновляет
+    лучшие n активов на месте: полный отбор нужен, только если
+    актив из лучших опустился до порога отбора
+    """
+
+    def __init__(self, store, shares, pairs, n=MAX_ASSETS,
+                 min_liquidity=MIN_LIQUIDITY, stock_weights=None,
+                 crypto_weights=None):
+        """
+        :param store: Хранилище свечей CandleStore
+        :param shares: DataFrame акций (см. stocks.shares_table)
+        :param pairs: DataFrame криптовалютных пар (см. crypto.PAIR_COLUMNS)
+        :param n: Число лучших активов
+        :param min_liquidity: Минимальная ликвидность актива
+        :param stock_weights: Веса компонент рейтинга акций
+        :param crypto_weights: Веса компонент рейтинга криптовалют
+        """
+        self.shares = shares.reset_index(drop=True)
+        self.pairs = pairs.reset_index(drop=True)
+        self.n = n
+        self.min_liquidity = min_liquidity
+        self.weights = (stock_weights or STOCK_WEIGHTS,
+                        crypto_weights or CRYPTO_WEIGHTS)
+        self.keys = (self.shares['figi'].tolist(),
+                     self.pairs['instId'].tolist())
+        self.windows = tuple(
+            RollingWindow(candle_table(store, keys, since=window_start(days)),
+                          len(keys), days)
+            for keys, days in zip(self.keys, (STOCK_HISTORY_DAYS,
+                                              CRYPTO_HISTORY_DAYS)))
+        # Строки акций идут первыми, как в score_universe
+        self.offsets = (0, len(self.keys[STOCK]))
+        self.index = {key: (code, row)
+                      for code, keys in enumerate(self.keys)
+                      for row, key in enumerate(keys)}
+        self.price = self.pairs['last'].to_numpy(dtype=np.float64).copy()
+        self.dirty = (set(), set())
+        self.received = []
+        self.ticks = 0
+        self.refreshes = 0
+
+        columns = [self._score(code, np.arange(len(keys)))
+                   for code, keys in enumerate(self.keys)]
+        self.metrics = Metrics.from_columns(
+            self.shares['ticker'].tolist() + self.keys[CRYPTO],
+            np.repeat([STOCK, CRYPTO], [len(keys) for keys in self.keys]),
+            **{name: np.concatenate([part[name] for part in columns])
+               for name in columns[0]})
+        self.top = select_assets(self.metrics, n, min_liquidity)
+
+    def _score(self, code, rows):
+        """
+        :param code: STOCK или CRYPTO
+        :param rows: Номера активов внутри класса
+        :return: Словарь колонок метрик (см. metrics.NUMERIC_COLUMNS)
+        """
+        stats = self.windows[code].stats(rows,
+                                         [self.keys[code][r] for r in rows])
+        nan = np.full(len(rows), np.nan)
+        if code == STOCK:
+            components = stock_components(stats, self.shares.iloc[rows])
+            pe, pb = components['pe'].to_numpy(), components['pb'].to_numpy()
+            volatility = nan
+        else:
+            components = crypto_components(
+                stats, self.pairs.iloc[rows].assign(last=self.price[rows]))
+            pe = pb = nan
+            volatility = components['volatility'].to_numpy()
+        return {
+            "pe": pe,
+            "pb": pb,
+            "returns": components['returns'].to_numpy(),
+            "volatility": volatility,
+            "liquidity": components['liquidity'].to_numpy(),
+            "rating": rate(components, self.weights[code]).to_numpy()
+        }
+
+    def apply(self, tick):
+        """
+        :param tick: Тик Tick
+        :return: True, если тик относится к известному активу и учтен
+        """
+        location = self.index.get(tick.key)
+        if location is None:
+            return False
+        code, row = location
+        if not self.windows[code].update(row, tick.ts, tick.price,
+                                         tick.volume):
+            return False
+        if code == CRYPTO:
+            self.price[row] = tick.price
+        self.dirty[code].add(row)
+        self.received.append(time.perf_counter())
+        self.ticks += 1
+        return True
+
+    def refresh(self):
+        """
+        Пересчитывает рейтинги активов, измененных после прошлого вызова
+        :return: True, если изменился состав или порядок лучших активов
+        """
+        if not self.received:
+            return False
+        previous = self.top
+        previous_rating = self.metrics.rating[previous].copy()
+        changed = []
+        for code, dirty in enumerate(self.dirty):
+            if not dirty:
+                continue
+            rows = np.fromiter(sorted(dirty), dtype=np.int64,
+                               count=len(dirty))
+            dirty.clear()
+            target = rows + self.offsets[code]
+            for name, values in self._score(code, rows).items():
+                getattr(self.metrics, name)[target] = values
+            changed.append(target)
+        self.top = self._rerank(np.concatenate(changed), previous,
+                                previous_rating)
+
+        now = time.perf_counter()
+        for received in self.received:
+            REGISTRY.observe("stream_tick_to_rating_seconds", now - received)
+        self.received.clear()
+        self.refreshes += 1
+        return not np.array_equal(previous, self.top)
+
+    def _rerank(self, changed, top, top_rating):
+        """
+        :param changed: Номера активов с новыми рейтингами
+        :param top: Лучшие активы до изменения
+        :param top_rating: Их рейтинги до изменения
+        :return: Лучшие активы после изменения
+        """
+        metrics = self.metrics
+        # Рейтинги остальных активов не выше рейтинга последнего
+        # из лучших. Если актив из лучших опустился до этого порога
+        # или стал неликвидным, его может заменить любой актив
+        threshold = top_rating[-1] if len(top) == self.n else -np.inf
+        rating = metrics.rating[top]
+        if ((rating < top_rating) & (rating <= threshold)).any() or (
+                metrics.liquidity[top] < self.min_liquidity).any():
+            return select_assets(metrics, self.n, self.min_liquidity)
+        # Иначе новые лучшие — среди прежних лучших и измененных
+        candidates = np.union1d(top, changed[metrics.liquidity[changed] >=
+                                             self.min_liquidity])
+        return top_k(metrics.rating, candidates, self.n)
+
+    def portfolio(self, capital):
+        """
+        :param capital: Капитал ($)
+        :return: Portfolio из текущих лучших активов
+        """
+        return build_portfolio(self.metrics.take(self.top), capital,
+                               n=self.n, min_liquidity=self.min_liquidity)
+
+    def last_prices(self):
+        """
+        :return: Ключи всех активов, их последние цены и объемы свечей
+        """
+        return (self.keys[STOCK] + self.keys[CRYPTO],
+                np.concatenate([window.last_close()
+                                for window in self.windows]),
+                np.concatenate([window.last_volume()
+                                for window in self.windows]))
+
+
+async def simulated_feed(keys, prices, volumes, rate=TICK_RATE,
+                         interval=REFRESH_INTERVAL, speed=1.0, seed=0,
+                         volatility=0.002):
+    """
+    Имитируемый поток тиков: случайное блуждание цен случайно
+    выбранных активов
+    :param keys: Ключи активов
+    :param prices: Начальные цены
+    :param volumes: Начальные объемы текущих свечей
+    :param rate: Число тиков в секунду
+    :param interval: Период выдачи пачек тиков (в секундах)
+    :param speed: Ускорение времени тиков относительно реального
+        (86400 — сутки за секунду)
+    :param seed: Начальное значение генератора
+    :param volatility: Стандартное отклонение изменения цены за тик
+    :return: Асинхронный генератор пачек (списков) тиков
+    """
+    rng = np.random.default_rng(seed)
+    prices = np.where(np.isnan(prices), 1.0, prices)
+    volumes = np.nan_to_num(np.asarray(volumes, dtype=np.float64)).copy()
+    started = time.time()
+    day = None
+    for batch in itertools.count(1):
+        now = int((started + (time.time() - started) * speed) * 1000)
+        if day is not None and now // DAY_MS != day:
+            # Новые дневные свечи начинаются с нулевого объема
+            volumes[:] = 0
+        day = now // DAY_MS
+        size = max(1, int(rate * interval))
+        chosen = rng.integers(0, len(keys), size)
+        prices[chosen] *= np.exp(rng.normal(0, volatility, size))
+        volumes[chosen] += rng.exponential(100, size)
+        yield [Tick(keys[i], now, float(prices[i]), float(volumes[i]))
+               for i in chosen.tolist()]
+        # Пачки выдаются по расписанию, время обработки не снижает частоту
+        await asyncio.sleep(max(0.0, started + batch * interval -
+                                time.time()))
+
+
+async def okx_ticker_feed(okx, interval=POLL_INTERVAL):
+    """
+    Поток тиков из тикеров OKX: один запрос отдает последние цены
+    всех спотовых пар, в поток попадают пары с изменившейся ценой
+    :param okx: Открытый провайдер OKX (crypto.OkxProvider)
+    :param interval: Период опроса (в секундах)
+    :return: Асинхронный генератор пачек (списков) тиков
+    """
+    seen = {}
+    while True:
+        tickers = await retry_call(okx.tickers, "okx", name="okx_stream")
+        ticks = []
+        for ticker in tickers:
+            tick = Tick(ticker['instId'], int(ticker['ts']),
+                        float(ticker['last']))
+            if seen.get(tick.key) != tick.price:
+                seen[tick.key] = tick.price
+                ticks.append(tick)
+        yield ticks
+        await asyncio.sleep(interval)
+
+
+async def stream(ratings, feed, on_change=None, duration=None):
+    """
+    Применяет тики из потока и после каждой пачки пересчитывает
+    рейтинги измененных активов
+    :param ratings: StreamingRatings
+    :param feed: Асинхронный генератор пачек тиков
+    :param on_change: Функция без аргументов, вызываемая при изменении
+        лучших активов
+    :param duration: Длительность (в секундах), по умолчанию без ограничения
+    """
+    deadline = time.perf_counter() + duration if duration else None
+    async for ticks in feed:
+        for tick in ticks:
+            ratings.apply(tick)
+        if ratings.refresh() and on_change is not None:
+            on_change()
+        if deadline and time.perf_counter() >= deadline:
+            break
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Потоковое обновление рейтингов по тикам")
+    parser.add_argument("--store", default="candles",
+                        help="директория хранилища свечей")
+    parser.add_argument("--feed", choices=["simulated", "okx"],
+                        default="simulated", help="источник тиков")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE,
+                        help="тиков в секунду имитируемого потока")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="ускорение времени имитируемого потока")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="длительность в секундах (0 — без ограничения)")
+    parser.add_argument("--top-n", type=int, default=MAX_ASSETS,
+                        help="число лучших активов")
+    parser.add_argument("--min-liquidity", type=float, default=MIN_LIQUIDITY,
+                        help="минимальная ликвидность актива")
+    parser.add_argument("--capital", type=float, default=10_000,
+                        help="капитал портфолио ($)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = CandleStore(args.store)
+    started = time.perf_counter()
+    ratings = StreamingRatings(store, store.load_instruments("stocks"),
+                               store.load_instruments("crypto"),
+                               args.top_n, args.min_liquidity)
+    print(f"Активов: {len(ratings.metrics)}, окна построены за "
+          f"{time.perf_counter() - started:.2f} с")
+
+    def on_change():
+        top = ratings.metrics.take(ratings.top)
+        print("Лучшие активы: " + ", ".join(
+            f"{asset} ({rating:.3f})"
+            for asset, rating in zip(top.asset, top.rating)))
+
+    async def run():
+        if args.feed == "okx":
+            from crypto import OkxProvider
+
+            async with OkxProvider() as okx:
+                await stream(ratings, okx_ticker_feed(okx), on_change,
+                             args.duration)
+        else:
+            feed = simulated_feed(*ratings.last_prices(), rate=args.tick_rate,
+                                  speed=args.speed)
+            await stream(ratings, feed, on_change, args.duration)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+    latency = REGISTRY.histograms.get(("stream_tick_to_rating_seconds", ()))
+    print(f"Тиков: {ratings.ticks}, пересчетов: {ratings.refreshes}")
+    if latency:
+        print(f"Задержка от тика до рейтинга: "
+              f"p50 {latency.quantile(0.5) * 1000:.0f} мс, "
+              f"p95 {latency.quantile(0.95) * 1000:.0f} мс")
+    print_portfolio(ratings.portfolio(args.capital))
+
+
+if __name__ == "__main__":
+    main()
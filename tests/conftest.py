@@ -0,0 +1,23 @@
+# Тесты импортируют модули проекта из корня репозитория
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retry  # noqa: E402
+from instrumentation import REGISTRY  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """
+    Выключатели хостов и счетчики общие для процесса:
+    каждый тест начинает с чистых
+    """
+    retry.BREAKERS.clear()
+    REGISTRY.reset()
+    yield
+    retry.BREAKERS.clear()
+    REGISTRY.reset()
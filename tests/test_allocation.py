@@ -0,0 +1,195 @@
+# Проекция на ограниченный симплекс и распределители капитала
+import numpy as np
+import pytest
+
+from allocation import (ALLOCATORS, bounded_weights, make_allocator,
+                        mean_variance, rank_weights, risk_parity)
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from metrics import CRYPTO, STOCK, Metrics
+from portfolio import build_portfolio
+
+EPSILON = 1e-9
+
+
+def bisection(values, lower, upper):
+    """
+    Та же проекция поиском tau делением пополам: эталон для сравнения
+    """
+    low, high = values.min() - upper, values.max() - lower
+    for _ in range(200):
+        tau = (low + high) / 2
+        if np.clip(values - tau, lower, upper).sum() > 1:
+            low = tau
+        else:
+            high = tau
+    return np.clip(values - (low + high) / 2, lower, upper)
+
+
+def random_covariance(rng, count):
+    factors = rng.normal(size=(count, count + 5)) * 0.1
+    return factors @ factors.T + np.eye(count) * 1e-4
+
+
+def test_bounded_weights_sum_to_one_within_bounds():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        count = int(rng.integers(1, 40))
+        lower = rng.uniform(0, 1 / count)
+        upper = rng.uniform(1 / count, 1)
+        values = rng.normal(scale=rng.choice([0.01, 1, 100]), size=count)
+
+        weights = bounded_weights(values, lower, upper)
+
+        assert weights.sum() == pytest.approx(1, abs=EPSILON)
+        assert weights.min() >= lower - EPSILON
+        assert weights.max() <= upper + EPSILON
+        np.testing.assert_allclose(weights, bisection(values, lower, upper),
+                                   atol=1e-9)
+
+
+def test_bounded_weights_with_infeasible_bounds():
+    # Верхняя граница не дает вложить весь капитал
+    np.testing.assert_array_equal(bounded_weights([3, 2, 1], 0.01, 0.3),
+                                  [0.3, 0.3, 0.3])
+    # Нижняя граница оставляет только равные доли
+    np.testing.assert_allclose(bounded_weights([3, 2, 1, 0], 0.25, 0.9),
+                               [0.25] * 4)
+    assert len(bounded_weights([], 0.01, 0.3)) == 0
+
+
+def test_rank_weights_follow_rank_and_capacity():
+    weights = rank_weights(120, 0.01, 0.3)
+
+    assert weights.sum() == pytest.approx(1)
+    assert np.all(np.diff(weights[:100]) <= EPSILON)
+    assert weights[:100].min() >= 0.01 - EPSILON
+    # Сверх 1 / lower = 100 активов купить нельзя
+    assert not weights[100:].any()
+
+
+def test_mean_variance_beats_feasible_portfolios():
+    rng = np.random.default_rng(1)
+    count = 12
+    covariance = random_covariance(rng, count)
+    mean = rng.normal(0.1, 0.2, size=count)
+
+    def utility(weights):
+        return mean @ weights - 2.5 * weights @ covariance @ weights
+
+    weights = mean_variance(mean, covariance, 0.01, 0.3, risk_aversion=5)
+
+    assert weights.sum() == pytest.approx(1)
+    assert weights.min() >= 0.01 - EPSILON
+    assert weights.max() <= 0.3 + EPSILON
+    for _ in range(200):
+        other = bounded_weights(rng.dirichlet(np.ones(count)), 0.01, 0.3)
+        assert utility(weights) >= utility(other) - 1e-9
+
+
+def test_risk_parity_equalizes_risk_contributions():
+    rng = np.random.default_rng(2)
+    covariance = random_covariance(rng, 8)
+
+    weights = risk_parity(covariance, 0.0, 1.0)
+    contributions = weights * (covariance @ weights)
+
+    assert weights.sum() == pytest.approx(1)
+    np.testing.assert_allclose(contributions, contributions.mean(),
+                               rtol=1e-6)
+
+
+def store_with_prices(root, assets, days=120):
+    """
+    :return: Хранилище с дневными свечами случайного блуждания
+    """
+    rng = np.random.default_rng(3)
+    store = CandleStore(str(root))
+    ts = (np.arange(days) + 20_000) * DAY_MS
+    for i, asset in enumerate(assets):
+        close = 100 * np.exp(np.cumsum(rng.normal(0.001 * i, 0.02 * (i + 1),
+                                                  size=days)))
+        store.append(asset, "1D", np.array(
+            list(zip(ts, close, close, close, close, np.ones(days))),
+            dtype=CANDLE_DTYPE))
+    return store
+
+
+def chosen_metrics(assets, asset_class):
+    count = len(assets)
+    return Metrics.from_columns(
+        assets, [asset_class] * count, pe=np.ones(count), pb=np.ones(count),
+        returns=np.zeros(count), volatility=np.zeros(count),
+        liquidity=np.full(count, 1e6), rating=np.linspace(1, 0.5, count))
+
+
+@pytest.mark.parametrize("name", sorted(ALLOCATORS))
+def test_allocators_respect_bounds(tmp_path, name):
+    assets = ["A-USDT", "B-USDT", "C-USDT", "D-USDT"]
+    allocator = make_allocator(name, store_with_prices(tmp_path, assets))
+
+    weights = allocator.weights(chosen_metrics(assets, CRYPTO), 0.1, 0.4)
+
+    assert weights.sum() == pytest.approx(1)
+    assert weights.min() >= 0.1 - EPSILON
+    assert weights.max() <= 0.4 + EPSILON
+
+
+def test_covariance_allocator_without_stock_instruments(tmp_path):
+    # Справочника акций нет: доходности нулевые, доли остаются допустимыми
+    allocator = make_allocator("risk_parity", CandleStore(str(tmp_path)))
+
+    weights = allocator.weights(chosen_metrics(["SBER", "GAZP"], STOCK),
+                                0.1, 0.9)
+
+    np.testing.assert_allclose(weights, [0.5, 0.5])
+
+
+@pytest.mark.parametrize("name", sorted(ALLOCATORS))
+def test_portfolio_accounts_for_every_dollar(tmp_path, name):
+    assets = [f"{letter}-USDT" for letter in "ABCDEFGHIJKL"]
+    store = store_with_prices(tmp_path, assets)
+
+    portfolio = build_portfolio(chosen_metrics(assets, CRYPTO), 10_000,
+                                allocator=make_allocator(name, store))
+
+    assert len(portfolio.asset) == 10
+    assert (portfolio.allocation.sum() + portfolio.commission +
+            portfolio.remaining_capital) == pytest.approx(10_000)
+    assert portfolio.percentage.max() <= 30 + EPSILON
+
+
+def test_bounded_weights_fall_back_to_rank_on_bad_input():
+    weights = bounded_weights([0.5, np.nan, np.inf, 0.1], 0.05, 0.6)
+
+    np.testing.assert_allclose(weights, rank_weights(4, 0.05, 0.6))
+
+
+def test_risk_parity_with_zero_variance():
+    covariance = np.diag([0.04, 0.0, 0.09])
+
+    weights = risk_parity(covariance, 0.1, 0.8)
+
+    assert np.isfinite(weights).all()
+    assert weights.sum() == pytest.approx(1)
+    assert weights.argmax() == 1
+    np.testing.assert_allclose(risk_parity(np.zeros((3, 3)), 0.1, 0.8),
+                               [1 / 3] * 3)
+
+
+@pytest.mark.parametrize("name", ["mean_variance", "risk_parity"])
+def test_allocators_survive_bad_prices(tmp_path, name):
+    assets = ["A-USDT", "B-USDT", "C-USDT"]
+    store = store_with_prices(tmp_path, assets)
+    candles = np.array(store.load("B-USDT", "1D"))
+    candles['close'][-10] = 0
+    candles['close'][-5] = -1
+    store.append("B-USDT", "1D", candles[-10:])
+
+    allocator = make_allocator(name, store)
+    returns = allocator.returns(chosen_metrics(assets, CRYPTO))
+    weights = allocator.weights(chosen_metrics(assets, CRYPTO), 0.1, 0.8)
+
+    assert np.isfinite(returns).all()
+    assert not returns[-10:-8, 1].any()
+    assert weights.sum() == pytest.approx(1)
+    assert weights.min() >= 0.1 - EPSILON
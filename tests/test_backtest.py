@@ -0,0 +1,164 @@
+# Бэктест: подготовка оценок, проигрыш стратегии и перебор в пуле
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import (COMPONENTS, BacktestData, prepare, run_backtest,
+                      sweep, weight_grid)
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from metrics import CRYPTO, STOCK
+from portfolio import COMMISSION, rank_percentages, select_assets
+from scoring import CRYPTO_WEIGHTS, STOCK_WEIGHTS
+
+START_DAY = 20_000
+
+
+def random_data(rng, days=200, assets=15, rebalance_days=20):
+    """
+    :return: BacktestData со случайными ценами, оценками и ликвидностью;
+        часть активов начинает торговаться позже
+    """
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.03,
+                                               size=(days, assets)), axis=0))
+    listed = rng.integers(0, days // 2, size=assets)
+    prices[np.arange(days)[:, None] < listed] = np.nan
+    rebalance = np.arange(30, days, rebalance_days)
+    liquidity = rng.choice([1e3, 1e6], size=(len(rebalance), assets))
+    liquidity[np.isnan(prices[rebalance])] = np.nan
+    return BacktestData(
+        prices=prices, rebalance=rebalance,
+        components=rng.random((len(rebalance), assets, len(COMPONENTS))),
+        liquidity=liquidity,
+        asset_class=rng.choice([STOCK, CRYPTO], size=assets).astype(np.int8))
+
+
+def replay(data, n):
+    """
+    Эталон: портфель как число купленных единиц каждого актива и остаток
+    в деньгах, стоимость пересчитывается каждый день
+    """
+    stock = np.array([STOCK_WEIGHTS.get(name, 0) for name in COMPONENTS])
+    crypto = np.array([CRYPTO_WEIGHTS.get(name, 0) for name in COMPONENTS])
+    is_stock = data.asset_class == STOCK
+    units = np.zeros(data.prices.shape[1])
+    cash = 1.0
+    curve = []
+    rebalance = list(data.rebalance) + [len(data.prices) - 1]
+    for r, (day, next_day) in enumerate(zip(rebalance, rebalance[1:])):
+        price = np.nan_to_num(data.prices[day])
+        equity = cash + units @ price
+        rating = np.where(is_stock, data.components[r] @ stock,
+                          data.components[r] @ crypto)
+        selected = select_assets(
+            SimpleNamespace(rating=rating, liquidity=data.liquidity[r],
+                            asset_class=data.asset_class), n, 10_000)
+        target = np.zeros_like(units)
+        target[selected] = rank_percentages(len(selected)) / 100
+        held = units * price / equity
+        equity *= 1 - np.abs(target - held).sum() * COMMISSION
+        units = np.zeros_like(units)
+        units[selected] = target[selected] * equity / price[selected]
+        cash = equity * (1 - target.sum())
+        for today in range(day if not curve else day + 1, next_day + 1):
+            curve.append(cash + units @ np.nan_to_num(data.prices[today]))
+    return np.array(curve)
+
+
+def test_run_backtest_matches_unit_replay():
+    rng = np.random.default_rng(0)
+    for n in (1, 3, 10):
+        data = random_data(rng)
+
+        result = run_backtest(data, n=n)
+
+        curve = replay(data, n)
+        drawdown = 1 - curve / np.maximum.accumulate(curve)
+        assert result["total_return"] == pytest.approx(
+            (curve[-1] - 1) * 100)
+        assert result["max_drawdown"] == pytest.approx(drawdown.max() * 100)
+
+
+def test_run_backtest_single_asset():
+    # Одна ребалансировка, цена растет вдвое; доля актива ограничена 30%
+    prices = np.linspace(1, 2, 11)[:, None]
+    data = BacktestData(prices=prices, rebalance=np.array([0]),
+                        components=np.ones((1, 1, len(COMPONENTS))),
+                        liquidity=np.full((1, 1), 1e6),
+                        asset_class=np.array([CRYPTO], dtype=np.int8))
+
+    result = run_backtest(data, n=1)
+
+    equity = 1 - 0.3 * COMMISSION
+    assert result["total_return"] == pytest.approx(
+        (equity * (0.7 + 0.3 * 2) - 1) * 100)
+    # Кривая начинается после комиссии, а цена только растет
+    assert result["max_drawdown"] == 0
+    assert result["turnover"] == pytest.approx(30)
+
+
+def test_sweep_matches_sequential_runs():
+    data = random_data(np.random.default_rng(1))
+    configs = [{"stock_weights": weights, "crypto_weights": CRYPTO_WEIGHTS,
+                "n": n}
+               for weights in weight_grid(list(STOCK_WEIGHTS), 0.5)
+               for n in (2, 5)]
+
+    results = sweep(data, configs, workers=2, chunksize=3)
+
+    assert results == [{**config, **run_backtest(data, **config)}
+                       for config in configs]
+
+
+def test_weight_grid_sums_to_one():
+    grid = weight_grid(["a", "b", "c"], 0.25)
+
+    assert len(grid) == 15
+    assert all(sum(weights.values()) == pytest.approx(1) for weights in grid)
+
+
+def synthetic_store(root, days):
+    store = CandleStore(str(root))
+    rng = np.random.default_rng(2)
+    keys = ["FIGI1", "FIGI2", "BTC-USDT", "ETH-USDT"]
+    for i, key in enumerate(keys):
+        # Второй актив появляется позже остальных
+        first = START_DAY + (days // 2 if i == 1 else 0)
+        ts = np.arange(first, START_DAY + days) * DAY_MS
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, size=len(ts))))
+        store.append(key, "1D", np.array(
+            list(zip(ts, close, close, close, close,
+                     np.full(len(ts), 1e6 * (i + 1)))), dtype=CANDLE_DTYPE))
+    shares = pd.DataFrame({"figi": keys[:2], "ticker": ["AAA", "BBB"],
+                           "issue_size": [1e6, 1e6], "nominal": [50, 200]})
+    pairs = pd.DataFrame({"instId": keys[2:], "transaction_volume_usd":
+                          [1e9, 1e8], "circulating_supply": [2e7, 1e8]})
+    return store, shares, pairs
+
+
+def test_prepare_scores_each_rebalance_window(tmp_path):
+    store, shares, pairs = synthetic_store(tmp_path, 100)
+
+    data = prepare(store, shares, pairs, lookback=30, rebalance_days=25)
+
+    assert data.prices.shape == (100, 4)
+    np.testing.assert_array_equal(data.rebalance, [30, 55, 80])
+    assert data.components.shape == (3, 4, len(COMPONENTS))
+    assert np.isfinite(data.components).all()
+    np.testing.assert_array_equal(data.asset_class,
+                                  [STOCK, STOCK, CRYPTO, CRYPTO])
+    # Актив до начала торгов не отбирается
+    assert np.isnan(data.liquidity[0, 1])
+    assert np.isfinite(data.liquidity[1:, 1]).all()
+    # Ликвидность — средний объем окна, у пар — объем последней свечи
+    np.testing.assert_allclose(data.liquidity[0], [1e6, np.nan, 3e6, 4e6])
+
+
+def test_prepare_rejects_short_history(tmp_path):
+    store, shares, pairs = synthetic_store(tmp_path, 20)
+
+    with pytest.raises(ValueError):
+        prepare(store, shares, pairs, lookback=30)
+    with pytest.raises(ValueError):
+        prepare(CandleStore(str(tmp_path / "empty")), shares, pairs)
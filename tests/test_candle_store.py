@@ -0,0 +1,85 @@
+# Инкрементальное хранилище свечей
+import os
+
+import numpy as np
+
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore, price_matrix
+
+START = 20_000 * DAY_MS
+
+
+def daily(first, closes):
+    """
+    :param first: Номер первого дня от START
+    :param closes: Цены закрытия по дням
+    :return: Массив свечей CANDLE_DTYPE
+    """
+    ts = START + (first + np.arange(len(closes))) * DAY_MS
+    closes = np.asarray(closes, dtype=np.float64)
+    return np.array(list(zip(ts, closes, closes, closes, closes,
+                             np.ones(len(closes)))), dtype=CANDLE_DTYPE)
+
+
+def test_append_replaces_overlap_without_duplicates(tmp_path):
+    store = CandleStore(str(tmp_path))
+    store.append("BTC-USDT", "1D", daily(0, [1, 2, 3]))
+
+    # Последняя свеча была незакрытой: она приходит снова с новой ценой
+    start = store.fetch_start("BTC-USDT", "1D", START)
+    assert start == START + 2 * DAY_MS
+    store.append("BTC-USDT", "1D", daily(2, [3.5, 4, 5])[::-1])
+
+    candles = store.load("BTC-USDT", "1D")
+    np.testing.assert_array_equal(candles['ts'],
+                                  START + np.arange(5) * DAY_MS)
+    np.testing.assert_array_equal(candles['close'], [1, 2, 3.5, 4, 5])
+
+
+def test_append_repeated_batch_is_idempotent(tmp_path):
+    store = CandleStore(str(tmp_path))
+    batch = daily(0, [1, 2, 3])
+
+    store.append("SBER", "1D", batch)
+    store.append("SBER", "1D", batch)
+    store.append("SBER", "1D", batch[:0])
+
+    np.testing.assert_array_equal(store.load("SBER", "1D"), batch)
+    assert store.last_timestamp("SBER", "1D") == START + 2 * DAY_MS
+    assert os.listdir(os.path.dirname(store.path("SBER", "1D"))) == [
+        "SBER.npy"]
+
+
+def test_fetch_start_and_window(tmp_path):
+    store = CandleStore(str(tmp_path))
+
+    assert store.fetch_start("ETH-USDT", "1D", START) == START
+    assert not len(store.load("ETH-USDT", "1D"))
+
+    store.append("ETH-USDT", "1D", daily(0, [1, 2, 3, 4]))
+
+    # Сохраненная история старше начала окна: грузим с начала окна
+    later = START + 10 * DAY_MS
+    assert store.fetch_start("ETH-USDT", "1D", later) == later
+    np.testing.assert_array_equal(
+        store.load("ETH-USDT", "1D", since=START + 2 * DAY_MS)['close'],
+        [3, 4])
+
+
+def test_keys_are_safe_file_names(tmp_path):
+    store = CandleStore(str(tmp_path))
+
+    store.append("A/B USDT", "1D", daily(0, [1]))
+
+    assert os.path.basename(store.path("A/B USDT", "1D")) == "A_B_USDT.npy"
+    assert store.last_timestamp("A/B USDT", "1D") == START
+
+
+def test_price_matrix_carries_last_price_forward():
+    history = [daily(1, [10, 11])[[0]], daily(0, [1, 2, 3, 4])[[0, 3]],
+               daily(0, [])]
+
+    prices = price_matrix(history, START // DAY_MS, 4)
+
+    np.testing.assert_array_equal(prices[:, :2],
+                                  [[np.nan, 1], [10, 1], [10, 1], [10, 4]])
+    assert np.isnan(prices[:, 2]).all()
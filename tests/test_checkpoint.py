@@ -0,0 +1,119 @@
+# Контрольные точки: продолжение сбора после сбоя
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from checkpoint import Checkpoint
+from crypto import collect_crypto
+from fundamentals import FundamentalsCache
+
+
+def test_records_survive_restart(tmp_path):
+    with Checkpoint("stocks", str(tmp_path), batch_size=2) as checkpoint:
+        for i in range(5):
+            checkpoint.add(f"FIGI{i}", {"figi": f"FIGI{i}", "price": i})
+
+    resumed = Checkpoint("stocks", str(tmp_path))
+
+    assert len(resumed) == 5
+    assert "FIGI3" in resumed and "FIGI5" not in resumed
+    assert [record["price"] for record in resumed.records()] == list(range(5))
+
+
+def test_unfinished_batch_is_ignored(tmp_path):
+    checkpoint = Checkpoint("crypto", str(tmp_path))
+    checkpoint.add("BTC-USDT", {"instId": "BTC-USDT"})
+    checkpoint.flush()
+    # Сбой при записи следующей пачки: запись без манифеста
+    # и недописанная строка
+    with open(checkpoint.records_path, "a", encoding="utf-8") as file:
+        file.write('{"key": "ETH-USDT", "record": {"instId": "ETH-USDT"}}\n')
+        file.write('{"key": "SOL-USDT", "rec')
+
+    resumed = Checkpoint("crypto", str(tmp_path))
+    resumed.add("XRP-USDT", {"instId": "XRP-USDT"})
+
+    assert "ETH-USDT" not in resumed
+    assert [record["instId"] for record in resumed.records()] == [
+        "BTC-USDT", "XRP-USDT"]
+
+
+def test_checkpoint_from_previous_day_is_discarded(tmp_path):
+    with Checkpoint("stocks", str(tmp_path)) as checkpoint:
+        checkpoint.add("FIGI0", {"figi": "FIGI0"})
+    yesterday = time.time() - 24 * 60 * 60
+    os.utime(checkpoint.manifest_path, (yesterday, yesterday))
+
+    resumed = Checkpoint("stocks", str(tmp_path))
+
+    assert len(resumed) == 0
+    assert list(resumed.records()) == []
+
+
+class FakeExchange:
+    """
+    OKX и CoinGecko в памяти. Запрос свечей пары из broken
+    завершается ошибкой, прерывающей сбор
+    """
+
+    def __init__(self, symbols, broken=()):
+        self.symbols = symbols
+        self.broken = set(broken)
+        self.requested = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def tickers(self):
+        return [{"instId": f"{symbol}-USDT", "last": "1.5", "vol24h": "100"}
+                for symbol in self.symbols]
+
+    async def candles(self, inst_id, since=None):
+        if inst_id in self.broken:
+            raise RuntimeError("сбой загрузки")
+        self.requested.append(inst_id)
+        ts = (np.arange(3) + 20_000) * DAY_MS
+        return np.array([(t, 1, 1, 1, 1, 1) for t in ts], dtype=CANDLE_DTYPE)
+
+    async def coin_mapping(self):
+        return {symbol.lower(): symbol.lower() for symbol in self.symbols}
+
+    async def markets(self, ids):
+        return {coingecko_id: {"transaction_volume_usd": 10.0,
+                               "circulating_supply": 5.0}
+                for coingecko_id in ids}
+
+
+def test_collect_crypto_resumes_after_failure(tmp_path):
+    symbols = [f"C{i}" for i in range(20)]
+    store = CandleStore(str(tmp_path / "candles"))
+    root = str(tmp_path / "checkpoint")
+
+    def collect(exchange):
+        return asyncio.run(collect_crypto(
+            exchange, exchange, store, FundamentalsCache(path=None),
+            Checkpoint("crypto", root, batch_size=3), rate=1000,
+            concurrency=1, coingecko_rate=1000))
+
+    with pytest.raises(RuntimeError):
+        collect(FakeExchange(symbols, broken=["C10-USDT"]))
+    stored = Checkpoint("crypto", root)
+    assert len(stored) == 10
+
+    exchange = FakeExchange(symbols)
+    pairs = collect(exchange)
+
+    # Загружаются только пары, не попавшие в контрольную точку
+    assert sorted(exchange.requested) == sorted(
+        f"{symbol}-USDT" for symbol in symbols[10:])
+    assert pairs["instId"].tolist() == [f"{s}-USDT" for s in symbols]
+    assert (pairs["circulating_supply"] == 5.0).all()
+    saved = store.load_instruments("crypto")
+    assert saved["instId"].tolist() == pairs["instId"].tolist()
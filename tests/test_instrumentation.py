@@ -0,0 +1,39 @@
+# Вывод счетчиков в текстовом формате Prometheus
+from instrumentation import Registry
+
+
+def parse(text):
+    """
+    :return: Словарь {строка метрики с метками: значение}
+    """
+    return dict(line.rsplit(" ", 1) for line in text.splitlines()
+                if not line.startswith("#"))
+
+
+def test_counters_keep_full_precision():
+    registry = Registry()
+    registry.inc("provider_bytes_total", 123456789, provider="okx")
+    registry.inc("backoff_seconds_total", 1234567.891, stage="okx")
+
+    values = parse(registry.prometheus())
+
+    assert values['provider_bytes_total{provider="okx"}'] == "123456789"
+    assert float(values['backoff_seconds_total{stage="okx"}']) == 1234567.891
+
+
+def test_histogram_sum_keeps_full_precision():
+    registry = Registry()
+    expected = 0.0
+    for _ in range(3):
+        registry.observe("provider_request_seconds", 123456.7891,
+                         provider="okx", call="candles")
+        expected += 123456.7891
+
+    values = parse(registry.prometheus())
+    labels = '{call="candles",provider="okx"}'
+    total = float(values[f"provider_request_seconds_sum{labels}"])
+
+    assert total == expected
+    assert values[f"provider_request_seconds_count{labels}"] == "3"
+    assert values['provider_request_seconds_bucket'
+                  '{call="candles",provider="okx",le="+Inf"}'] == "3"
@@ -0,0 +1,82 @@
+# Колоночные метрики, словарь имен и хранилище на диске
+import os
+
+import numpy as np
+
+from metrics import (COLUMN_TYPES, CRYPTO, NUMERIC_COLUMNS, STOCK,
+                     AssetDictionary, Metrics, MetricsStore, load_metrics)
+
+NAMES = ["SBER", "BTC-USDT", "Ёлка", "", "ETH-USDT", "GAZP", "名前-USDT"]
+CLASSES = [STOCK, CRYPTO, STOCK, STOCK, CRYPTO, STOCK, CRYPTO]
+
+
+def sample_metrics():
+    rng = np.random.default_rng(0)
+    count = len(NAMES)
+    columns = {name: rng.normal(size=count) for name in NUMERIC_COLUMNS}
+    columns['pe'][2] = np.nan
+    return Metrics.from_columns(NAMES, CLASSES, **columns)
+
+
+def rows(metrics):
+    """
+    :return: Строки метрик как {имя: (класс, колонки...)} для сравнения
+        без учета порядка
+    """
+    return {asset: tuple(float(getattr(metrics, name)[i])
+                         for name in ("asset_class",) + NUMERIC_COLUMNS)
+            for i, asset in enumerate(metrics.asset.tolist())}
+
+
+def test_asset_dictionary_lookups():
+    names = AssetDictionary.from_names(NAMES)
+
+    assert len(names) == len(NAMES)
+    assert names.names() == NAMES
+    assert names[np.int32(2)] == "Ёлка"
+    # Малая выборка декодируется поштучно, большая — целиком
+    assert names[[6]].tolist() == ["名前-USDT"]
+    assert names[np.arange(len(NAMES))[::-1]].tolist() == NAMES[::-1]
+    assert len(AssetDictionary.from_names([])) == 0
+
+
+def test_asset_dictionary_round_trip(tmp_path):
+    AssetDictionary.from_names(NAMES).save(str(tmp_path))
+
+    assert AssetDictionary.load(str(tmp_path)).names() == NAMES
+
+
+def test_store_round_trip_and_partitions(tmp_path):
+    metrics = sample_metrics()
+    store = MetricsStore(str(tmp_path / "metrics"))
+
+    store.save(metrics)
+    loaded = store.load()
+
+    np.testing.assert_equal(rows(loaded), rows(metrics))
+    for name, dtype in COLUMN_TYPES.items():
+        assert getattr(loaded, name).dtype == dtype
+        assert isinstance(getattr(loaded, name), np.memmap)
+    manifest = store.manifest()
+    assert manifest["rows"] == len(NAMES)
+    assert manifest["partitions"] == {"stock": [0, 4], "crypto": [4, 7]}
+    # Внутри раздела сохраняется исходный порядок
+    assert store.load("stock").asset.tolist() == ["SBER", "Ёлка", "",
+                                                  "GAZP"]
+    assert store.load("crypto").asset.tolist() == ["BTC-USDT", "ETH-USDT",
+                                                   "名前-USDT"]
+    np.testing.assert_equal(rows(load_metrics(store.root)), rows(metrics))
+
+
+def test_store_replaces_previous_version(tmp_path):
+    store = MetricsStore(str(tmp_path / "metrics"))
+    store.save(sample_metrics())
+
+    metrics = Metrics.from_columns(
+        ["ONLY-USDT"], [CRYPTO],
+        **{name: [1.5] for name in NUMERIC_COLUMNS})
+    store.save(metrics)
+
+    assert store.load().asset.tolist() == ["ONLY-USDT"]
+    assert store.load("stock").asset.tolist() == []
+    assert sorted(os.listdir(tmp_path)) == ["metrics"]
@@ -0,0 +1,137 @@
+# Отбор лучших активов и распределение капитала клиентов
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from metrics import ASSET_CLASSES, CRYPTO, STOCK, Metrics
+from portfolio import (COMMISSION, build_portfolio, build_portfolios,
+                       save_portfolios, select_assets, top_k)
+
+
+def random_metrics(rng, count):
+    """
+    :return: Метрики со множеством равных рейтингов, пропусками
+        и активами ниже порога ликвидности
+    """
+    rating = rng.integers(0, 20, size=count) / 10
+    rating[rng.random(count) < 0.05] = np.nan
+    return Metrics.from_columns(
+        [f"A{i}" for i in range(count)],
+        rng.choice([STOCK, CRYPTO], size=count),
+        pe=np.ones(count), pb=np.ones(count), returns=np.zeros(count),
+        volatility=np.zeros(count),
+        liquidity=rng.choice([1e3, 1e5, 1e7], size=count),
+        rating=rating)
+
+
+def sorted_selection(metrics, n, min_liquidity, quotas=None):
+    """
+    Эталон: устойчивая сортировка всех кандидатов по убыванию рейтинга
+    и обход по порядку с учетом квот классов
+    """
+    rating = np.nan_to_num(np.asarray(metrics.rating), nan=-np.inf)
+    candidates = np.flatnonzero(metrics.liquidity >= min_liquidity)
+    order = candidates[np.argsort(-rating[candidates], kind='stable')]
+    limits = {ASSET_CLASSES.index(name): quota
+              for name, quota in (quotas or {}).items()}
+    taken = dict.fromkeys(limits, 0)
+    selected = []
+    for index in order.tolist():
+        code = int(metrics.asset_class[index])
+        if code in limits:
+            if taken[code] >= limits[code]:
+                continue
+            taken[code] += 1
+        selected.append(index)
+    return np.array(selected[:n], dtype=np.int64)
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        count = int(rng.integers(0, 60))
+        rating = rng.integers(0, 8, size=count).astype(np.float64)
+        rating[rng.random(count) < 0.1] = np.nan
+        candidates = np.sort(rng.choice(100, size=count, replace=False))
+        values = np.full(100, np.nan)
+        values[candidates] = rating
+        k = int(rng.integers(-1, count + 3))
+
+        chosen = top_k(values, candidates, k)
+
+        order = np.argsort(-np.nan_to_num(rating, nan=-np.inf),
+                           kind='stable')
+        np.testing.assert_array_equal(chosen, candidates[order][:max(k, 0)])
+
+
+@pytest.mark.parametrize("quotas", [
+    None, {"stock": 3}, {"crypto": 0}, {"stock": 2, "crypto": 4},
+    {"stock": 50, "crypto": 50}])
+def test_select_assets_matches_stable_sort(quotas):
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        metrics = random_metrics(rng, int(rng.integers(1, 200)))
+        n = int(rng.integers(1, 15))
+
+        selected = select_assets(metrics, n, 10_000, quotas)
+
+        np.testing.assert_array_equal(
+            selected, sorted_selection(metrics, n, 10_000, quotas))
+
+
+def test_batch_accounts_for_every_dollar():
+    rng = np.random.default_rng(2)
+    metrics = random_metrics(rng, 300)
+    capitals = np.concatenate([[0, 0.01, 1, 999.99],
+                               rng.uniform(10, 1e7, size=200)])
+
+    batch = build_portfolios(metrics, capitals, quotas={"crypto": 4})
+
+    spent = batch.allocation.sum(axis=1)
+    np.testing.assert_allclose(
+        spent + batch.commission + batch.remaining_capital, capitals,
+        rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(batch.commission,
+                               spent * COMMISSION / (1 - COMMISSION))
+    np.testing.assert_allclose(batch.percentage.sum(axis=1), 100)
+    single = build_portfolio(metrics, capitals[-1], quotas={"crypto": 4})
+    np.testing.assert_array_equal(single.allocation, batch.allocation[-1])
+    assert single.commission == batch.commission[-1]
+
+
+def test_saved_parts_read_back(tmp_path):
+    rng = np.random.default_rng(3)
+    metrics = random_metrics(rng, 100)
+    capitals = rng.uniform(100, 1e5, size=25)
+    clients = [f"client {i}" for i in range(24)] + ['Smith, "J"']
+    batch = build_portfolios(metrics, capitals, clients)
+    directory = str(tmp_path / "portfolios")
+    # Лишняя часть от прошлого запуска должна исчезнуть
+    os.makedirs(directory)
+    open(os.path.join(directory, "part-00009.csv"), "w").close()
+
+    paths = save_portfolios(batch, directory, partition_size=10)
+
+    assert [os.path.basename(path) for path in paths] == [
+        "part-00000.csv", "part-00001.csv", "part-00002.csv"]
+    assert sorted(os.listdir(directory)) == sorted(
+        os.path.basename(path) for path in paths)
+    saved = {}
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                saved.setdefault(row["Client"], []).append(row)
+    assert list(saved) == clients
+    for i, client in enumerate(clients):
+        rows = saved[client]
+        portfolio = batch.portfolio(i)
+        assert [row["Asset"] for row in rows] == portfolio.asset.tolist()
+        amounts = [float(row["Allocation ($)"]) for row in rows]
+        np.testing.assert_allclose(amounts, portfolio.allocation,
+                                   atol=0.005)
+        assert float(rows[0]["Capital ($)"]) == pytest.approx(
+            capitals[i], abs=0.005)
+        assert float(rows[0]["Remaining capital ($)"]) == pytest.approx(
+            portfolio.remaining_capital, abs=0.005)
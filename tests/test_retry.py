@@ -0,0 +1,207 @@
+# Повторы запросов и автоматический выключатель
+import asyncio
+import random
+
+import pytest
+
+import retry
+from fetcher import FetchStats, fetch_all
+from instrumentation import REGISTRY
+from ratelimit import Throttled, TokenBucket, Unavailable
+from retry import (CircuitBreaker, CircuitOpen, RetriesExhausted,
+                   RetryPolicy, retry_call)
+
+# Без пауз между попытками
+FAST = RetryPolicy(attempts=3, base_delay=0.0)
+
+
+class Clock:
+    """
+    Управляемое монотонное время для выключателя
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def install(clock, threshold=2, reset_timeout=10.0):
+    """
+    :return: Выключатель хоста host, используемый retry_call
+    """
+    circuit = CircuitBreaker("host", threshold, reset_timeout, clock)
+    retry.BREAKERS["host"] = circuit
+    return circuit
+
+
+def failing(*errors, result="ok"):
+    """
+    :param errors: Исключения, которые бросят первые вызовы
+    :return: Корутина-функция и список ее вызовов
+    """
+    calls = []
+
+    async def call():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return call, calls
+
+
+def test_delay_is_jittered_and_respects_retry_after():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+    rng = random.Random(0)
+    for attempt in range(6):
+        backoff = min(8.0, 2 ** attempt)
+        assert backoff / 2 <= policy.delay(attempt, rng=rng) <= backoff
+    assert policy.delay(0, retry_after=30, rng=rng) >= 30
+
+
+def test_retry_call_retries_throttled_until_success():
+    call, calls = failing(Throttled(0), Unavailable())
+    throttled, unavailable = [], []
+
+    result = asyncio.run(retry_call(call, "host", FAST,
+                                    on_throttled=throttled.append,
+                                    on_unavailable=unavailable.append))
+
+    assert result == "ok"
+    assert len(calls) == 3
+    assert len(throttled) == 1
+    assert len(unavailable) == 1
+    assert REGISTRY.value("retries_total", stage="host") == 2
+
+
+def test_retry_call_gives_up_after_all_attempts():
+    call, calls = failing(*[Throttled(0)] * FAST.attempts)
+
+    with pytest.raises(RetriesExhausted):
+        asyncio.run(retry_call(call, "host", FAST))
+    assert len(calls) == FAST.attempts
+
+
+def test_retry_call_does_not_retry_other_errors():
+    call, calls = failing(ValueError("bad instrument"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_call(call, "host", FAST))
+    assert len(calls) == 1
+
+
+def test_breaker_opens_after_consecutive_outages():
+    clock = Clock()
+    circuit = install(clock)
+    # Отказы по лимиту выключатель не учитывают
+    call, _ = failing(Throttled(0), Unavailable(), Unavailable())
+
+    with pytest.raises(RetriesExhausted):
+        asyncio.run(retry_call(call, "host", FAST))
+    assert circuit.state == "open"
+
+    call, calls = failing()
+    with pytest.raises(CircuitOpen):
+        asyncio.run(retry_call(call, "host", FAST))
+    assert calls == []
+    assert REGISTRY.value("circuit_rejected_total", host="host") == 1
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    clock = Clock()
+    circuit = install(clock, threshold=1)
+    circuit.failure()
+    clock.now = 10.0
+    assert circuit.state == "half_open"
+
+    probes = []
+
+    async def probe():
+        probes.append(None)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def request():
+        try:
+            return await retry_call(probe, "host", FAST)
+        except CircuitOpen:
+            return "rejected"
+
+    async def run():
+        return await asyncio.gather(*[request() for _ in range(5)])
+
+    results = asyncio.run(run())
+
+    assert len(probes) == 1
+    assert sorted(results) == ["ok"] + ["rejected"] * 4
+    assert circuit.state == "closed"
+
+
+def test_failed_probe_reopens_breaker():
+    clock = Clock()
+    circuit = install(clock, threshold=1)
+    circuit.failure()
+    clock.now = 10.0
+
+    assert circuit.check() is True
+    with pytest.raises(CircuitOpen):
+        circuit.check()
+    circuit.failure()
+
+    assert circuit.state == "open"
+    clock.now = 20.0
+    assert circuit.check() is True
+
+
+def test_throttled_probe_is_released():
+    clock = Clock()
+    circuit = install(clock, threshold=1)
+    circuit.failure()
+    clock.now = 10.0
+    call, calls = failing(Throttled(0))
+
+    # Отказ по лимиту не говорит о доступности хоста: та же проба
+    # повторяется и замыкает выключатель
+    assert asyncio.run(retry_call(call, "host", FAST)) == "ok"
+    assert len(calls) == 2
+    assert circuit.state == "closed"
+
+
+def test_outage_is_not_counted_as_throttling():
+    bucket = TokenBucket(1000)
+    stats = FetchStats()
+    call, calls = failing(Unavailable(), Throttled(0, rate=50))
+
+    async def fetch(key):
+        return await call()
+
+    async def run():
+        return [item async for item in fetch_all(
+            ["key"], fetch, bucket, stats=stats, policy=FAST)]
+
+    assert asyncio.run(run()) == [("key", "ok")]
+    assert stats.unavailable == 1
+    assert stats.throttled == 1
+    # Частоту меняет только отказ по лимиту
+    assert bucket.rate == 50
+
+
+def test_outage_keeps_bucket_rate():
+    bucket = TokenBucket(1000)
+    stats = FetchStats()
+    call, _ = failing(Unavailable())
+
+    async def fetch(key):
+        return await call()
+
+    async def run():
+        return [item async for item in fetch_all(
+            ["key"], fetch, bucket, stats=stats, policy=FAST)]
+
+    asyncio.run(run())
+
+    assert stats.throttled == 0
+    assert stats.unavailable == 1
+    assert bucket.rate == 1000
@@ -0,0 +1,126 @@
+# Векторизованный рейтинг против прежнего расчета по одному активу
+import numpy as np
+import pandas as pd
+
+from scoring import score_crypto, score_stocks
+
+
+def candles_frame(candles):
+    """
+    :param candles: Словарь актив -> список пар (цена закрытия, объем)
+    :return: Таблица свечей длинного формата с перемешанными строками,
+        как ее мог бы собрать не candle_table
+    """
+    rows = [(asset, day, close, volume)
+            for asset, bars in candles.items()
+            for day, (close, volume) in enumerate(bars)]
+    frame = pd.DataFrame(rows, columns=["asset", "ts", "close", "volume"])
+    frame['asset'] = pd.Categorical(frame['asset'], categories=list(candles))
+    return frame.sample(frac=1, random_state=0)
+
+
+def stock_reference(bars, issue_size, nominal):
+    """
+    Прежний расчет метрик и рейтинга одной акции
+    """
+    prices = np.array([close for close, _ in bars])
+    if len(prices):
+        last_price = prices[-1]
+        returns = (last_price - prices[0]) / prices[0] * 100
+        liquidity = np.mean([volume for _, volume in bars])
+    else:
+        last_price = returns = liquidity = 0
+    eps = last_price * issue_size * 0.1 / issue_size if issue_size else None
+    pe = last_price / eps if eps else None
+    pb = last_price / nominal if issue_size and nominal else None
+
+    pe_score = 1 if pe and pe < 15 else 0.25 if pe and pe < 25 else 0
+    pb_score = 1 if pb and pb < 1.5 else 0.5 if pb and pb < 3 else 0
+    rating = (0.4 * pe_score + 0.3 * pb_score +
+              0.2 * np.clip(returns / 10, 0, 1) +
+              0.1 * np.clip(liquidity / 1_000_000, 0, 1))
+    return [np.nan if pe is None else pe, np.nan if pb is None else pb,
+            returns, liquidity, rating]
+
+
+def crypto_reference(bars, price, liquidity, transaction_volume, supply):
+    """
+    Прежний расчет метрик и рейтинга одной криптовалютной пары
+    """
+    close = pd.Series([close for close, _ in bars], dtype=np.float64)
+    pct_change = close.pct_change()
+    max_volatility = (pct_change.abs() * 100).max()
+    if not close.empty:
+        returns = (close.iloc[-1] - close.iloc[0]) / close.iloc[0] * 100
+        volatility = pct_change.std() * 100
+    else:
+        returns = volatility = 0
+
+    if transaction_volume > 0:
+        nvt_score = 1 / (price * supply / transaction_volume + 1)
+    else:
+        nvt_score = 0
+    pv_score = 1 / (price / liquidity + 1) if liquidity > 0 else 0
+    if pd.notna(max_volatility) and max_volatility:
+        volatility_score = 1 - min(volatility / max_volatility, 1)
+    else:
+        volatility_score = 0
+    rating = (0.3 * nvt_score + 0.2 * pv_score +
+              0.3 * np.clip(returns / 10, 0, 1) +
+              0.1 * np.clip(liquidity / 1_000_000, 0, 1) +
+              0.1 * volatility_score)
+    return [returns, volatility, liquidity, rating]
+
+
+def test_stock_scores_match_per_asset_calculation():
+    candles = {
+        "FIGI1": [(100, 2e6), (104, 1e6), (101, 3e6), (112, 2e6)],
+        "FIGI2": [(50, 1e5), (49, 2e5), (48, 1e5)],
+        "FIGI3": [(7.5, 4e5)],
+        "FIGI4": [],
+    }
+    shares = pd.DataFrame({
+        "figi": list(candles),
+        "ticker": ["AAA", "BBB", "CCC", "DDD"],
+        "issue_size": [1e6, 2e6, 0, 1e6],
+        "nominal": [100, 20, 1, 0],
+    })
+
+    scored = score_stocks(candles_frame(candles), shares)
+
+    expected = [stock_reference(bars, issue_size, nominal)
+                for bars, issue_size, nominal in zip(
+                    candles.values(), shares['issue_size'],
+                    shares['nominal'])]
+    np.testing.assert_allclose(
+        scored[["pe", "pb", "returns", "liquidity", "rating"]].to_numpy(),
+        expected, equal_nan=True)
+    assert scored['ticker'].tolist() == ["AAA", "BBB", "CCC", "DDD"]
+
+
+def test_crypto_scores_match_per_asset_calculation():
+    candles = {
+        "BTC-USDT": [(60000, 10), (61500, 12), (59000, 9), (64000, 14)],
+        "ETH-USDT": [(3000, 100), (2900, 90), (3100, 120)],
+        "FLAT-USDT": [(1, 5), (1, 5), (1, 5)],
+        "NEW-USDT": [(0.5, 1000)],
+        "DEAD-USDT": [],
+    }
+    tickers = pd.DataFrame({
+        "instId": list(candles),
+        "last": [64000, 3100, 1, 0.5, 0.1],
+        "vol24h": [2e9, 5e8, 0, 3e5, 1e3],
+        "transaction_volume_usd": [1e10, 0, 1e6, 1e5, 0],
+        "circulating_supply": [19e6, 12e7, 1e9, 1e8, 1e6],
+    })
+
+    scored = score_crypto(candles_frame(candles), tickers)
+
+    expected = [crypto_reference(bars, *row)
+                for bars, row in zip(candles.values(), tickers[
+                    ["last", "vol24h", "transaction_volume_usd",
+                     "circulating_supply"]].itertuples(index=False))]
+    np.testing.assert_allclose(
+        scored[["returns", "volatility", "liquidity", "rating"]].to_numpy(),
+        expected, equal_nan=True)
+    assert scored['symbol'].tolist() == list(candles)
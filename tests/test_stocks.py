@@ -0,0 +1,138 @@
+# Загрузка свечей акций на локальной заглушке сервиса свечей
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from fetcher import FetchStats
+from ratelimit import Throttled, TokenBucket
+from stocks import (CANDLES_RATE, TinkoffProvider, fetch_stock_candles,
+                    parse_ratelimit)
+
+FIGIS = [f"FIGI{i}" for i in range(10)]
+TODAY = int(datetime.now(timezone.utc).timestamp() * 1000) // DAY_MS * DAY_MS
+
+
+def history(days, price=100.0):
+    """
+    :param days: Число дневных свечей, последняя — сегодня
+    :param price: Начальная цена
+    :return: Массив свечей CANDLE_DTYPE
+    """
+    ts = TODAY - np.arange(days - 1, -1, -1) * DAY_MS
+    close = price + np.arange(days)
+    return np.array(list(zip(ts, close, close, close, close, [10] * days)),
+                    dtype=CANDLE_DTYPE)
+
+
+class FakeCandleService:
+    """
+    Провайдер свечей акций в памяти. Первый запрос по каждой акции
+    из throttled отклоняется по лимиту, как это делает Tinkoff
+    """
+
+    def __init__(self, candles, throttled=()):
+        self.candles_by_figi = candles
+        self.throttled = set(throttled)
+        self.starts = {}
+
+    async def candles(self, figi, start=None):
+        if figi in self.throttled:
+            self.throttled.discard(figi)
+            raise Throttled(0, rate=100)
+        self.starts[figi] = start
+        candles = self.candles_by_figi[figi]
+        return candles if start is None else candles[candles['ts'] >= start]
+
+
+async def fetch(provider, store, stats=None):
+    shares = [{"figi": figi} for figi in FIGIS]
+    return [share["figi"] async for share in fetch_stock_candles(
+        provider, shares, store, days=30, rate=1000, concurrency=4,
+        stats=stats)]
+
+
+def test_fetch_stock_candles_retries_throttled_requests(tmp_path):
+    candles = {figi: history(20, 10 * i) for i, figi in enumerate(FIGIS)}
+    service = FakeCandleService(candles, throttled=FIGIS[::3])
+    store = CandleStore(str(tmp_path))
+    stats = FetchStats()
+
+    fetched = asyncio.run(fetch(service, store, stats))
+
+    assert sorted(fetched) == FIGIS
+    assert stats.throttled == len(FIGIS[::3])
+    assert stats.failed == 0
+    for figi in FIGIS:
+        np.testing.assert_array_equal(store.load(figi), candles[figi])
+
+
+def test_fetch_stock_candles_requests_only_new_candles(tmp_path):
+    store = CandleStore(str(tmp_path))
+    asyncio.run(fetch(FakeCandleService(
+        {figi: history(20)[:-1] for figi in FIGIS}), store))
+
+    # Появилась новая свеча: запрашивается только хвост начиная
+    # с последней сохраненной свечи
+    service = FakeCandleService({figi: history(20) for figi in FIGIS})
+    asyncio.run(fetch(service, store))
+
+    for figi in FIGIS:
+        assert service.starts[figi] == TODAY - DAY_MS
+        np.testing.assert_array_equal(store.load(figi), history(20))
+
+
+def test_throttling_never_raises_configured_rate():
+    # Лимит из заголовка 429 выше настроенной частоты запросов
+    limit = parse_ratelimit("600, 600;w=60")
+    assert limit == 10 > CANDLES_RATE
+    bucket = TokenBucket(CANDLES_RATE)
+
+    bucket.throttle(limit)
+    assert bucket.rate == CANDLES_RATE
+
+    bucket.throttle(2)
+    assert bucket.rate == 2
+
+
+def test_tinkoff_provider_against_fake_market_data(tmp_path):
+    invest = pytest.importorskip("tinkoff.invest")
+    from grpc import StatusCode
+
+    def money(value):
+        return SimpleNamespace(units=int(value), nano=0)
+
+    class FakeMarketData:
+        """
+        Заглушка client.market_data: сначала отказ по лимиту
+        с метаданными Tinkoff, затем свечи
+        """
+
+        def __init__(self):
+            self.requests = 0
+
+        async def get_candles(self, figi, from_, to, interval):
+            self.requests += 1
+            if self.requests == 1:
+                raise invest.RequestError(
+                    StatusCode.RESOURCE_EXHAUSTED, "limit",
+                    SimpleNamespace(ratelimit_reset=0,
+                                    ratelimit_limit="600, 600;w=60"))
+            return SimpleNamespace(candles=[SimpleNamespace(
+                time=datetime.fromtimestamp(TODAY / 1000, timezone.utc),
+                open=money(1), high=money(3), low=money(1), close=money(2),
+                volume=5)])
+
+    provider = TinkoffProvider("token")
+    provider.client = SimpleNamespace(market_data=FakeMarketData())
+    store = CandleStore(str(tmp_path))
+    stats = FetchStats()
+
+    fetched = asyncio.run(fetch(provider, store, stats))
+
+    assert sorted(fetched) == FIGIS
+    assert stats.throttled == 1
+    assert store.load(FIGIS[0])['close'].tolist() == [2.0]
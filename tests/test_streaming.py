@@ -0,0 +1,93 @@
+# Пересчет рейтингов по тикам: отбор лучших на месте
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from candle_store import CANDLE_DTYPE, DAY_MS, CandleStore
+from crypto import PAIR_COLUMNS
+from metrics import metrics_from_frame
+from portfolio import select_assets
+from scoring import score_universe
+from stocks import shares_table
+from streaming import StreamingRatings, Tick
+
+STOCKS = 30
+PAIRS = 40
+DAYS = 60
+TOP_N = 5
+
+
+@pytest.fixture
+def market(tmp_path):
+    """
+    Хранилище с дневными свечами по сегодняшний день и справочники
+    инструментов. Объемы разного порядка, чтобы часть активов
+    не проходила фильтр ликвидности
+    """
+    rng = np.random.default_rng(0)
+    store = CandleStore(str(tmp_path))
+    today = int(time.time() * 1000) // DAY_MS
+    ts = (today - np.arange(DAYS - 1, -1, -1)) * DAY_MS
+    keys = ([f"FIGI{i}" for i in range(STOCKS)] +
+            [f"C{i}-USDT" for i in range(PAIRS)])
+    last = {}
+    for key in keys:
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.03, DAYS)))
+        volume = rng.lognormal(np.log(rng.choice([1e3, 1e5])), 0.5, DAYS)
+        store.append(key, "1D", np.array(
+            list(zip(ts, close, close * 1.01, close * 0.99, close, volume)),
+            dtype=CANDLE_DTYPE))
+        last[key] = close[-1]
+
+    shares = shares_table([
+        {"figi": f"FIGI{i}", "ticker": f"S{i}",
+         "issue_size": int(rng.integers(1e6, 1e9)),
+         "nominal": float(rng.uniform(0.1, 10))}
+        for i in range(STOCKS)])
+    pairs = pd.DataFrame([
+        {"instId": f"C{i}-USDT", "last": last[f"C{i}-USDT"],
+         "vol24h": float(rng.uniform(1e3, 1e6)),
+         "transaction_volume_usd": float(rng.uniform(1e6, 1e9)),
+         "circulating_supply": float(rng.uniform(1e6, 1e9))}
+        for i in range(PAIRS)], columns=PAIR_COLUMNS)
+    return store, shares, pairs
+
+
+def test_initial_ratings_match_scoring(market):
+    store, shares, pairs = market
+
+    ratings = StreamingRatings(store, shares, pairs, n=TOP_N)
+    expected = metrics_from_frame(score_universe(store, shares, pairs))
+
+    np.testing.assert_array_equal(ratings.metrics.asset, expected.asset)
+    np.testing.assert_allclose(ratings.metrics.rating, expected.rating,
+                               rtol=1e-6)
+    np.testing.assert_array_equal(
+        ratings.top, select_assets(expected, TOP_N))
+
+
+def test_incremental_top_matches_full_selection(market):
+    store, shares, pairs = market
+    ratings = StreamingRatings(store, shares, pairs, n=TOP_N)
+    keys, prices, volumes = ratings.last_prices()
+    prices, volumes = prices.copy(), volumes.copy()
+    rng = np.random.default_rng(1)
+    now = int(time.time() * 1000)
+
+    changes = 0
+    for _ in range(300):
+        chosen = rng.integers(0, len(keys), int(rng.integers(1, 8)))
+        # Крупные скачки цен и объемов меняют состав лучших
+        prices[chosen] *= np.exp(rng.normal(0, 0.2, len(chosen)))
+        volumes[chosen] *= np.exp(rng.normal(0, 1.0, len(chosen)))
+        for i in chosen.tolist():
+            ratings.apply(Tick(keys[i], now, float(prices[i]),
+                               float(volumes[i])))
+        changes += ratings.refresh()
+
+        np.testing.assert_array_equal(
+            ratings.top, select_assets(ratings.metrics, TOP_N))
+
+    assert changes > 0